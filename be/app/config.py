@@ -23,13 +23,78 @@ ALIGNER_MODEL = os.environ.get(
 )
 ALIGNER_BATCH_SIZE = int(os.environ.get("LINGTRAIN_ALIGNER_BATCH_SIZE", "200"))
 ALIGNER_WINDOW = int(os.environ.get("LINGTRAIN_ALIGNER_WINDOW", "50"))
-ALIGNER_PROCESSORS = int(os.environ.get("LINGTRAIN_ALIGNER_PROCESSORS", "1"))
+# worker processes and compute threads per worker, numbers or "auto"
+ALIGNER_PROCESSORS = os.environ.get("LINGTRAIN_ALIGNER_PROCESSORS", "1")
+ALIGNER_WORKER_THREADS = os.environ.get("LINGTRAIN_ALIGNER_WORKER_THREADS", "auto")
+ALIGNER_PIN_WORKERS = (
+    os.environ.get("LINGTRAIN_ALIGNER_PIN_WORKERS", "true").lower() == "true"
+)
+# memory one worker needs for its model copy, bounds the "auto" worker count
+ALIGNER_WORKER_MEMORY_MB = int(
+    os.environ.get("LINGTRAIN_ALIGNER_WORKER_MEMORY_MB", "2048")
+)
 ALIGNER_EMBED_BATCH_SIZE = int(
     os.environ.get("LINGTRAIN_ALIGNER_EMBED_BATCH_SIZE", "5")
 )
+# padded tokens per embedding batch, 0 tunes it when a worker starts,
+# -1 batches by ALIGNER_EMBED_BATCH_SIZE lines
+ALIGNER_EMBED_TOKEN_BUDGET = int(
+    os.environ.get("LINGTRAIN_ALIGNER_EMBED_TOKEN_BUDGET", "0")
+)
 ALIGNER_NORMALIZE_EMBEDDINGS = (
     os.environ.get("LINGTRAIN_ALIGNER_NORMALIZE_EMBEDDINGS", "true").lower() == "true"
 )
+# "torch" runs the float model, "torch-int8" a dynamically quantized copy
+ALIGNER_BACKEND = os.environ.get("LINGTRAIN_ALIGNER_BACKEND", "torch")
+ALIGNER_BACKEND_CACHE_DIR = os.environ.get(
+    "LINGTRAIN_ALIGNER_BACKEND_CACHE_DIR", os.path.join(DATA_DIR, "models_int8")
+)
+ALIGNER_BACKEND_MIN_COSINE = float(
+    os.environ.get("LINGTRAIN_ALIGNER_BACKEND_MIN_COSINE", "0.98")
+)
+ALIGNER_EMBED_CACHE_DIR = os.environ.get(
+    "LINGTRAIN_ALIGNER_EMBED_CACHE_DIR", os.path.join(DATA_DIR, "embedding_cache")
+)
+ALIGNER_EMBED_CACHE_SIZE_MB = int(
+    os.environ.get("LINGTRAIN_ALIGNER_EMBED_CACHE_SIZE_MB", "1024")
+)
 ALIGNER_MAX_BATCHES = int(os.environ.get("LINGTRAIN_ALIGNER_MAX_BATCHES", "2000"))
+ALIGNER_SCHEDULER_SLOTS = int(os.environ.get("LINGTRAIN_ALIGNER_SCHEDULER_SLOTS", "0"))
+ALIGNER_SCHEDULER_USER_JOBS = int(
+    os.environ.get("LINGTRAIN_ALIGNER_SCHEDULER_USER_JOBS", "2")
+)
+ALIGNER_INCREMENTAL_COMMIT = (
+    os.environ.get("LINGTRAIN_ALIGNER_INCREMENTAL_COMMIT", "true").lower() == "true"
+)
+ALIGNER_PROGRESS_FLUSH_BATCHES = int(
+    os.environ.get("LINGTRAIN_ALIGNER_PROGRESS_FLUSH_BATCHES", "10")
+)
+ALIGNER_PROGRESS_FLUSH_SECONDS = float(
+    os.environ.get("LINGTRAIN_ALIGNER_PROGRESS_FLUSH_SECONDS", "2")
+)
+ALIGNER_PROGRESS_HEARTBEAT_SECONDS = 15
+ALIGNER_CONFLICT_CACHE_SIZE = int(
+    os.environ.get("LINGTRAIN_ALIGNER_CONFLICT_CACHE_SIZE", "64")
+)
+ALIGNER_DOC_INDEX_CACHE_SIZE = int(
+    os.environ.get("LINGTRAIN_ALIGNER_DOC_INDEX_CACHE_SIZE", "32")
+)
+ALIGNER_EDIT_JOURNAL_SIZE = int(
+    os.environ.get("LINGTRAIN_ALIGNER_EDIT_JOURNAL_SIZE", "200")
+)
+ALIGNER_DB_POOL_SIZE = int(os.environ.get("LINGTRAIN_ALIGNER_DB_POOL_SIZE", "4"))
+ALIGNER_DB_POOL_IDLE_SECONDS = float(
+    os.environ.get("LINGTRAIN_ALIGNER_DB_POOL_IDLE_SECONDS", "300")
+)
+ALIGNER_DB_POOL_MAX_DATABASES = int(
+    os.environ.get("LINGTRAIN_ALIGNER_DB_POOL_MAX_DATABASES", "64")
+)
+ALIGNER_DB_MMAP_MB = int(os.environ.get("LINGTRAIN_ALIGNER_DB_MMAP_MB", "256"))
+ALIGNER_DB_WAL = os.environ.get("LINGTRAIN_ALIGNER_DB_WAL", "true").lower() == "true"
+# how long an editor request waits for another edit before it gets a 409,
+# a running job refuses it at once
+ALIGNER_EDIT_LOCK_WAIT_SECONDS = float(
+    os.environ.get("LINGTRAIN_ALIGNER_EDIT_LOCK_WAIT_SECONDS", "2")
+)
 ALIGNER_MAX_BATCH_COUNT = 5
 ALIGNER_DEFAULT_BATCH_COUNT = 1
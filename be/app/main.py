@@ -8,7 +8,19 @@ from fastapi.staticfiles import StaticFiles
 from app.config import STATIC_DIR
 from app.database import Base, engine, SessionLocal
 from app.seed import add_test_users
-from app.routers import auth, users, documents, alignments, processing, marks, export
+from app.routers import (
+    admin,
+    auth,
+    users,
+    documents,
+    alignments,
+    processing,
+    marks,
+    export,
+)
+from app.services import alignment_db
+from app.services.processing_service import recover_jobs
+from app.services.worker_pool import pool
 
 
 @asynccontextmanager
@@ -19,7 +31,11 @@ async def lifespan(_app: FastAPI):
         add_test_users(db)
     finally:
         db.close()
+    pool.start()
+    recover_jobs()
     yield
+    pool.stop()
+    alignment_db.connections.close_all()
 
 
 app = FastAPI(title="Lingtrain API", lifespan=lifespan)
@@ -39,6 +55,7 @@ app.include_router(alignments.router)
 app.include_router(processing.router)
 app.include_router(marks.router)
 app.include_router(export.router)
+app.include_router(admin.router)
 
 # Serve static files (visualization images)
 static_path = Path(STATIC_DIR)
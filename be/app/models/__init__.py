@@ -3,6 +3,8 @@ from app.models.verification import EmailVerification
 from app.models.document import Document
 from app.models.alignment import Alignment, AlignmentState
 from app.models.alignment_progress import AlignmentProgress
+from app.models.alignment_job import AlignmentJob, AlignmentJobState
+from app.models.alignment_job_timing import AlignmentJobTiming
 
 __all__ = [
     "User",
@@ -11,4 +13,7 @@ __all__ = [
     "Alignment",
     "AlignmentState",
     "AlignmentProgress",
+    "AlignmentJob",
+    "AlignmentJobState",
+    "AlignmentJobTiming",
 ]
@@ -0,0 +1,44 @@
+import enum
+from datetime import datetime, timezone
+
+from sqlalchemy import JSON, DateTime, ForeignKey, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import Base
+
+
+class AlignmentJobState(enum.IntEnum):
+    QUEUED = 0
+    RUNNING = 1
+    DONE = 2
+    CANCELLED = 3
+    ERROR = 4
+
+
+class AlignmentJob(Base):
+    """Durable record of a background alignment job, used to resume it."""
+
+    __tablename__ = "alignment_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    alignment_id: Mapped[int] = mapped_column(
+        ForeignKey("alignments.id"), index=True
+    )
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    kind: Mapped[str] = mapped_column(String(20))
+    priority: Mapped[int] = mapped_column(Integer)
+    tasks: Mapped[int] = mapped_column(Integer, default=0)
+    params: Mapped[dict] = mapped_column(JSON, default=dict)
+    batch_ids: Mapped[list[int] | None] = mapped_column(JSON, nullable=True)
+    done_batch_ids: Mapped[list[int]] = mapped_column(JSON, default=list)
+    state: Mapped[int] = mapped_column(
+        Integer, default=AlignmentJobState.QUEUED, index=True
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, default=lambda: datetime.now(timezone.utc)
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime,
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
@@ -0,0 +1,19 @@
+from sqlalchemy import Float, ForeignKey, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.database import Base
+
+# batch_id of the stages that belong to the whole job
+JOB_STAGE = -1
+
+
+class AlignmentJobTiming(Base):
+    """Seconds one batch of a job spent in a pipeline stage."""
+
+    __tablename__ = "alignment_job_timings"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    job_id: Mapped[int] = mapped_column(ForeignKey("alignment_jobs.id"), index=True)
+    batch_id: Mapped[int] = mapped_column(Integer, default=JOB_STAGE)
+    stage: Mapped[str] = mapped_column(String(30))
+    seconds: Mapped[float] = mapped_column(Float)
@@ -0,0 +1,77 @@
+"""Admin router - alignment infrastructure status"""
+
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.dependencies import require_role
+from app.models.alignment_job import AlignmentJob
+from app.models.alignment_job_timing import AlignmentJobTiming
+from app.models.user import User
+from app.services import alignment_db
+from app.services.scheduler import scheduler
+from app.services.stage_timer import histograms, summarize
+from app.services.worker_pool import pool
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+
+@router.get("/workers")
+def get_worker_pool_status(
+    _: User = Depends(require_role("admin")),
+):
+    return pool.status()
+
+
+@router.get("/databases")
+def get_database_pool_status(
+    _: User = Depends(require_role("admin")),
+):
+    return alignment_db.connections.status()
+
+
+@router.get("/jobs")
+def get_scheduler_status(
+    _: User = Depends(require_role("admin")),
+):
+    return scheduler.status()
+
+
+@router.get("/jobs/{job_id}/timings")
+def get_job_timings(
+    job_id: int,
+    db: Session = Depends(get_db),
+    _: User = Depends(require_role("admin")),
+):
+    job = db.get(AlignmentJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    rows = (
+        db.query(AlignmentJobTiming)
+        .filter(AlignmentJobTiming.job_id == job_id)
+        .order_by(AlignmentJobTiming.id)
+        .all()
+    )
+    batches = {}
+    for row in rows:
+        batches.setdefault(row.batch_id, {})[row.stage] = row.seconds
+    return {
+        "job_id": job.id,
+        "alignment_id": job.alignment_id,
+        "kind": job.kind,
+        "state": job.state,
+        "stages": summarize((row.stage, row.seconds) for row in rows),
+        "batches": batches,
+    }
+
+
+@router.get("/stages")
+def get_stage_histograms(
+    _: User = Depends(require_role("admin")),
+):
+    return histograms.snapshot()
@@ -1,14 +1,18 @@
 """Alignments router - create, list, align, resolve, conflicts"""
 
+import asyncio
+import json
 import logging
-from threading import Thread
 
 from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from app.database import get_db
+from app import config
+from app.database import SessionLocal, get_db
 from app.dependencies import get_current_user
-from app.models.alignment import AlignmentState
+from app.models.alignment import Alignment, AlignmentState
 from app.models.user import User
 from app.schemas.alignment import (
     AlignmentCreate,
@@ -18,20 +22,29 @@ from app.schemas.alignment import (
     ResolveRequest,
 )
 from app.services import alignment_service, processing_service
+from app.services.alignment_lock import AlignmentBusy
 from app.services.document_service import get_document_by_guid
-from app.services.processing_service import AlignmentInfo
+from app.services.progress_bus import bus
+from app.services.scheduler import JobPriority, scheduler
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/aligner/alignments", tags=["alignments"])
 
 
+def _alignment_out(alignment) -> AlignmentOut:
+    """Alignment with its position in the job queue."""
+    return AlignmentOut.model_validate(alignment).model_copy(
+        update=scheduler.queue_info(alignment.guid)
+    )
+
+
 @router.get("/", response_model=list[AlignmentOut])
 def list_alignments(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    return alignment_service.list_alignments(db, user.id)
+    return [_alignment_out(a) for a in alignment_service.list_alignments(db, user.id)]
 
 
 @router.post("/", response_model=AlignmentOut, status_code=status.HTTP_201_CREATED)
@@ -83,16 +96,15 @@ def start_alignment(
         )
     alignment_service.update_state(db, alignment.id, AlignmentState.IN_PROGRESS)
 
-    info = AlignmentInfo.from_orm(alignment)
-    # Run in background thread to not block the response
-    thread = Thread(
-        target=processing_service.start_alignment,
-        args=(user.id, info, data),
-        daemon=True,
+    if data.align_all:
+        priority, tasks = JobPriority.BULK, alignment.total_batches
+    else:
+        priority, tasks = JobPriority.NORMAL, len(data.batch_ids)
+    processing_service.submit_job(
+        db, user.id, alignment, "align", priority, tasks, data
     )
-    thread.start()
 
-    return {"status": "started"}
+    return {"status": "started", **scheduler.queue_info(alignment.guid)}
 
 
 @router.post("/{guid}/align/next")
@@ -108,15 +120,17 @@ def align_next(
 
     alignment_service.update_state(db, alignment.id, AlignmentState.IN_PROGRESS)
 
-    info = AlignmentInfo.from_orm(alignment)
-    thread = Thread(
-        target=processing_service.align_next,
-        args=(user.id, info, data),
-        daemon=True,
+    processing_service.submit_job(
+        db,
+        user.id,
+        alignment,
+        "align_next",
+        JobPriority.INTERACTIVE,
+        data.amount,
+        data,
     )
-    thread.start()
 
-    return {"status": "started"}
+    return {"status": "started", **scheduler.queue_info(alignment.guid)}
 
 
 @router.post("/{guid}/align/stop")
@@ -146,15 +160,17 @@ def resolve_conflicts(
 
     alignment_service.update_state(db, alignment.id, AlignmentState.IN_PROGRESS)
 
-    info = AlignmentInfo.from_orm(alignment)
-    thread = Thread(
-        target=processing_service.resolve_conflicts,
-        args=(user.id, info, data),
-        daemon=True,
+    processing_service.submit_job(
+        db,
+        user.id,
+        alignment,
+        "resolve",
+        JobPriority.NORMAL,
+        len(data.batch_ids),
+        data,
     )
-    thread.start()
 
-    return {"status": "started"}
+    return {"status": "started", **scheduler.queue_info(alignment.guid)}
 
 
 @router.get("/{guid}/conflicts")
@@ -220,7 +236,12 @@ async def upload_proxy(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
 
     content = (await file.read()).decode("utf-8")
-    alignment_service.upload_proxy(user.id, alignment, direction, content)
+    try:
+        await run_in_threadpool(
+            alignment_service.upload_proxy, user.id, alignment, direction, content
+        )
+    except AlignmentBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     return alignment_service.update_proxy_loaded(db, alignment.id, direction)
 
 
@@ -235,4 +256,58 @@ def get_progress(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
 
     db.refresh(alignment)
-    return alignment
+    return _alignment_out(alignment)
+
+
+def _progress_snapshot(alignment_id: int) -> dict | None:
+    db = SessionLocal()
+    try:
+        alignment = db.get(Alignment, alignment_id)
+        if not alignment:
+            return None
+        return _alignment_out(alignment).model_dump(mode="json")
+    finally:
+        db.close()
+
+
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+
+@router.get("/{guid}/progress/stream")
+def stream_progress(
+    guid: str,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    """Server-sent events with the alignment progress, replaces polling."""
+    alignment = alignment_service.get_alignment(db, user.id, guid)
+    if not alignment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
+    alignment_id = alignment.id
+
+    async def events():
+        sub = bus.subscribe(guid)
+        try:
+            # subscribed first, so no update between snapshot and stream is lost
+            snapshot = await run_in_threadpool(_progress_snapshot, alignment_id)
+            if snapshot is None:
+                return
+            yield _sse(snapshot)
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        sub.queue.get(), config.ALIGNER_PROGRESS_HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield _sse({**event, **scheduler.queue_info(guid)})
+        finally:
+            bus.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -8,8 +8,15 @@ from sqlalchemy.orm import Session
 from app.database import get_db
 from app.dependencies import get_current_user
 from app.models.user import User
-from app.schemas.alignment import EditRequest, SplitRequest
+from app.schemas.alignment import (
+    EditBatchRequest,
+    EditRequest,
+    MergeRequest,
+    SplitRequest,
+)
 from app.services import alignment_service, editor_service
+from app.services.alignment_lock import AlignmentBusy
+from app.services.edit_journal import JournalConflict
 
 logger = logging.getLogger(__name__)
 
@@ -77,10 +84,79 @@ def edit_processing(
     alignment = alignment_service.get_alignment(db, user.id, guid)
     if not alignment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
-    editor_service.edit_doc(user.id, alignment, data)
+    try:
+        editor_service.edit_doc(user.id, alignment, data)
+    except AlignmentBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     return {"status": "ok"}
 
 
+@router.post("/{guid}/edit/batch")
+def edit_processing_batch(
+    guid: str,
+    data: EditBatchRequest,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    alignment = alignment_service.get_alignment(db, user.id, guid)
+    if not alignment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
+    try:
+        editor_service.edit_doc_batch(user.id, alignment, data.operations)
+    except editor_service.EditError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Edit {e.position} ({data.operations[e.position].operation}) failed: {e}",
+        )
+    except AlignmentBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return {"status": "ok", "applied": len(data.operations)}
+
+
+@router.post("/{guid}/undo")
+def undo_edit(
+    guid: str,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    alignment = alignment_service.get_alignment(db, user.id, guid)
+    if not alignment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
+    try:
+        res = editor_service.undo_edit(user.id, alignment)
+    except JournalConflict:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Edit history is out of date"
+        )
+    except AlignmentBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if res is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Nothing to undo")
+    return {"status": "ok", **res}
+
+
+@router.post("/{guid}/redo")
+def redo_edit(
+    guid: str,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    alignment = alignment_service.get_alignment(db, user.id, guid)
+    if not alignment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
+    try:
+        res = editor_service.redo_edit(user.id, alignment)
+    except JournalConflict:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Edit history is out of date"
+        )
+    except AlignmentBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if res is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Nothing to redo")
+    return {"status": "ok", **res}
+
+
 @router.post("/{guid}/split")
 def split_sentence(
     guid: str,
@@ -97,7 +173,37 @@ def split_sentence(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid direction"
         )
 
-    editor_service.split_sentence(user.id, alignment, data)
+    try:
+        done = editor_service.split_sentence(user.id, alignment, data)
+    except AlignmentBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if not done:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Line not found")
+    return {"status": "ok"}
+
+
+@router.post("/{guid}/merge")
+def merge_sentences(
+    guid: str,
+    data: MergeRequest,
+    db: Session = Depends(get_db),
+    user: User = Depends(get_current_user),
+):
+    alignment = alignment_service.get_alignment(db, user.id, guid)
+    if not alignment:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
+
+    if data.direction not in ("from", "to"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid direction"
+        )
+
+    try:
+        done = editor_service.merge_sentences(user.id, alignment, data)
+    except AlignmentBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if not done:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Line not found")
     return {"status": "ok"}
 
 
@@ -139,7 +245,10 @@ def switch_excluded(
     if not alignment:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
 
-    editor_service.switch_excluded(user.id, alignment, line_id, text_type)
+    try:
+        editor_service.switch_excluded(user.id, alignment, line_id, text_type)
+    except AlignmentBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     return {"status": "ok"}
 
 
@@ -182,4 +291,10 @@ def get_line_position(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Alignment not found")
 
     pos = editor_service.get_line_position(user.id, alignment, lang, line_id)
-    return {"pos": pos}
+    if pos is None:
+        return {"pos": -1}
+    return {
+        "pos": pos.position,
+        "batch_id": pos.batch_id,
+        "batch_index_id": pos.batch_index_id,
+    }
@@ -19,6 +19,8 @@ class AlignmentOut(BaseModel):
     document_from_id: int
     document_to_id: int
     created_at: datetime
+    queue_position: int | None = None
+    eta_seconds: float | None = None
 
     model_config = {"from_attributes": True}
 
@@ -68,6 +70,10 @@ class EditRequest(BaseModel):
     line_id_to: int = -1
 
 
+class EditBatchRequest(BaseModel):
+    operations: list[EditRequest] = Field(min_length=1, max_length=200)
+
+
 class SplitRequest(BaseModel):
     direction: str
     line_id: int
@@ -75,6 +81,12 @@ class SplitRequest(BaseModel):
     part2: str
 
 
+class MergeRequest(BaseModel):
+    direction: str
+    line_id: int
+    text: str | None = None
+
+
 class MarkAdd(BaseModel):
     type: str
     val_from: str
@@ -0,0 +1,172 @@
+"""Alignment DB - pooled and tuned connections to the per-alignment databases"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT_SECONDS = 30
+CACHED_STATEMENTS = 256
+
+
+class _DbConnections:
+    def __init__(self):
+        self.idle: list[tuple[sqlite3.Connection, float]] = []
+        self.wal_checked = False
+
+
+class ConnectionPool:
+    """Idle connections per alignment DB, shared by the service modules.
+
+    A connection is opened with ``synchronous=NORMAL``, a memory map of
+    the DB file and a statement cache. The WAL journal is switched on once
+    per DB, it is stored in the file and used by every later connection,
+    lingtrain_aligner's too. At most ``size`` idle connections are kept per
+    DB and ``max_databases`` DBs, connections idle for ``idle_seconds`` are
+    closed. A connection moves between request threads, but is used by one
+    thread at a time.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        idle_seconds: float,
+        max_databases: int,
+        mmap_bytes: int = 0,
+        wal: bool = True,
+    ):
+        self.size = max(0, size)
+        self.idle_seconds = idle_seconds
+        self.max_databases = max(1, max_databases)
+        self.mmap_bytes = mmap_bytes
+        self.wal = wal
+        self._dbs: OrderedDict[str, _DbConnections] = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._inherited = []
+        self._last_sweep = time.monotonic()
+
+    @contextmanager
+    def connect(self, db_path: str):
+        """Connection to the DB, committed on success like ``with sqlite3.connect()``."""
+        db_path = str(db_path)
+        db = self._acquire(db_path)
+        try:
+            with db:
+                yield db
+        finally:
+            self._release(db_path, db)
+
+    @contextmanager
+    def snapshot(self, db_path: str):
+        """Connection in a read transaction, all its reads see one commit."""
+        with self.connect(db_path) as db:
+            db.execute("begin")
+            yield db
+
+    def checkpoint(self, db_path: str) -> None:
+        """Move the WAL into the DB file, before the file is copied."""
+        with self.connect(db_path) as db:
+            db.execute("pragma wal_checkpoint(truncate)")
+
+    def close_all(self) -> None:
+        with self._lock:
+            dbs = list(self._dbs.values())
+            self._dbs.clear()
+        for conns in dbs:
+            for db, _ in conns.idle:
+                db.close()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "databases": len(self._dbs),
+                "idle": sum(len(x.idle) for x in self._dbs.values()),
+            }
+
+    def _acquire(self, db_path: str) -> sqlite3.Connection:
+        with self._lock:
+            if self._pid != os.getpid():
+                # connections of the parent must not be used or closed here,
+                # closing one may checkpoint and drop the WAL under the parent
+                self._inherited.append(self._dbs)
+                self._dbs = OrderedDict()
+                self._pid = os.getpid()
+            conns = self._dbs.get(db_path)
+            if conns is None:
+                conns = self._dbs[db_path] = _DbConnections()
+            self._dbs.move_to_end(db_path)
+            if conns.idle:
+                return conns.idle.pop()[0]
+            set_wal = self.wal and not conns.wal_checked
+            conns.wal_checked = True
+        return self._open(db_path, set_wal)
+
+    def _release(self, db_path: str, db: sqlite3.Connection) -> None:
+        if db.in_transaction:
+            db.rollback()
+        now = time.monotonic()
+        to_close = []
+        with self._lock:
+            conns = self._dbs.get(db_path)
+            if conns is not None and len(conns.idle) < self.size:
+                conns.idle.append((db, now))
+            else:
+                to_close.append(db)
+            to_close.extend(self._evict(now))
+        for x in to_close:
+            x.close()
+
+    def _evict(self, now: float) -> list:
+        evicted = []
+        while len(self._dbs) > self.max_databases:
+            _, conns = self._dbs.popitem(last=False)
+            evicted.extend(db for db, _ in conns.idle)
+        if now - self._last_sweep < self.idle_seconds / 2:
+            return evicted
+        self._last_sweep = now
+        for conns in self._dbs.values():
+            evicted.extend(db for db, used in conns.idle if now - used > self.idle_seconds)
+            conns.idle = [x for x in conns.idle if now - x[1] <= self.idle_seconds]
+        return evicted
+
+    def _open(self, db_path: str, set_wal: bool) -> sqlite3.Connection:
+        db = sqlite3.connect(
+            db_path,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        if set_wal:
+            try:
+                db.execute("pragma journal_mode=wal")
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Can not switch {db_path} to WAL: {e}")
+        db.execute("pragma synchronous=normal")
+        if self.mmap_bytes:
+            db.execute(f"pragma mmap_size={int(self.mmap_bytes)}")
+        return db
+
+
+connections = ConnectionPool(
+    config.ALIGNER_DB_POOL_SIZE,
+    config.ALIGNER_DB_POOL_IDLE_SECONDS,
+    config.ALIGNER_DB_POOL_MAX_DATABASES,
+    mmap_bytes=config.ALIGNER_DB_MMAP_MB * 1024 * 1024,
+    wal=config.ALIGNER_DB_WAL,
+)
+
+
+def connect(db_path: str):
+    return connections.connect(db_path)
+
+
+def snapshot(db_path: str):
+    return connections.snapshot(db_path)
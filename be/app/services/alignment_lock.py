@@ -0,0 +1,161 @@
+"""Alignment lock - one structural writer at a time per alignment DB"""
+
+import fcntl
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 0.05
+# editor requests hold the lock under names starting with this, jobs do not
+EDITOR_HOLDER = "editor"
+
+
+class AlignmentBusy(Exception):
+    """The alignment is written by someone else, ``holder`` says by whom."""
+
+    def __init__(self, holder: str):
+        super().__init__(f"Alignment is busy: {holder}")
+        self.holder = holder
+
+
+def lock_path(db_path: str) -> str:
+    return f"{os.path.splitext(str(db_path))[0]}.lock"
+
+
+class AlignmentLock:
+    """Writer lock of one alignment DB, across threads and processes.
+
+    Jobs hold it for their whole run, so an edit can not land between a
+    job's read of the index and its write. Readers never take it, they read
+    in one transaction and see the last commit. A thread lock orders the
+    threads of the process and a ``flock`` on the lock file next to the DB
+    the processes. The holder is written to the file for busy reports.
+    """
+
+    def __init__(self, db_path: str):
+        self.path = lock_path(db_path)
+        self.holder: str | None = None
+        self._lock = threading.Lock()
+        self._fd: int | None = None
+
+    def acquire(self, holder: str, timeout: float | None = None, cancelled=None) -> bool:
+        """Wait up to ``timeout`` seconds, forever if None, or until
+        ``cancelled()`` is true. Returns whether the lock was taken."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not _wait(lambda: self._lock.acquire(timeout=POLL_SECONDS), deadline, cancelled):
+            return False
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            self._lock.release()
+            raise
+        if not _wait(lambda: _try_flock(fd), deadline, cancelled, POLL_SECONDS):
+            os.close(fd)
+            self._lock.release()
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, holder.encode("utf-8"))
+        self._fd = fd
+        self.holder = holder
+        return True
+
+    def release(self) -> None:
+        fd, self._fd = self._fd, None
+        self.holder = None
+        try:
+            os.ftruncate(fd, 0)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+            self._lock.release()
+
+    def current_holder(self) -> str:
+        return self.read_holder() or "another writer"
+
+    def read_holder(self) -> str:
+        """Holder of the lock, empty if it is free or not known."""
+        if self.holder:
+            return self.holder
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return f.read().strip()
+        except OSError:
+            return ""
+
+
+_locks: dict[str, AlignmentLock] = {}
+_locks_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def get_lock(db_path: str) -> AlignmentLock:
+    global _pid
+    db_path = str(db_path)
+    with _locks_lock:
+        if _pid != os.getpid():
+            # thread locks held by the parent's threads stay held in a fork
+            _locks.clear()
+            _pid = os.getpid()
+        lock = _locks.get(db_path)
+        if lock is None:
+            lock = _locks[db_path] = AlignmentLock(db_path)
+        return lock
+
+
+@contextmanager
+def writing(db_path: str, holder: str, timeout: float | None = None, cancelled=None):
+    """Hold the writer lock of the alignment, ``AlignmentBusy`` if it is
+    not free within ``timeout`` seconds or the wait was cancelled."""
+    lock = get_lock(db_path)
+    started = time.monotonic()
+    if not lock.acquire(holder, timeout, cancelled):
+        raise AlignmentBusy(lock.current_holder())
+    waited = time.monotonic() - started
+    if waited > 1:
+        logger.info("%s waited %.1fs for the alignment lock of %s", holder, waited, db_path)
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def editing(db_path: str, holder: str = EDITOR_HOLDER):
+    """Writer lock for a request thread. Waits for other editor writes up
+    to ``ALIGNER_EDIT_LOCK_WAIT_SECONDS``, fails at once while a job runs."""
+    lock = get_lock(db_path)
+    return writing(
+        db_path,
+        holder,
+        timeout=config.ALIGNER_EDIT_LOCK_WAIT_SECONDS,
+        cancelled=lambda: _held_by_job(lock.read_holder()),
+    )
+
+
+def _held_by_job(holder: str) -> bool:
+    return bool(holder) and not holder.startswith(EDITOR_HOLDER)
+
+
+def _try_flock(fd: int) -> bool:
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _wait(attempt, deadline, cancelled, pause: float = 0) -> bool:
+    while True:
+        if attempt():
+            return True
+        if cancelled is not None and cancelled():
+            return False
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        if pause:
+            time.sleep(pause)
@@ -1,7 +1,6 @@
 """Alignment service - migrated from a-studio/backend/user_db_helper.py"""
 
 import logging
-import sqlite3
 import uuid
 
 from sqlalchemy.orm import Session
@@ -9,12 +8,14 @@ from sqlalchemy.orm import Session
 from app.models.alignment import Alignment, AlignmentState
 from app.models.alignment_progress import AlignmentProgress
 from app.models.document import Document
+from app.services import alignment_db, alignment_lock, line_store
 from app.services.file_storage import (
     get_alignment_db_path,
     get_db_dir,
     get_splitted_dir,
     get_proxy_dir,
 )
+from app.services.progress_bus import bus, progress_event
 from app import config
 
 logger = logging.getLogger(__name__)
@@ -92,10 +93,11 @@ def create_alignment(
         doc_to.guid,
         name,
     )
+    line_store.build(str(db_path))
 
     # Calculate total batches
     batch_size = config.ALIGNER_BATCH_SIZE
-    with sqlite3.connect(str(db_path)) as align_db:
+    with alignment_db.connect(str(db_path)) as align_db:
         len_from = align_db.execute(
             "select count(*) from splitted_from"
         ).fetchone()[0]
@@ -146,6 +148,15 @@ def update_state(
     if total_batches is not None:
         alignment.total_batches = total_batches
     db.commit()
+    bus.publish(
+        alignment.guid,
+        progress_event(
+            alignment.guid,
+            alignment.state,
+            alignment.curr_batches,
+            alignment.total_batches,
+        ),
+    )
 
 
 def update_progress(db: Session, alignment_id: int, batch_id: int) -> None:
@@ -185,8 +196,6 @@ def increment_state(db: Session, alignment_id: int, state: int) -> None:
 def upload_proxy(
     user_id: int, alignment: Alignment, direction: str, content: str
 ) -> None:
-    from lingtrain_aligner import aligner
-
     lang = alignment.lang_from if direction == "from" else alignment.lang_to
     proxy_dir = get_proxy_dir(user_id, lang)
     proxy_dir.mkdir(parents=True, exist_ok=True)
@@ -196,10 +205,25 @@ def upload_proxy(
     with open(proxy_path, "w", encoding="utf-8") as f:
         f.write(content)
 
-    db_path = get_alignment_db_path(
-        user_id, alignment.lang_from, alignment.lang_to, alignment.guid
+    db_path = str(
+        get_alignment_db_path(user_id, alignment.lang_from, alignment.lang_to, alignment.guid)
     )
-    aligner.load_proxy(str(db_path), str(proxy_path), direction)
+    # raises AlignmentBusy while a job reads the lines
+    with alignment_lock.editing(db_path):
+        _load_proxy(db_path, proxy_path, direction)
+        line_store.invalidate(db_path)
+
+
+def _load_proxy(db_path: str, proxy_path, direction: str) -> None:
+    """Same as ``aligner.load_proxy`` on a pooled connection."""
+    with open(proxy_path, encoding="utf-8") as f:
+        lines = f.readlines()
+    table = "splitted_from" if direction == "from" else "splitted_to"
+    with alignment_db.connect(db_path) as db:
+        db.executemany(
+            f"update {table} set proxy_text = ? where id = ?",
+            [(proxy, line_id) for line_id, proxy in enumerate(lines, start=1)],
+        )
 
 
 def update_proxy_loaded(
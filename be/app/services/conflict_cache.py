@@ -0,0 +1,93 @@
+"""Conflict cache - whole-document conflicts of an alignment per index version"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+from app import config
+from app.services import doc_index_store
+
+logger = logging.getLogger(__name__)
+
+MIN_CHAIN_LENGTH = 2
+MAX_CONFLICTS_LEN = 20
+
+
+class ConflictIndex:
+    """Conflicts found in one version of an alignment's document index."""
+
+    def __init__(self, version: tuple, conflicts: list, rest: list):
+        from lingtrain_aligner import resolver
+
+        self.version = version
+        self.conflicts = conflicts + rest
+        stat1 = resolver.get_statistics(conflicts, print_stat=False)
+        stat2 = resolver.get_statistics(rest, print_stat=False)
+        items = [(x, stat1[x]) for x in stat1]
+        items.extend([(x, stat2[x]) for x in stat2])
+        items.sort(key=lambda x: x[1], reverse=True)
+        self.items = items
+
+
+class ConflictCache:
+    """LRU of conflict indexes, an entry is rebuilt once the index stamp
+    of its alignment DB changes.
+
+    The index is read from the rows in one snapshot, a request never writes
+    the blob and needs no alignment lock.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._entries: OrderedDict = OrderedDict()
+        self._locks: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, db_path: str, handle_start: bool, handle_finish: bool) -> ConflictIndex:
+        key = (db_path, handle_start, handle_finish)
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        # one rebuild per alignment at a time, concurrent requests reuse it
+        with key_lock:
+            stamp = doc_index_store.get_stamp(db_path)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.version == stamp:
+                    self._entries.move_to_end(key)
+                    return entry
+
+            stamp, index = doc_index_store.read_index(db_path)
+            entry = self._build(db_path, stamp, index, handle_start, handle_finish)
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._locks.pop(evicted, None)
+            return entry
+
+    def _build(self, db_path, version, index, handle_start, handle_finish) -> ConflictIndex:
+        from lingtrain_aligner import resolver
+
+        if not index:
+            return ConflictIndex(version, [], [])
+        conflicts, rest = resolver.get_all_conflicts(
+            db_path,
+            min_chain_length=MIN_CHAIN_LENGTH,
+            max_conflicts_len=MAX_CONFLICTS_LEN,
+            batch_id=-1,
+            handle_start=handle_start,
+            handle_finish=handle_finish,
+            index=index,
+        )
+        logger.debug(
+            "Conflict index of %s built for version %s: %d conflicts",
+            db_path,
+            version,
+            len(conflicts) + len(rest),
+        )
+        return ConflictIndex(version, conflicts, rest)
+
+
+conflict_cache = ConflictCache(config.ALIGNER_CONFLICT_CACHE_SIZE)
@@ -0,0 +1,327 @@
+"""Conflict tracker - in-memory conflict detection for the resolve passes"""
+
+import json
+import logging
+from typing import NamedTuple
+
+from app.services import alignment_db, doc_index_store
+from app.services.index_version import get_version
+
+logger = logging.getLogger(__name__)
+
+
+class Run(NamedTuple):
+    """Rows in index order whose target line ids go up by one. A row is
+    ``(first source line id, target line id, batch_id, sub_id)``."""
+
+    first: tuple
+    last: tuple
+    length: int
+
+
+class BatchRuns(NamedTuple):
+    runs: list[Run]
+    # the first two rows, a handled start takes the first one apart
+    head: list[tuple]
+
+
+class ConflictTracker:
+    """Document index of one resolve task, kept in memory between passes.
+
+    Mirrors ``resolver.get_all_conflicts``, ``resolve_all_conflicts`` and
+    ``correct_conflicts`` of lingtrain_aligner, but the index is read once
+    and text lengths come from ``count(*)``. The chains of
+    ``resolver.get_good_chains`` are the runs of rows with consecutive
+    target lines, whatever the pass parameters are. The runs are found once
+    per batch and kept, a later pass only scans the batches changed by the
+    last resolutions and joins runs across the batch borders. The good
+    chains and the conflicts between them come from the runs. The index is
+    written back by ``flush``, once per pass.
+    """
+
+    def __init__(self, db_path: str, batch_id: int = -1):
+        from lingtrain_aligner import aligner
+
+        self.db_path = db_path
+        self.batch_id = batch_id
+        doc_index_store.materialize_path(db_path)
+        self.version = get_version(db_path)
+        with alignment_db.connect(db_path) as db:
+            self.index = aligner.get_doc_index(db)
+            self.len_from = db.execute("select count(*) from splitted_from").fetchone()[0]
+            self.len_to = db.execute("select count(*) from splitted_to").fetchone()[0]
+        self.dirty = False
+        self._runs: dict[int, BatchRuns] = {}
+        self._changed: set[int] = set()
+
+    def find(
+        self,
+        min_chain_length: int,
+        max_conflicts_len: int,
+        handle_start: bool = False,
+        handle_finish: bool = False,
+    ):
+        """Conflicts to solve and the rest, like ``resolver.get_all_conflicts``."""
+        return self._find(
+            min_chain_length, max_conflicts_len, handle_start, handle_finish
+        )
+
+    def resolve(
+        self,
+        conflicts,
+        model_name,
+        model=None,
+        use_proxy_from=False,
+        use_proxy_to=False,
+    ) -> None:
+        """Squash the conflicts, last first so that coordinates stay valid."""
+        from lingtrain_aligner import resolver
+
+        for conflict in conflicts[::-1]:
+            solution, lines_from, lines_to = resolver.squash_conflict(
+                self.db_path,
+                conflict,
+                model_name,
+                model=model,
+                use_proxy_from=use_proxy_from,
+                use_proxy_to=use_proxy_to,
+            )
+            self._apply(conflict, solution, lines_from, lines_to)
+
+    def correct(
+        self,
+        conflicts,
+        min_chain_length: int,
+        max_conflicts_len: int,
+        handle_start: bool = False,
+        handle_finish: bool = False,
+    ) -> int:
+        """Fix conflict endings with negative length, like
+        ``resolver.correct_conflicts``. Returns the number of fixes."""
+        from lingtrain_aligner import resolver
+
+        negative_conflicts_to = [
+            c for c in conflicts if c["to"]["end"][0] - c["to"]["start"][0] + 1 < 0
+        ]
+
+        def rest_amount(overrides=None):
+            _, rest = self._find(
+                min_chain_length,
+                max_conflicts_len,
+                handle_start,
+                handle_finish,
+                overrides,
+            )
+            return len(rest)
+
+        curr_conf_len = rest_amount()
+        fixed_conflicts = 0
+        for n_conf in negative_conflicts_to:
+            start, end = resolver.get_conflict_coordinates(n_conf)
+
+            batch_id, batch = self._try_fix_ending(start)
+            conf_len = rest_amount({batch_id: batch})
+            if conf_len != curr_conf_len:
+                self._set_batch(batch_id, batch)
+                curr_conf_len = conf_len
+                fixed_conflicts += 1
+                continue
+
+            batch_id, batch = self._try_fix_ending(end)
+            conf_len = rest_amount({batch_id: batch})
+            if conf_len != curr_conf_len:
+                # the library keeps the old amount here, results stay identical
+                self._set_batch(batch_id, batch)
+                fixed_conflicts += 1
+
+        logger.debug("%d negative conflict ending(s) fixed", fixed_conflicts)
+        return fixed_conflicts
+
+    def flush(self) -> None:
+        """Write the index back if it was changed since the last flush.
+
+        Resolve tasks of other batches may have written the index since it
+        was read, then only the batches this tracker changed are put into
+        the current index and the others are taken from it.
+        """
+        from lingtrain_aligner import aligner
+
+        if not self.dirty:
+            return
+        with alignment_db.connect(self.db_path) as db:
+            db.execute("begin immediate")
+            doc_index_store.materialize(db)
+            version = db.execute(
+                "select version from doc_index_version where id = 1"
+            ).fetchone()[0]
+            if version != self.version:
+                self._merge(aligner.get_doc_index(db))
+            aligner.update_doc_index(db, self.index)
+            self.version = db.execute(
+                "select version from doc_index_version where id = 1"
+            ).fetchone()[0]
+        self._changed.clear()
+        self.dirty = False
+
+    def _merge(self, current) -> None:
+        lost = [x for x in self._changed if x >= len(current)]
+        if lost:
+            logger.warning(
+                "Document index of %s lost batch(es) %s during resolve",
+                self.db_path,
+                lost,
+            )
+        for batch_id, batch in enumerate(current):
+            if batch_id in self._changed:
+                current[batch_id] = self.index[batch_id]
+            elif batch_id >= len(self.index) or batch != self.index[batch_id]:
+                self._runs.pop(batch_id, None)
+        logger.debug(
+            "Document index of %s changed during resolve, merged %d batch(es)",
+            self.db_path,
+            len(self._changed) - len(lost),
+        )
+        self.index = current
+
+    def _find(
+        self, min_chain_length, max_conflicts_len, handle_start, handle_finish, overrides=None
+    ):
+        from lingtrain_aligner import resolver
+
+        if self.batch_id >= 0:
+            if self.batch_id >= len(self.index):
+                return [], []
+            batch_ids = [self.batch_id]
+            total_batches = len(self.index)
+        else:
+            batch_ids = range(len(self.index))
+            total_batches = 1
+        batches = [self._batch_runs(x, overrides) for x in batch_ids]
+        head = [row for x in batches for row in x.head][:2]
+        if not head:
+            return [], []
+
+        if total_batches != 1:
+            if self.batch_id > 0:
+                handle_start = False
+            if self.batch_id < total_batches - 1:
+                handle_finish = False
+
+        runs = _join_runs(batches)
+        chains_from, chains_to = [], []
+        if handle_start and head[0][1] != 1:
+            if len(head) < 2:
+                raise IndexError("A handled start needs two rows")
+            first = head[0]
+            chains_from.append([_point(first, 0)])
+            chains_to.append([(1, *first[2:])])
+            # the row is a chain of its own, the next one starts anew
+            if runs[0].length == 1:
+                runs = runs[1:]
+            else:
+                runs[0] = Run(head[1], runs[0].last, runs[0].length - 1)
+
+        for i, run in enumerate(runs):
+            if run.length >= min_chain_length:
+                chains_from.append([_point(run.first, 0), _point(run.last, 0)])
+                chains_to.append([_point(run.first, 1), _point(run.last, 1)])
+            elif handle_finish and i == len(runs) - 1:
+                chains_from.append([(self.len_from, *run.last[2:])])
+                chains_to.append([(self.len_to, *run.last[2:])])
+        return resolver.get_conflicts(chains_from, chains_to, max_len=max_conflicts_len)
+
+    def _batch_runs(self, batch_id, overrides=None) -> BatchRuns:
+        if overrides and batch_id in overrides:
+            return _scan_batch(batch_id, overrides[batch_id])
+        runs = self._runs.get(batch_id)
+        if runs is None:
+            runs = self._runs[batch_id] = _scan_batch(batch_id, self.index[batch_id])
+        return runs
+
+    def _set_batch(self, batch_id, batch):
+        self.index[batch_id] = batch
+        self._runs.pop(batch_id, None)
+        self._changed.add(batch_id)
+        self.dirty = True
+
+    def _try_fix_ending(self, coordinate):
+        """Copy of the coordinate's batch with the conflict ending moved by one."""
+        batch_id, sub_id = coordinate
+        batch = list(self.index[batch_id])
+        entry = list(batch[sub_id])
+        ids_to = json.loads(entry[3])
+        entry[3] = json.dumps([ids_to[0] + 1] + ids_to[1:])
+        batch[sub_id] = entry
+        return batch_id, batch
+
+    def _apply(self, conflict, solution, lines_from, lines_to):
+        from lingtrain_aligner import helper, resolver
+
+        start, end = resolver.get_conflict_coordinates(conflict)
+        index_solution = []
+        with alignment_db.connect(self.db_path) as db:
+            for line in solution:
+                from_id, to_id = helper.add_resolved_processing_line(
+                    db,
+                    start[0],
+                    helper.get_string(lines_from, line[0]),
+                    helper.get_string(lines_to, line[1]),
+                )
+                index_solution.append(
+                    [from_id, json.dumps(line[0]), to_id, json.dumps(line[1])]
+                )
+
+        # a solution may span the border of two batches
+        if start[0] == end[0]:
+            self.index[start[0]][start[1] : end[1] + 1] = index_solution
+        else:
+            self.index[start[0]][start[1] :] = index_solution
+            self.index[end[0]][: end[1] + 1] = []
+            self._runs.pop(end[0], None)
+        self._runs.pop(start[0], None)
+        self._changed.update((start[0], end[0]))
+        self.dirty = True
+
+
+def _scan_batch(batch_id, batch) -> BatchRuns:
+    """Runs of one batch, rows as ``resolver.prepare_index`` flattens them."""
+    runs = []
+    head = []
+    first = last = None
+    length = 0
+    for sub_id, ix in enumerate(batch):
+        from_ids = json.loads(ix[1])
+        for t_id in json.loads(ix[3]):
+            row = (from_ids[0], t_id, batch_id, sub_id)
+            if len(head) < 2:
+                head.append(row)
+            if last is not None and t_id == last[1] + 1:
+                last = row
+                length += 1
+                continue
+            if last is not None:
+                runs.append(Run(first, last, length))
+            first = last = row
+            length = 1
+    if last is not None:
+        runs.append(Run(first, last, length))
+    return BatchRuns(runs, head)
+
+
+def _join_runs(batches: list[BatchRuns]) -> list[Run]:
+    """Runs of the batches in order, a run going on in the next batch is one."""
+    runs = []
+    for batch in batches:
+        for run in batch.runs:
+            if runs and run.first[1] == runs[-1].last[1] + 1:
+                prev = runs[-1]
+                runs[-1] = Run(prev.first, run.last, prev.length + run.length)
+            else:
+                runs.append(run)
+    return runs
+
+
+def _point(row, side: int) -> tuple:
+    """Chain point ``(line id, batch_id, sub_id)`` of a row, 0 for the
+    source side and 1 for the target side."""
+    return (row[side], row[2], row[3])
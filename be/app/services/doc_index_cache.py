@@ -0,0 +1,227 @@
+"""Doc index cache - document index of an alignment, kept up to date by the edits"""
+
+import itertools
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+from app import config
+from app.services import doc_index_store
+from app.services.doc_index_store import TYPE_TO
+
+logger = logging.getLogger(__name__)
+
+
+class LinePosition(NamedTuple):
+    batch_id: int
+    batch_index_id: int
+    position: int
+
+
+class FlatDocIndex:
+    """One alignment's document index, per batch and flattened.
+
+    ``entries[i]`` is the ``[from_id, from_line_ids, to_id, to_line_ids]``
+    entry at absolute position ``i`` and ``items[i]`` the ``(entry,
+    position in batch)`` pair of ``helper.get_flatten_doc_index``. Both are
+    shared between requests and must not be changed, ``apply`` makes new
+    ones.
+
+    The line map of a side holds the entries mapped to a line id with their
+    batch, it is built on the first lookup and kept up to date by ``apply``.
+    A position is the place of the entry in its batch plus the length of the
+    batches before it, so a jump does not depend on the document size.
+    """
+
+    def __init__(self, version: tuple, batches: list):
+        self.version = version
+        self._batches = [list(batch) for batch in batches]
+        self._flat = None
+        self._offsets = None
+        self._lines: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def items(self) -> list:
+        return self._flatten()[0]
+
+    @property
+    def entries(self) -> list:
+        return self._flatten()[1]
+
+    def find_line(self, text_type: str, line_id: int) -> LinePosition | None:
+        """First entry mapped to the line, ``None`` if it is not aligned."""
+        with self._lock:
+            found = self._line_map(text_type).get(line_id, ())
+            positions = [self._position(*x) for x in found]
+        return min(positions, key=lambda x: x.position) if positions else None
+
+    def find_single(self, text_type: str, line_ids, limit: int) -> list[LinePosition]:
+        """First entries in index order mapped to exactly one of the lines."""
+        column = _column(text_type)
+        with self._lock:
+            line_map = self._line_map(text_type)
+            found = [
+                self._position(batch_id, entry)
+                for line_id in line_ids
+                for batch_id, entry in line_map.get(line_id, ())
+                if len(_line_ids(entry, column)) == 1
+            ]
+        return sorted(found, key=lambda x: x.position)[:limit]
+
+    def apply(self, update: doc_index_store.IndexUpdate) -> bool:
+        """Follow the changes of an ``IndexUpdate`` made to this version,
+        False if it is of another one."""
+        with self._lock:
+            if self.version == update.new_version:
+                return True
+            if self.version != update.version:
+                return False
+            for change in update.changes:
+                self._apply(change)
+            self.version = update.new_version
+            self._flat = None
+            self._offsets = None
+        return True
+
+    def _apply(self, change) -> None:
+        kind, batch_id = change[:2]
+        while len(self._batches) <= batch_id:
+            self._batches.append([])
+        batch = self._batches[batch_id]
+        if kind == "set":
+            _, _, pos, entry = change
+            self._unmap(batch_id, batch[pos])
+            batch[pos] = entry
+            self._map(batch_id, entry)
+        elif kind == "insert":
+            _, _, pos, entry = change
+            batch.insert(pos, entry)
+            self._map(batch_id, entry)
+        elif kind == "delete":
+            self._unmap(batch_id, batch.pop(change[2]))
+        elif kind == "batch":
+            for entry in batch:
+                self._unmap(batch_id, entry)
+            batch[:] = change[2]
+            for entry in batch:
+                self._map(batch_id, entry)
+
+    def _map(self, batch_id: int, entry) -> None:
+        for text_type, line_map in self._lines.items():
+            for line_id in _line_ids(entry, _column(text_type)):
+                line_map.setdefault(line_id, []).append((batch_id, entry))
+
+    def _unmap(self, batch_id: int, entry) -> None:
+        for text_type, line_map in self._lines.items():
+            for line_id in _line_ids(entry, _column(text_type)):
+                found = line_map.get(line_id, [])
+                found[:] = [x for x in found if x[1] is not entry]
+                if not found:
+                    line_map.pop(line_id, None)
+
+    def _position(self, batch_id: int, entry) -> LinePosition:
+        if self._offsets is None:
+            self._offsets = [0, *itertools.accumulate(map(len, self._batches))]
+        batch = self._batches[batch_id]
+        pos = next(i for i, x in enumerate(batch) if x is entry)
+        return LinePosition(batch_id, pos, self._offsets[batch_id] + pos)
+
+    def _flatten(self) -> tuple:
+        with self._lock:
+            if self._flat is None:
+                items = [
+                    (entry, pos)
+                    for batch in self._batches
+                    for pos, entry in enumerate(batch)
+                ]
+                self._flat = (items, [entry for entry, _ in items])
+            return self._flat
+
+    def _line_map(self, text_type: str) -> dict:
+        line_map = self._lines.get(text_type)
+        if line_map is None:
+            column = _column(text_type)
+            line_map = {}
+            for batch_id, batch in enumerate(self._batches):
+                for entry in batch:
+                    for line_id in _line_ids(entry, column):
+                        line_map.setdefault(line_id, []).append((batch_id, entry))
+            self._lines[text_type] = line_map
+        return line_map
+
+
+def _column(text_type: str) -> int:
+    return 3 if text_type == TYPE_TO else 1
+
+
+def _line_ids(entry, column: int) -> list:
+    try:
+        return json.loads(entry[column]) if entry[column] else []
+    except ValueError:
+        return []
+
+
+class DocIndexCache:
+    """LRU of flattened doc indexes. Edits and aligned batches of this
+    process are applied to the cached entry by ``update``, any other change
+    of the index makes it read again."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._entries: OrderedDict = OrderedDict()
+        self._locks: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, db_path: str) -> FlatDocIndex:
+        db_path = str(db_path)
+        with self._lock:
+            key_lock = self._locks.setdefault(db_path, threading.Lock())
+
+        with key_lock:
+            version = doc_index_store.get_stamp(db_path)
+            with self._lock:
+                entry = self._entries.get(db_path)
+                if entry is not None and entry.version == version:
+                    self._entries.move_to_end(db_path)
+                    return entry
+
+            entry = self._build(db_path)
+            with self._lock:
+                self._entries[db_path] = entry
+                self._entries.move_to_end(db_path)
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._locks.pop(evicted, None)
+            return entry
+
+    def update(self, db_path: str, update: doc_index_store.IndexUpdate) -> None:
+        """Carry the cached index over a change made in this process, a
+        cached index of another version is dropped and read again."""
+        db_path = str(db_path)
+        with self._lock:
+            entry = self._entries.get(db_path)
+        if entry is None or entry.apply(update):
+            return
+        with self._lock:
+            if self._entries.get(db_path) is entry:
+                del self._entries[db_path]
+
+    def _build(self, db_path: str) -> FlatDocIndex:
+        stamp, batches = doc_index_store.read_index(db_path)
+        entry = FlatDocIndex(stamp, batches)
+        logger.debug(
+            "Doc index of %s loaded for version %s: %d lines",
+            db_path,
+            stamp,
+            len(entry),
+        )
+        return entry
+
+
+doc_index_cache = DocIndexCache(config.ALIGNER_DOC_INDEX_CACHE_SIZE)
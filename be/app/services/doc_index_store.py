@@ -0,0 +1,466 @@
+"""Doc index store - document index of an alignment DB as one row per entry"""
+
+import json
+import logging
+import sqlite3
+import threading
+from typing import NamedTuple
+
+from app.services import alignment_db, edit_journal
+from app.services.index_version import ensure_version_tracking
+
+logger = logging.getLogger(__name__)
+
+TYPE_FROM = "from"
+TYPE_TO = "to"
+
+# gap between the ordering keys of neighbouring rows, an inserted row takes
+# the middle of the gap and a batch is renumbered once a gap is used up
+ORDER_STEP = 1024
+READ_RETRIES = 3
+
+# lingtrain_aligner keeps the index as one JSON blob in doc_index and
+# rewrites all of it on every change. The editor works on doc_index_rows
+# instead and the blob is written back lazily by ``materialize`` before
+# anything reads it. synced_version is the doc_index_version the rows were
+# built from or written to, dirty marks edits the blob does not have yet.
+_SCHEMA = """
+create table if not exists doc_index_rows(
+    id integer primary key,
+    batch_id integer not null,
+    ord integer not null,
+    from_id integer,
+    from_ids text not null,
+    to_id integer,
+    to_ids text not null
+);
+create index if not exists doc_index_rows_order on doc_index_rows(batch_id, ord);
+create table if not exists doc_index_rows_state(
+    id integer primary key check (id = 1),
+    batches integer not null,
+    synced_version integer not null,
+    rows_version integer not null,
+    dirty integer not null
+);
+"""
+
+_ROW_COLUMNS = "id, ord, from_id, from_ids, to_id, to_ids"
+
+
+class IndexRow(NamedTuple):
+    id: int
+    ord: int
+    from_id: int
+    from_ids: str
+    to_id: int
+    to_ids: str
+
+    def line_ids(self, text_type: str) -> str:
+        return self.to_ids if text_type == TYPE_TO else self.from_ids
+
+
+class IndexUpdate(NamedTuple):
+    """Changes of the index from stamp ``version`` to ``new_version``.
+
+    ``changes`` are ``("set", batch_id, pos, entry)``, ``("insert",
+    batch_id, pos, entry)``, ``("delete", batch_id, pos)`` and ``("batch",
+    batch_id, entries)`` in the order they were made.
+    """
+
+    version: tuple
+    new_version: tuple
+    changes: list
+
+
+class IndexState(NamedTuple):
+    batches: int
+    synced_version: int
+    rows_version: int
+    dirty: int
+
+
+_installed: set[str] = set()
+_lock = threading.Lock()
+
+
+def ensure_schema(db_path: str) -> None:
+    """Install the rows tables and the version tracking once per DB."""
+    db_path = str(db_path)
+    if db_path in _installed:
+        return
+    ensure_version_tracking(db_path)
+    with _lock:
+        if db_path in _installed:
+            return
+        with alignment_db.connect(db_path) as db:
+            db.executescript(_SCHEMA + edit_journal.SCHEMA)
+        _installed.add(db_path)
+
+
+class IndexRows:
+    """Doc index rows of an alignment DB, edited in the caller's write
+    transaction. Positions are the ones of the nested index: ``(batch_id,
+    position in batch)``. ``save`` marks the blob as outdated. Changed rows
+    are reported to the ``edit_journal.Journal`` if one is given.
+
+    The rows of a batch are read once in order and kept up to date by the
+    edits, a position is looked up in that list instead of by an offset.
+    The edits are recorded for ``update``, so the cached index can follow
+    them without being read again.
+    """
+
+    def __init__(self, db, journal=None):
+        self.db = db
+        self.journal = journal
+        self.state = sync(db)
+        self.version = _stamp(db)
+        self.changed = False
+        self.changes: list = []
+        self._batches: dict[int, list[IndexRow]] = {}
+        self._row_batch: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return self.state.batches
+
+    def stamp(self) -> tuple:
+        return _stamp(self.db)
+
+    def update(self) -> IndexUpdate:
+        """The edits since the rows were opened, after ``save``."""
+        return IndexUpdate(self.version, self.stamp(), self.changes)
+
+    def batch_len(self, batch_id: int) -> int:
+        return len(self._batch(batch_id))
+
+    def entry(self, batch_id: int, pos: int) -> IndexRow | None:
+        rows = self._batch(batch_id)
+        return rows[pos] if 0 <= pos < len(rows) else None
+
+    def with_single_line_id(
+        self, text_type: str, line_ids, limit: int
+    ) -> list[IndexRow]:
+        """First rows in index order mapped to exactly one of the lines."""
+        column = "to_ids" if text_type == TYPE_TO else "from_ids"
+        marks = ",".join("?" * len(line_ids))
+        return [
+            IndexRow(*row)
+            for row in self.db.execute(
+                f"select {_ROW_COLUMNS} from doc_index_rows "
+                f"where json_valid({column}) and json_array_length({column}) = 1 "
+                f"and json_extract({column}, '$[0]') in ({marks}) "
+                "order by batch_id, ord limit ?",
+                (*line_ids, limit),
+            )
+        ]
+
+    def set_line_ids(self, row_id: int, text_type: str, line_ids: str) -> None:
+        column = "to_ids" if text_type == TYPE_TO else "from_ids"
+        self._touch(row_id)
+        self.db.execute(
+            f"update doc_index_rows set {column} = ? where id = ?", (line_ids, row_id)
+        )
+        found = self._locate(row_id)
+        if found is not None:
+            batch_id, rows, i = found
+            rows[i] = rows[i]._replace(**{column: line_ids})
+            self.changes.append(("set", batch_id, i, _entry(rows[i])))
+        self.changed = True
+
+    def insert(self, batch_id: int, pos: int, entry) -> None:
+        """Insert ``(from_id, from_ids, to_id, to_ids)`` before ``pos``,
+        a position past the end appends like ``list.insert``."""
+        if not 0 <= batch_id < self.state.batches:
+            return
+        rows = self._batch(batch_id)
+        pos = min(max(0, pos), len(rows))
+        ord_ = self._order_key(rows, pos)
+        if ord_ is None:
+            self._renumber(batch_id)
+            ord_ = self._order_key(rows, pos)
+        row_id = self.db.execute(
+            "insert into doc_index_rows(batch_id, ord, from_id, from_ids, to_id, to_ids) "
+            "values (?, ?, ?, ?, ?, ?)",
+            (batch_id, ord_, *entry),
+        ).lastrowid
+        rows.insert(pos, IndexRow(row_id, ord_, *entry))
+        self._row_batch[row_id] = batch_id
+        self.changes.append(("insert", batch_id, pos, _entry(rows[pos])))
+        self._touch(row_id, inserted=True)
+        self.changed = True
+
+    def delete(self, row_id: int) -> None:
+        self._touch(row_id)
+        found = self._locate(row_id)
+        self.db.execute("delete from doc_index_rows where id = ?", (row_id,))
+        if found is not None:
+            batch_id, rows, i = found
+            rows.pop(i)
+            del self._row_batch[row_id]
+            self.changes.append(("delete", batch_id, i))
+        self.changed = True
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        self.db.execute(
+            "update doc_index_rows_state set dirty = 1, rows_version = rows_version + 1 "
+            "where id = 1"
+        )
+        self.changed = False
+
+    def _touch(self, row_id: int, inserted: bool = False) -> None:
+        if self.journal is not None:
+            self.journal.touch("doc_index_rows", row_id, inserted)
+
+    def _batch(self, batch_id: int) -> list[IndexRow]:
+        rows = self._batches.get(batch_id)
+        if rows is None:
+            rows = [
+                IndexRow(*row)
+                for row in self.db.execute(
+                    f"select {_ROW_COLUMNS} from doc_index_rows where batch_id = ? "
+                    "order by ord",
+                    (batch_id,),
+                )
+            ]
+            self._batches[batch_id] = rows
+            self._row_batch.update((row.id, batch_id) for row in rows)
+        return rows
+
+    def _locate(self, row_id: int) -> tuple | None:
+        """Batch id, rows of the batch and position of a row in the index."""
+        batch_id = self._row_batch.get(row_id)
+        if batch_id is None:
+            # a row found by its line ids, its batch is not read yet
+            row = self.db.execute(
+                "select batch_id from doc_index_rows where id = ?", (row_id,)
+            ).fetchone()
+            if row is None or row[0] >= self.state.batches:
+                return None
+            batch_id = row[0]
+        rows = self._batch(batch_id)
+        return batch_id, rows, _find(rows, row_id)
+
+    @staticmethod
+    def _order_key(rows: list[IndexRow], pos: int) -> int | None:
+        before = rows[pos - 1].ord if pos > 0 else None
+        after = rows[pos].ord if pos < len(rows) else None
+
+        if before is None and after is None:
+            return 0
+        if before is None:
+            return after - ORDER_STEP
+        if after is None:
+            return before + ORDER_STEP
+        if after - before < 2:
+            return None
+        return (before + after) // 2
+
+    def _renumber(self, batch_id: int) -> None:
+        rows = self._batch(batch_id)
+        for row in rows:
+            self._touch(row.id)
+        self.db.executemany(
+            "update doc_index_rows set ord = ? where id = ?",
+            [(i * ORDER_STEP, row.id) for i, row in enumerate(rows)],
+        )
+        rows[:] = [row._replace(ord=i * ORDER_STEP) for i, row in enumerate(rows)]
+
+
+def _find(rows: list[IndexRow], row_id: int) -> int:
+    return next(i for i, row in enumerate(rows) if row.id == row_id)
+
+
+def _entry(row: IndexRow) -> list:
+    return [row.from_id, row.from_ids, row.to_id, row.to_ids]
+
+
+def sync(db) -> IndexState:
+    """Rebuild the rows from the blob if the blob was written since.
+
+    Also migrates a DB that only has the blob. Needs a write transaction.
+    """
+    version = _blob_version(db)
+    state = _state(db)
+    if state is not None and state.synced_version == version:
+        return state
+    if state is not None and state.dirty:
+        logger.warning("Document index was rewritten over unsaved row edits")
+
+    batches = _read_blob(db)
+    # row ids start over, the edit history can not be replayed on them
+    edit_journal.clear(db)
+    db.execute("delete from doc_index_rows")
+    db.executemany(
+        "insert into doc_index_rows(batch_id, ord, from_id, from_ids, to_id, to_ids) "
+        "values (?, ?, ?, ?, ?, ?)",
+        (
+            (batch_id, pos * ORDER_STEP, *entry[:4])
+            for batch_id, batch in enumerate(batches)
+            for pos, entry in enumerate(batch)
+        ),
+    )
+    rows_version = state.rows_version + 1 if state else 0
+    state = IndexState(len(batches), version, rows_version, 0)
+    db.execute(
+        "insert or replace into doc_index_rows_state"
+        "(id, batches, synced_version, rows_version, dirty) values (1, ?, ?, ?, ?)",
+        state,
+    )
+    return state
+
+
+def replace_batches(db, batch_ids) -> IndexUpdate:
+    """Entries of aligned batches from the processing tables, like
+    ``aligner.create_doc_index`` builds them, put into the rows only.
+
+    The blob is written once by ``materialize`` instead of once per batch.
+    Needs a write transaction.
+    """
+    state = sync(db)
+    version = _stamp(db)
+    # row ids of the batches change, the edit history can not be replayed
+    edit_journal.clear(db)
+    for batch_id in batch_ids:
+        db.execute("delete from doc_index_rows where batch_id = ?", (batch_id,))
+        db.execute(
+            "insert into doc_index_rows(batch_id, ord, from_id, from_ids, to_id, to_ids) "
+            "select f.batch_id, (row_number() over (order by f.id) - 1) * ?, "
+            "f.id, f.text_ids, t.id, t.text_ids from processing_from f "
+            "join processing_to t on f.id = t.id where f.batch_id = ? order by f.id",
+            (ORDER_STEP, batch_id),
+        )
+    db.execute(
+        "update doc_index_rows_state set batches = ?, rows_version = ?, dirty = 1 "
+        "where id = 1",
+        (max(state.batches, max(batch_ids) + 1), state.rows_version + 1),
+    )
+    changes = [
+        (
+            "batch",
+            batch_id,
+            [
+                list(x)
+                for x in db.execute(
+                    "select from_id, from_ids, to_id, to_ids from doc_index_rows "
+                    "where batch_id = ? order by ord",
+                    (batch_id,),
+                )
+            ],
+        )
+        for batch_id in batch_ids
+    ]
+    return IndexUpdate(version, _stamp(db), changes)
+
+
+def materialize(db) -> None:
+    """Write the rows back to the blob if they have edits it does not have.
+
+    Needs a write transaction, the caller may read the blob right after in
+    the same one.
+    """
+    from lingtrain_aligner import aligner
+
+    state = _state(db)
+    if state is None or not state.dirty:
+        return
+    if state.synced_version != _blob_version(db):
+        sync(db)
+        return
+    aligner.update_doc_index(db, _read_rows(db, state.batches))
+    db.execute(
+        "update doc_index_rows_state set synced_version = ?, dirty = 0 where id = 1",
+        (_blob_version(db),),
+    )
+
+
+def materialize_path(db_path: str) -> None:
+    """``materialize`` before a lingtrain_aligner call reading the blob."""
+    db_path = str(db_path)
+    ensure_schema(db_path)
+    with alignment_db.connect(db_path) as db:
+        state = _state(db)
+        if state is None or not state.dirty:
+            return
+        db.execute("begin immediate")
+        materialize(db)
+
+
+def get_stamp(db_path: str) -> tuple:
+    """Changes whenever the index changes, in the blob or in the rows."""
+    db_path = str(db_path)
+    ensure_schema(db_path)
+    with alignment_db.connect(db_path) as db:
+        return _stamp(db)
+
+
+def read_index(db_path: str) -> tuple[tuple, list]:
+    """Stamp and nested entries of the index, read from the rows."""
+    db_path = str(db_path)
+    ensure_schema(db_path)
+    with alignment_db.connect(db_path) as db:
+        for _ in range(READ_RETRIES):
+            state = _state(db)
+            if state is None or state.synced_version != _blob_version(db):
+                db.execute("begin immediate")
+                sync(db)
+                db.commit()
+
+            # the blob may be written between the sync and this snapshot
+            db.execute("begin")
+            state = _state(db)
+            if state.synced_version == _blob_version(db):
+                stamp = _stamp(db)
+                batches = _read_rows(db, state.batches)
+                db.commit()
+                return stamp, batches
+            db.commit()
+    raise sqlite3.OperationalError(f"Document index of {db_path} keeps changing")
+
+
+def _blob_version(db) -> int:
+    row = db.execute("select version from doc_index_version where id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def _state(db) -> IndexState | None:
+    row = db.execute(
+        "select batches, synced_version, rows_version, dirty "
+        "from doc_index_rows_state where id = 1"
+    ).fetchone()
+    return IndexState(*row) if row else None
+
+
+def _stamp(db) -> tuple:
+    # rows_version counts the edits of the rows and their rebuilds from the
+    # blob, a blob written since the last sync shows as its version. Writing
+    # the rows to the blob changes neither.
+    state = _state(db)
+    blob_version = _blob_version(db)
+    if state is None:
+        return blob_version, -1
+    if state.synced_version == blob_version:
+        return 0, state.rows_version
+    return blob_version, state.rows_version
+
+
+def _read_blob(db) -> list:
+    row = db.execute("select contents from doc_index").fetchone()
+    if not row or not row[0]:
+        return []
+    try:
+        return json.loads(row[0])
+    except ValueError:
+        logger.warning("Can not parse the document index blob")
+        return []
+
+
+def _read_rows(db, batches: int) -> list:
+    index = [[] for _ in range(batches)]
+    for batch_id, from_id, from_ids, to_id, to_ids in db.execute(
+        "select batch_id, from_id, from_ids, to_id, to_ids "
+        "from doc_index_rows order by batch_id, ord"
+    ):
+        if batch_id < batches:
+            index[batch_id].append([from_id, from_ids, to_id, to_ids])
+    return index
@@ -0,0 +1,162 @@
+"""Edit journal - undo and redo of editor changes as row deltas"""
+
+import json
+import logging
+import time
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+# Tables an edit may change, deltas hold whole rows of them
+TABLES = ("doc_index_rows", "processing_from", "processing_to")
+
+SCHEMA = """
+create table if not exists edit_journal(
+    id integer primary key,
+    created_at real not null,
+    operations text not null,
+    undone integer not null default 0
+);
+create table if not exists edit_journal_changes(
+    id integer primary key,
+    edit_id integer not null,
+    tbl text not null,
+    row_id integer not null,
+    before text,
+    after text
+);
+create index if not exists edit_journal_changes_edit on edit_journal_changes(edit_id);
+"""
+
+
+class JournalConflict(Exception):
+    """The rows were changed outside the journal since the edit."""
+
+
+class Journal:
+    """Rows touched by one edit, collected in its write transaction.
+
+    ``touch`` is called before a row is changed and keeps its first state,
+    ``save`` stores the before and after state of every row that differs.
+    Undo and redo write these states back, so they cost as much as the
+    edit did and never read the rest of the document.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._before: dict[tuple[str, int], dict | None] = {}
+
+    def touch(self, table: str, row_id: int, inserted: bool = False) -> None:
+        key = (table, row_id)
+        if key not in self._before:
+            self._before[key] = None if inserted else _read_row(self.db, table, row_id)
+
+    def save(self, operations: list[str]) -> int | None:
+        changes = []
+        for (table, row_id), before in self._before.items():
+            after = _read_row(self.db, table, row_id)
+            if after != before:
+                changes.append((table, row_id, _dump(before), _dump(after)))
+        self._before.clear()
+        if not changes:
+            return None
+
+        # a new edit drops the edits that could be redone
+        _delete_edits(self.db, "undone = 1")
+        edit_id = self.db.execute(
+            "insert into edit_journal(created_at, operations) values (?, ?)",
+            (time.time(), json.dumps(operations)),
+        ).lastrowid
+        self.db.executemany(
+            "insert into edit_journal_changes(edit_id, tbl, row_id, before, after) "
+            "values (?, ?, ?, ?, ?)",
+            [(edit_id, *change) for change in changes],
+        )
+        compact(self.db, edit_id)
+        return edit_id
+
+
+def undo(db) -> dict | None:
+    """Revert the last edit that is not undone yet, None if there is none."""
+    row = db.execute(
+        "select id, operations from edit_journal where undone = 0 "
+        "order by id desc limit 1"
+    ).fetchone()
+    if row is None:
+        return None
+    _apply(db, row[0], "before", "after", "desc")
+    db.execute("update edit_journal set undone = 1 where id = ?", (row[0],))
+    return {"edit_id": row[0], "operations": json.loads(row[1])}
+
+
+def redo(db) -> dict | None:
+    """Apply the first undone edit again, None if there is none."""
+    row = db.execute(
+        "select id, operations from edit_journal where undone = 1 "
+        "order by id limit 1"
+    ).fetchone()
+    if row is None:
+        return None
+    _apply(db, row[0], "after", "before", "asc")
+    db.execute("update edit_journal set undone = 0 where id = ?", (row[0],))
+    return {"edit_id": row[0], "operations": json.loads(row[1])}
+
+
+def compact(db, last_id: int) -> None:
+    """Keep the newest ``ALIGNER_EDIT_JOURNAL_SIZE`` edits."""
+    _delete_edits(db, "id <= ?", (last_id - config.ALIGNER_EDIT_JOURNAL_SIZE,))
+
+
+def clear(db) -> None:
+    """Forget the history, the rows it refers to were rebuilt."""
+    db.execute("delete from edit_journal_changes")
+    db.execute("delete from edit_journal")
+
+
+def _apply(db, edit_id: int, state: str, expected: str, order: str) -> None:
+    changes = db.execute(
+        f"select tbl, row_id, {state}, {expected} from edit_journal_changes "
+        f"where edit_id = ? order by id {order}",
+        (edit_id,),
+    ).fetchall()
+    for table, row_id, _, current in changes:
+        if table not in TABLES:
+            raise JournalConflict(f"Unknown table {table} in edit {edit_id}")
+        if _read_row(db, table, row_id) != _load(current):
+            raise JournalConflict(f"Row {row_id} of {table} changed since edit {edit_id}")
+    for table, row_id, value, _ in changes:
+        value = _load(value)
+        db.execute(f"delete from {table} where id = ?", (row_id,))
+        if value is not None:
+            columns = list(value)
+            db.execute(
+                f"insert into {table}({', '.join(columns)}) "
+                f"values ({', '.join('?' * len(columns))})",
+                [value[x] for x in columns],
+            )
+
+
+def _delete_edits(db, where: str, params=()) -> None:
+    db.execute(
+        "delete from edit_journal_changes where edit_id in "
+        f"(select id from edit_journal where {where})",
+        params,
+    )
+    db.execute(f"delete from edit_journal where {where}", params)
+
+
+def _read_row(db, table: str, row_id: int) -> dict | None:
+    cur = db.execute(f"select * from {table} where id = ?", (row_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return {d[0]: value for d, value in zip(cur.description, row)}
+
+
+def _dump(value) -> str | None:
+    return None if value is None else json.dumps(value)
+
+
+def _load(value):
+    return None if value is None else json.loads(value)
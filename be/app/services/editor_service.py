@@ -2,9 +2,18 @@
 
 import json
 import logging
-import sqlite3
+from collections import defaultdict
 
 from app.models.alignment import Alignment
+from app.services import (
+    alignment_db,
+    alignment_lock,
+    doc_index_store,
+    edit_journal,
+    line_edit,
+    line_store,
+)
+from app.services.doc_index_cache import LinePosition, doc_index_cache
 from app.services.file_storage import get_alignment_db_path
 
 logger = logging.getLogger(__name__)
@@ -22,6 +31,8 @@ EDIT_TRY_SET_LINE_IDS = "edit_try_set_line_ids"
 ADD_EMPTY_LINE_BEFORE = "add_empty_line_before"
 ADD_EMPTY_LINE_AFTER = "add_empty_line_after"
 
+SQL_VARIABLES_LIMIT = 900
+
 
 def _get_db_path(user_id: int, alignment: Alignment) -> str:
     return str(
@@ -78,33 +89,86 @@ def _add_empty_processing_line(db, batch_id):
     return from_id, to_id
 
 
-def _get_processing_text(db_path, text_type, processing_id):
-    with sqlite3.connect(db_path) as db:
-        if text_type == TYPE_FROM:
-            cur = db.execute(
-                "select text from processing_from where id = :id",
-                {"id": processing_id},
-            )
-        else:
-            cur = db.execute(
-                "select text from processing_to where id = :id",
-                {"id": processing_id},
-            )
-        res = cur.fetchone()
+def _get_doc_items(db_path, index_items):
+    """Same as ``helper.get_doc_items`` on one pooled connection."""
+    from_ids, to_ids = set(), set()
+    for (entry, _), _ in index_items:
+        from_ids.update(json.loads(entry[1]))
+        to_ids.update(json.loads(entry[3]))
+
+    with alignment_db.snapshot(db_path) as db:
+        proxy_from = _get_proxy_dict(db, "splitted_from", from_ids)
+        proxy_to = _get_proxy_dict(db, "splitted_to", to_ids)
+        texts = {}
+        ids = [entry[0] for (entry, _), _ in index_items]
+        for chunk_start in range(0, len(ids), SQL_VARIABLES_LIMIT):
+            chunk = ids[chunk_start : chunk_start + SQL_VARIABLES_LIMIT]
+            for processing_id, batch_id, text_from, text_to in db.execute(
+                "select f.id, f.batch_id, f.text, t.text from processing_from f "
+                "join processing_to t on t.id = f.id "
+                f"where f.id in ({','.join('?' * len(chunk))})",
+                chunk,
+            ):
+                texts[processing_id] = (text_from, text_to, batch_id)
+
+    res = []
+    for ((entry, batch_index_id), index_id) in index_items:
+        if entry[0] not in texts:
+            continue
+        text_from, text_to, batch_id = texts[entry[0]]
+        res.append(
+            {
+                "index_id": index_id,
+                "batch_id": batch_id,
+                "batch_index_id": batch_index_id,
+                "text_from": text_from,
+                "line_id_from": entry[1],
+                "processing_from_id": entry[0],
+                "text_to": text_to,
+                "line_id_to": entry[3],
+                "processing_to_id": entry[2],
+            }
+        )
+    return res, proxy_from, proxy_to
+
+
+def _get_proxy_dict(db, table, ids):
+    res = {}
+    ids = list(ids)
+    for chunk_start in range(0, len(ids), SQL_VARIABLES_LIMIT):
+        chunk = ids[chunk_start : chunk_start + SQL_VARIABLES_LIMIT]
+        for line_id, proxy in db.execute(
+            f"select id, proxy_text from {table} where id in ({','.join('?' * len(chunk))})",
+            chunk,
+        ):
+            res[line_id] = proxy
+    return res
+
+
+def _get_processing_text(db, text_type, processing_id):
+    if text_type == TYPE_FROM:
+        cur = db.execute(
+            "select text from processing_from where id = :id",
+            {"id": processing_id},
+        )
+    else:
+        cur = db.execute(
+            "select text from processing_to where id = :id",
+            {"id": processing_id},
+        )
+    res = cur.fetchone()
     return res if res else ("",)
 
 
 def get_processing_page(user_id: int, alignment: Alignment, count: int, page: int) -> dict:
-    from lingtrain_aligner import helper
-
     db_path = _get_db_path(user_id, alignment)
     if not _file_exists(db_path):
         return {"items": [], "meta": {}, "proxy_from_dict": {}, "proxy_to_dict": {}}
 
-    index = helper.get_flatten_doc_index(db_path)
+    index = doc_index_cache.get(db_path).items
     shift = (page - 1) * count
     pages = list(zip(index[shift: shift + count], range(shift, shift + count)))
-    res, proxy_from_dict, proxy_to_dict = helper.get_doc_items(pages, db_path)
+    res, proxy_from_dict, proxy_to_dict = _get_doc_items(db_path, pages)
 
     lines_count = len(index)
     total_pages = (lines_count // count) + (1 if lines_count % count != 0 else 0)
@@ -118,15 +182,13 @@ def get_processing_page(user_id: int, alignment: Alignment, count: int, page: in
 
 
 def get_processing_by_ids(user_id: int, alignment: Alignment, index_ids: list[int]) -> dict:
-    from lingtrain_aligner import helper
-
     db_path = _get_db_path(user_id, alignment)
-    index = helper.get_flatten_doc_index(db_path)
-    index_items = [(index[i], i) for i in index_ids if i < len(index)]
-    data, proxy_from_dict, proxy_to_dict = helper.get_doc_items(index_items, db_path)
+    index = doc_index_cache.get(db_path).items
+    index_items = [(index[i], i) for i in index_ids if 0 <= i < len(index)]
+    data, proxy_from_dict, proxy_to_dict = _get_doc_items(db_path, index_items)
 
     res = {}
-    valid_ids = [i for i in index_ids if i < len(index)]
+    valid_ids = [i for i in index_ids if 0 <= i < len(index)]
     for i, item in zip(valid_ids, data):
         res[i] = item
 
@@ -139,165 +201,249 @@ def get_processing_by_ids(user_id: int, alignment: Alignment, index_ids: list[in
 
 def get_processing_meta(user_id: int, alignment: Alignment) -> dict:
     db_path = _get_db_path(user_id, alignment)
-    with sqlite3.connect(db_path) as db:
+    with alignment_db.connect(db_path) as db:
         batch_ids = [x[0] for x in db.execute("select batch_id from batches").fetchall()]
     return {"batch_ids": batch_ids, "align_guid": alignment.guid}
 
 
 def get_doc_index(user_id: int, alignment: Alignment) -> list:
-    from lingtrain_aligner import helper
-
     db_path = _get_db_path(user_id, alignment)
-    return helper.get_clear_flatten_doc_index(db_path)
+    return doc_index_cache.get(db_path).entries
+
+
+class EditError(Exception):
+    """An edit operation that can not be applied to the document index."""
+
+    def __init__(self, message: str, position: int = 0):
+        super().__init__(message)
+        self.position = position
 
 
 def edit_doc(user_id: int, alignment: Alignment, data) -> None:
-    from lingtrain_aligner import aligner, helper
+    try:
+        edit_doc_batch(user_id, alignment, [data])
+    except EditError as e:
+        # a single edit that does not fit the index is ignored, as before
+        logger.debug(f"Edit {data.operation} skipped: {e}")
+
+
+def edit_doc_batch(user_id: int, alignment: Alignment, operations: list) -> None:
+    """Apply the edits in order in one transaction, all of them or none.
 
+    Every edit sees the index as left by the previous ones. Raises
+    ``EditError`` with the position of the first edit that does not apply
+    and ``AlignmentBusy`` while a job writes the alignment.
+    """
     db_path = _get_db_path(user_id, alignment)
+    doc_index_store.ensure_schema(db_path)
+    # line lookups use the cached index while it is still current
+    flat = (
+        doc_index_cache.get(db_path)
+        if any(x.operation == EDIT_TRY_SET_LINE_IDS for x in operations)
+        else None
+    )
 
-    update_index = True
+    with alignment_lock.editing(db_path), alignment_db.connect(db_path) as db:
+        db.execute("begin immediate")
+        index = doc_index_store.IndexRows(db, edit_journal.Journal(db))
+        for position, data in enumerate(operations):
+            try:
+                _apply_edit(db, index, flat, data)
+            except EditError as e:
+                e.position = position
+                raise
+        index.journal.save([x.operation for x in operations])
+        index.save()
+        update = index.update()
+    doc_index_cache.update(db_path, update)
 
-    with sqlite3.connect(db_path) as db:
-        index = aligner.get_doc_index(db)
 
-        if (
-            data.batch_id < 0
-            or data.batch_id >= len(index)
-            or data.batch_index_id < 0
-            or data.batch_index_id > len(index[data.batch_id])
-        ):
-            return
+def undo_edit(user_id: int, alignment: Alignment) -> dict | None:
+    """Revert the last edit, None if there is nothing to undo."""
+    return _replay_edit(user_id, alignment, edit_journal.undo)
 
-        direction = 3 if data.text_type == TYPE_TO else 1
-        line_ids = _parse_json_array(index[data.batch_id][data.batch_index_id][direction])
 
-        if data.operation in (EDIT_ADD_PREV_END, EDIT_ADD_NEXT_END):
-            target_batch_id = data.batch_id
-            if data.target == "next":
-                if data.batch_index_id + 1 >= len(index[data.batch_id]):
-                    target_batch_id = data.batch_id + 1
-                    target_index_id = 0
-                else:
-                    target_index_id = data.batch_index_id + 1
+def redo_edit(user_id: int, alignment: Alignment) -> dict | None:
+    """Apply the last undone edit again, None if there is nothing to redo."""
+    return _replay_edit(user_id, alignment, edit_journal.redo)
+
+
+def _replay_edit(user_id: int, alignment: Alignment, step) -> dict | None:
+    db_path = _get_db_path(user_id, alignment)
+    doc_index_store.ensure_schema(db_path)
+    with alignment_lock.editing(db_path), alignment_db.connect(db_path) as db:
+        db.execute("begin immediate")
+        index = doc_index_store.IndexRows(db)
+        try:
+            res = step(db)
+        except edit_journal.JournalConflict:
+            db.rollback()
+            db.execute("begin immediate")
+            edit_journal.clear(db)
+            db.commit()
+            raise
+        if res is not None:
+            index.changed = True
+            index.save()
+        return res
+
+
+def _touch_processing(index, text_type, processing_id, inserted=False):
+    table = "processing_to" if text_type == TYPE_TO else "processing_from"
+    if index.journal is not None:
+        index.journal.touch(table, processing_id, inserted)
+
+
+def _apply_edit(db, index, flat, data) -> None:
+    if (
+        data.batch_id < 0
+        or data.batch_id >= len(index)
+        or data.batch_index_id < 0
+        or data.batch_index_id > index.batch_len(data.batch_id)
+    ):
+        raise EditError(f"No line {data.batch_index_id} in batch {data.batch_id}")
+
+    entry = index.entry(data.batch_id, data.batch_index_id)
+    if entry is None:
+        raise EditError(f"No line {data.batch_index_id} in batch {data.batch_id}")
+    line_ids = _parse_json_array(entry.line_ids(data.text_type))
+
+    if data.operation in (EDIT_ADD_PREV_END, EDIT_ADD_NEXT_END):
+        target_batch_id = data.batch_id
+        if data.target == "next":
+            if data.batch_index_id + 1 >= index.batch_len(data.batch_id):
+                target_batch_id = data.batch_id + 1
+                target_index_id = 0
             else:
-                if data.batch_index_id - 1 < 0:
-                    if target_batch_id > 0:
-                        target_batch_id = data.batch_id - 1
-                        target_index_id = len(index[target_batch_id]) - 1
-                    else:
-                        return
+                target_index_id = data.batch_index_id + 1
+        else:
+            if data.batch_index_id - 1 < 0:
+                if target_batch_id > 0:
+                    target_batch_id = data.batch_id - 1
+                    target_index_id = index.batch_len(target_batch_id) - 1
                 else:
-                    target_index_id = data.batch_index_id - 1
+                    raise EditError("No line before the first one")
+            else:
+                target_index_id = data.batch_index_id - 1
 
-            if target_batch_id >= len(index) or target_index_id >= len(
-                index[target_batch_id]
-            ):
-                return
-
-            processing_target_id = index[target_batch_id][target_index_id][0]
-            text_to_edit = _get_processing_text(db_path, data.text_type, processing_target_id)[0]
-            text_to_update = (text_to_edit + data.text).strip()
-
-            processing_text_ids = _parse_json_array(
-                index[target_batch_id][target_index_id][direction]
-            )
-            new_ids = processing_text_ids + line_ids
-            new_ids = json.dumps(sorted(list(set(new_ids))))
-
-            index[target_batch_id][target_index_id][direction] = new_ids
-            _update_processing(db, data.text_type, processing_target_id, new_ids, text_to_update)
-
-        elif data.operation == EDIT_ADD_CANDIDATE_END:
-            processing_target_id = index[data.batch_id][data.batch_index_id][0]
-            text_to_edit = _get_processing_text(db_path, data.text_type, processing_target_id)[0]
-            text_to_update = (text_to_edit + data.candidate_text).strip()
-
-            processing_text_ids = _parse_json_array(
-                index[data.batch_id][data.batch_index_id][direction]
-            )
-            new_ids = processing_text_ids + [data.candidate_line_id]
-            new_ids = json.dumps(sorted(list(set(new_ids))))
-
-            index[data.batch_id][data.batch_index_id][direction] = new_ids
-            _update_processing(db, data.text_type, processing_target_id, new_ids, text_to_update)
-
-        elif data.operation == ADD_EMPTY_LINE_BEFORE:
-            from_id, to_id = _add_empty_processing_line(db, data.batch_id)
-            index[data.batch_id].insert(data.batch_index_id, (from_id, "[]", to_id, "[]"))
-
-        elif data.operation == ADD_EMPTY_LINE_AFTER:
-            from_id, to_id = _add_empty_processing_line(db, data.batch_id)
-            index[data.batch_id].insert(data.batch_index_id + 1, (from_id, "[]", to_id, "[]"))
-
-        elif data.operation == EDIT_LINE:
-            processing_target_id = index[data.batch_id][data.batch_index_id][0]
-            _update_processing(
-                db, data.text_type, processing_target_id, json.dumps(line_ids), data.text
-            )
-            update_index = False
-
-        elif data.operation == EDIT_CLEAR_LINE:
-            processing_target_id = index[data.batch_id][data.batch_index_id][0]
-            index[data.batch_id][data.batch_index_id][direction] = "[]"
-            _clear_processing(db, data.text_type, processing_target_id)
-
-        elif data.operation == EDIT_DELETE_LINE:
-            index[data.batch_id].pop(data.batch_index_id)
-
-        elif data.operation == EDIT_TRY_SET_LINE_IDS:
-            lines_to_edit = []
-            for bid, batch in enumerate(index):
-                for id, line_info in enumerate(batch):
-                    actual_ids = _parse_json_array(line_info[1])
-                    if len(actual_ids) == 1 and actual_ids[0] == data.line_id_from:
-                        lines_to_edit.append({
-                            "batch_id": bid, "batch_index_id": id,
-                            "line_info": line_info, "update_to": data.line_id_to,
-                        })
-                    elif len(actual_ids) == 1 and actual_ids[0] == data.line_id_from + 1:
-                        lines_to_edit.append({
-                            "batch_id": bid, "batch_index_id": id,
-                            "line_info": line_info, "update_to": data.line_id_to + 1,
-                        })
-                    if len(lines_to_edit) == 2:
-                        break
-                else:
-                    continue
-                break
-
-            if len(lines_to_edit) < 2:
-                return
-
-            direction = 3  # right side (to)
-            for line in lines_to_edit:
-                processing_target_id = index[line["batch_id"]][line["batch_index_id"]][2]
-                new_ids = json.dumps([line["update_to"]])
-                text = helper.get_splitted_to_by_id(db_path, [line["update_to"]])
-                if not text:
-                    return
-                text = text[0][1]
-                _update_processing(db, TYPE_TO, processing_target_id, new_ids, text)
-                index[line["batch_id"]][line["batch_index_id"]][direction] = new_ids
+        target = (
+            index.entry(target_batch_id, target_index_id)
+            if target_batch_id < len(index)
+            else None
+        )
+        if target is None:
+            raise EditError(f"No {data.target or 'prev'} line to add the text to")
+
+        text_to_edit = _get_processing_text(db, data.text_type, target.from_id)[0]
+        text_to_update = (text_to_edit + data.text).strip()
+
+        processing_text_ids = _parse_json_array(target.line_ids(data.text_type))
+        new_ids = processing_text_ids + line_ids
+        new_ids = json.dumps(sorted(list(set(new_ids))))
+
+        index.set_line_ids(target.id, data.text_type, new_ids)
+        _touch_processing(index, data.text_type, target.from_id)
+        _update_processing(db, data.text_type, target.from_id, new_ids, text_to_update)
+
+    elif data.operation == EDIT_ADD_CANDIDATE_END:
+        text_to_edit = _get_processing_text(db, data.text_type, entry.from_id)[0]
+        text_to_update = (text_to_edit + data.candidate_text).strip()
+
+        new_ids = line_ids + [data.candidate_line_id]
+        new_ids = json.dumps(sorted(list(set(new_ids))))
+
+        index.set_line_ids(entry.id, data.text_type, new_ids)
+        _touch_processing(index, data.text_type, entry.from_id)
+        _update_processing(db, data.text_type, entry.from_id, new_ids, text_to_update)
+
+    elif data.operation == ADD_EMPTY_LINE_BEFORE:
+        from_id, to_id = _add_empty_processing_line(db, data.batch_id)
+        _touch_processing(index, TYPE_FROM, from_id, inserted=True)
+        _touch_processing(index, TYPE_TO, to_id, inserted=True)
+        index.insert(data.batch_id, data.batch_index_id, (from_id, "[]", to_id, "[]"))
+
+    elif data.operation == ADD_EMPTY_LINE_AFTER:
+        from_id, to_id = _add_empty_processing_line(db, data.batch_id)
+        _touch_processing(index, TYPE_FROM, from_id, inserted=True)
+        _touch_processing(index, TYPE_TO, to_id, inserted=True)
+        index.insert(
+            data.batch_id, data.batch_index_id + 1, (from_id, "[]", to_id, "[]")
+        )
 
+    elif data.operation == EDIT_LINE:
+        _touch_processing(index, data.text_type, entry.from_id)
+        _update_processing(
+            db, data.text_type, entry.from_id, json.dumps(line_ids), data.text
+        )
+
+    elif data.operation == EDIT_CLEAR_LINE:
+        index.set_line_ids(entry.id, data.text_type, "[]")
+        _touch_processing(index, data.text_type, entry.from_id)
+        _clear_processing(db, data.text_type, entry.from_id)
+
+    elif data.operation == EDIT_DELETE_LINE:
+        index.delete(entry.id)
+
+    elif data.operation == EDIT_TRY_SET_LINE_IDS:
+        line_ids = (data.line_id_from, data.line_id_from + 1)
+        if flat is not None and not index.changed and flat.version == index.stamp():
+            lines_to_edit = [
+                index.entry(x.batch_id, x.batch_index_id)
+                for x in flat.find_single(TYPE_FROM, line_ids, limit=2)
+            ]
         else:
-            return
+            lines_to_edit = index.with_single_line_id(TYPE_FROM, line_ids, limit=2)
+        if len(lines_to_edit) < 2:
+            raise EditError(f"Lines {line_ids} are not aligned one to one")
+
+        for line in lines_to_edit:
+            # the line mapped to line_id_from + 1 moves to line_id_to + 1
+            shift = _parse_json_array(line.from_ids)[0] - data.line_id_from
+            update_to = data.line_id_to + shift
+            text = db.execute(
+                "select text from splitted_to where id = :id", {"id": update_to}
+            ).fetchone()
+            if not text:
+                raise EditError(f"No line {update_to} in the target text")
+            new_ids = json.dumps([update_to])
+            _touch_processing(index, TYPE_TO, line.to_id)
+            _update_processing(db, TYPE_TO, line.to_id, new_ids, text[0])
+            index.set_line_ids(line.id, TYPE_TO, new_ids)
 
-        if update_index:
-            aligner.update_doc_index(db, index)
+    else:
+        raise EditError(f"Unknown operation {data.operation}")
 
 
-def split_sentence(user_id: int, alignment: Alignment, data) -> None:
-    from lingtrain_aligner import aligner, helper
+def split_sentence(user_id: int, alignment: Alignment, data) -> bool:
+    """Split a line in two, False if there is no such line."""
+    db_path = _get_db_path(user_id, alignment)
+    return _change_lines(
+        db_path,
+        lambda db: line_edit.split_line(
+            db, data.direction, data.line_id, data.part1, data.part2
+        ),
+    )
 
+
+def merge_sentences(user_id: int, alignment: Alignment, data) -> bool:
+    """Merge a line with the next one, False if one of them does not exist."""
     db_path = _get_db_path(user_id, alignment)
+    return _change_lines(
+        db_path,
+        lambda db: line_edit.merge_lines(db, data.direction, data.line_id, data.text),
+    )
 
-    helper.ensure_splitted_pk_is_not_exists(db_path, data.direction)
-    helper.insert_new_splitted_line(db_path, data.direction, data.line_id)
-    helper.update_splitted_text(db_path, data.direction, data.line_id, data.part1)
-    helper.update_splitted_text(db_path, data.direction, data.line_id + 1, data.part2)
-    helper.update_processing_mapping(db_path, data.direction, data.line_id)
-    aligner.update_index_mapping(db_path, data.direction, data.line_id)
+
+def _change_lines(db_path: str, change) -> bool:
+    doc_index_store.ensure_schema(db_path)
+    # line ids shift, a job must not align or resolve in between
+    with alignment_lock.editing(db_path):
+        with alignment_db.connect(db_path) as db:
+            db.execute("begin immediate")
+            changed = change(db)
+        if changed:
+            line_store.invalidate(db_path)
+    return changed
 
 
 def get_candidates(
@@ -309,10 +455,8 @@ def get_candidates(
     count_after: int,
     shift: int,
 ) -> list:
-    from lingtrain_aligner import helper
-
     db_path = _get_db_path(user_id, alignment)
-    index = helper.get_clear_flatten_doc_index(db_path)
+    index = doc_index_cache.get(db_path).entries
 
     if index_id < 0 or index_id >= len(index):
         return []
@@ -343,59 +487,59 @@ def get_candidates(
 
 def switch_excluded(user_id: int, alignment: Alignment, line_id: int, text_type: str) -> None:
     db_path = _get_db_path(user_id, alignment)
-    with sqlite3.connect(db_path) as db:
-        table = "splitted_from" if text_type == "from" else "splitted_to"
-        exclude = db.execute(
-            f"select exclude from {table} where id=:id", {"id": line_id}
-        ).fetchone()
-        if exclude:
-            db.execute(
-                f"update {table} set exclude=:exclude where id=:id",
-                {"exclude": (exclude[0] + 1) % 2, "id": line_id},
-            )
+    with alignment_lock.editing(db_path):
+        with alignment_db.connect(db_path) as db:
+            table = "splitted_from" if text_type == "from" else "splitted_to"
+            exclude = db.execute(
+                f"select exclude from {table} where id=:id", {"id": line_id}
+            ).fetchone()
+            if exclude:
+                db.execute(
+                    f"update {table} set exclude=:exclude where id=:id",
+                    {"exclude": (exclude[0] + 1) % 2, "id": line_id},
+                )
+        line_store.invalidate(db_path)
 
 
 def get_splitted_by_ids(
     user_id: int, alignment: Alignment, direction: str, ids: list[int]
 ) -> dict:
-    from lingtrain_aligner import helper
-
     db_path = _get_db_path(user_id, alignment)
     res = {}
     if not ids:
         return res
 
-    if direction == "from":
-        for row in helper.get_splitted_from_by_id(db_path, ids):
-            res[row[0]] = {"t": row[1], "p": row[2] if row[2] else "", "e": row[3] == 1}
-    else:
-        for row in helper.get_splitted_to_by_id(db_path, ids):
-            res[row[0]] = {"t": row[1], "p": row[2] if row[2] else "", "e": row[3] == 1}
+    table = "splitted_from" if direction == "from" else "splitted_to"
+    ids = [int(x) for x in ids]
+    with alignment_db.snapshot(db_path) as db:
+        for chunk_start in range(0, len(ids), SQL_VARIABLES_LIMIT):
+            chunk = ids[chunk_start : chunk_start + SQL_VARIABLES_LIMIT]
+            for line_id, text, proxy, exclude in db.execute(
+                f"select id, text, proxy_text, exclude from {table} "
+                f"where id in ({','.join('?' * len(chunk))})",
+                chunk,
+            ):
+                res[line_id] = {"t": text, "p": proxy if proxy else "", "e": exclude == 1}
 
     return res
 
 
 def get_line_position(
     user_id: int, alignment: Alignment, lang: str, line_id: int
-) -> int:
-    from lingtrain_aligner import helper
-
+) -> LinePosition | None:
     db_path = _get_db_path(user_id, alignment)
-    direction = "from" if lang == alignment.lang_from else "to"
-    index = helper.get_flatten_doc_index(db_path)
-    direction_pos = 1 if direction == "from" else 3
-    for i, item in enumerate(index):
-        ids = json.loads(item[0][direction_pos])
-        if line_id in ids:
-            return i
-    return -1
+    direction = TYPE_FROM if lang == alignment.lang_from else TYPE_TO
+    return doc_index_cache.get(db_path).find_line(direction, line_id)
 
 
 def get_alignment_marks(user_id: int, alignment: Alignment) -> dict:
-    from lingtrain_aligner import helper
-
     db_path = _get_db_path(user_id, alignment)
-    meta_dict = helper.get_meta_dict(db_path)
+    meta_dict = defaultdict(list)
+    with alignment_db.connect(db_path) as db:
+        for key, val, occurence, par_id, mark_id in db.execute(
+            "select key, val, occurence, par_id, id from meta where deleted = 0"
+        ):
+            meta_dict[key].append((val, occurence, par_id, mark_id))
     res = {alignment.lang_from: [], alignment.lang_to: []}
 
     for mark_name in meta_dict:
@@ -417,7 +561,7 @@ def get_alignment_marks(user_id: int, alignment: Alignment) -> dict:
 
 
 def add_alignment_mark(user_id: int, alignment: Alignment, data) -> bool:
-    from lingtrain_aligner import helper, preprocessor
+    from lingtrain_aligner import preprocessor
 
     db_path = _get_db_path(user_id, alignment)
 
@@ -428,15 +572,15 @@ def add_alignment_mark(user_id: int, alignment: Alignment, data) -> bool:
         and data.par_id_from >= 0
         and data.par_id_to >= 0
     ):
-        helper.add_meta(
-            db_path, data.type, data.val_from, data.val_to, data.par_id_from, data.par_id_to
-        )
+        with alignment_db.connect(db_path) as db:
+            _add_meta(db, data.type, data.val_from, data.par_id_from, "from")
+            _add_meta(db, data.type, data.val_to, data.par_id_to, "to")
         return True
     return False
 
 
 def bulk_add_alignment_mark(user_id: int, alignment: Alignment, raw_info: str) -> bool:
-    from lingtrain_aligner import helper, preprocessor
+    from lingtrain_aligner import preprocessor
 
     db_path = _get_db_path(user_id, alignment)
 
@@ -450,40 +594,72 @@ def bulk_add_alignment_mark(user_id: int, alignment: Alignment, raw_info: str) -
         if len(x.split(",")) > 2
     ]
     info.sort(key=lambda x: x[1])
-    for i in range(0, len(info), 2):
-        if i + 1 < len(info):
-            helper.add_meta(
-                db_path,
-                preprocessor.IMAGE,
-                info[i][0],
-                info[i + 1][0],
-                info[i][1],
-                info[i + 1][1],
-                info[i][2],
-                info[i + 1][2],
-            )
+    with alignment_db.connect(db_path) as db:
+        for i in range(0, len(info) - 1, 2):
+            val_from, par_id_from, comment_from = info[i]
+            val_to, par_id_to, comment_to = info[i + 1]
+            _add_meta(db, preprocessor.IMAGE, val_from, par_id_from, "from", comment_from)
+            _add_meta(db, preprocessor.IMAGE, val_to, par_id_to, "to", comment_to)
     return True
 
 
 def edit_alignment_mark(user_id: int, alignment: Alignment, data) -> bool:
-    from lingtrain_aligner import helper
-
     db_path = _get_db_path(user_id, alignment)
 
     if data.mark_id > 0 and data.operation == "delete":
-        helper.delete_meta(db_path, data.mark_id)
+        with alignment_db.connect(db_path) as db:
+            db.execute("update meta set deleted = 1 where id = ?", (data.mark_id,))
         return True
 
     if data.operation == "edit" and data.value and data.par_id >= 0 and data.mark_id > 0:
-        helper.edit_meta(db_path, data.type, data.direction, data.mark_id, data.par_id, data.value)
+        with alignment_db.connect(db_path) as db:
+            _edit_meta(db, data.type, data.direction, data.mark_id, data.par_id, data.value)
         return True
 
     return False
 
 
+def _add_meta(db, mark, val, par_id, direction, comment="") -> None:
+    """One side of ``helper.add_meta``, later marks of the key move by one."""
+    key = f"{mark}_{direction}"
+    occurence = _shift_meta_occurences(db, key, par_id)
+    db.execute(
+        "insert into meta(key, val, occurence, par_id, comment) values (?, ?, ?, ?, ?)",
+        (key, val, occurence, par_id, comment),
+    )
+
+
+def _edit_meta(db, mark, direction, mark_id, par_id, val) -> None:
+    """Same as ``helper.edit_meta``."""
+    row = db.execute("select par_id from meta where id = ?", (mark_id,)).fetchone()
+    if row is None:
+        return
+    if row[0] == par_id:
+        db.execute("update meta set val = ? where id = ?", (val, mark_id))
+        return
+    _shift_meta_occurences(db, f"{mark}_{direction}", par_id)
+    db.execute(
+        "update meta set val = ?, par_id = ? where id = ?", (val, par_id, mark_id)
+    )
+
+
+def _shift_meta_occurences(db, key, par_id) -> int:
+    """Make room after the last mark of ``key`` up to ``par_id``, returns
+    the occurence of a mark inserted there."""
+    last = db.execute(
+        "select max(occurence) from meta where key = ? and par_id <= ?", (key, par_id)
+    ).fetchone()[0]
+    last = -1 if last is None else last
+    db.execute(
+        "update meta set occurence = occurence + 1 where key = ? and occurence > ?",
+        (key, last),
+    )
+    return last + 1
+
+
 def _get_candidates_page(db_path, text_type, id_from, id_to):
     res = []
-    with sqlite3.connect(db_path) as db:
+    with alignment_db.connect(db_path) as db:
         if text_type == TYPE_FROM:
             for row_id, splitted, proxy in db.execute(
                 "SELECT sf.id, sf.text, sf.proxy_text FROM splitted_from sf WHERE sf.id >= :id_from and sf.id <= :id_to ORDER BY sf.id",
@@ -0,0 +1,70 @@
+"""Embed batching - token budget batches of sentences sorted by length"""
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_LINES = 256
+TUNE_BUDGETS = (256, 512, 1024, 2048, 4096, 8192)
+TUNE_WORDS = (
+    "the old man had not been fishing alone in a skiff in the gulf stream "
+    "and he had gone eighty four days now without taking a fish"
+).split()
+
+
+def token_batches(lengths: list[int], budget: int, max_lines: int = MAX_BATCH_LINES):
+    """Indexes of the lines grouped into batches of similar length.
+
+    A batch is padded to its longest line, so ``lines * longest`` of every
+    batch stays under ``budget``. A line longer than the budget gets its
+    own batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        # lines come sorted, the new one is the longest in the batch
+        longest = max(1, lengths[i])
+        if batch and ((len(batch) + 1) * longest > budget or len(batch) >= max_lines):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def tune_lines(amount: int = 128) -> list[str]:
+    """Synthetic lines of 3 to 60 words, mixed like in a real book."""
+    lines = []
+    for i in range(amount):
+        words = (i * 37) % 58 + 3
+        lines.append(
+            " ".join(TUNE_WORDS[(i + j) % len(TUNE_WORDS)] for j in range(words))
+        )
+    return lines
+
+
+def tune_budget(embed, count_tokens, lines: list[str]) -> int:
+    """Token budget with the best measured throughput on this host.
+
+    ``embed(lines, budget)`` embeds the lines in token budget batches and
+    ``count_tokens(lines)`` returns their lengths. Budgets are tried from
+    the smallest one, the search stops once throughput starts to fall.
+    """
+    longest = max(count_tokens(lines))
+    best_budget, best_speed = TUNE_BUDGETS[0], 0.0
+    embed(lines[:8], TUNE_BUDGETS[0])
+    for budget in TUNE_BUDGETS:
+        if budget < longest:
+            continue
+        started = time.perf_counter()
+        embed(lines, budget)
+        speed = len(lines) / max(time.perf_counter() - started, 1e-9)
+        logger.debug("Token budget %d: %.1f lines/s", budget, speed)
+        if speed <= best_speed:
+            break
+        best_budget, best_speed = budget, speed
+    logger.info("Token budget %d tuned, %.1f lines/s", best_budget, best_speed)
+    return best_budget
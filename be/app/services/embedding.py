@@ -0,0 +1,184 @@
+"""Embedding model adapter used by the alignment workers"""
+
+import logging
+
+import numpy as np
+
+from app import config
+from app.services.embed_batching import token_batches, tune_budget, tune_lines
+from app.services.embedding_cache import get_cache
+from app.services.hashing_model import HASHING_MODEL, HashingModel, is_hashing_model
+from app.services.quantized_model import (
+    BACKEND_TORCH,
+    BACKEND_TORCH_INT8,
+    BACKENDS,
+    load_quantized,
+)
+
+logger = logging.getLogger(__name__)
+
+WARMUP_LINES = ["Lingtrain warm up sentence."]
+
+
+class EmbeddingModel:
+    """Sentence embedding model with the encode() interface of lingtrain_aligner.
+
+    An instance lives for the whole lifetime of a pool worker, so the model
+    weights are loaded once and reused by every batch the worker processes.
+    It is passed as ``model=`` to ``aligner.process_batch`` and
+    ``resolver.resolve_all_conflicts``. Vectors are looked up in the
+    persistent embedding cache first, only missing sentences are embedded.
+
+    With ``ALIGNER_BACKEND="torch-int8"`` the worker embeds with an int8
+    copy of the model. Its vectors are cached apart from the float ones.
+
+    Missing sentences are sorted by token length and embedded in batches
+    under a token budget instead of a fixed number of lines, so short lines
+    share a call and long ones are not padded to each other's length.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.is_loaded = False
+        self.backend = BACKEND_TORCH
+        self.cache = get_cache(model_name)
+        self.token_budget = config.ALIGNER_EMBED_TOKEN_BUDGET
+        self._encoder = None
+        self._tokenizer = None
+        self._max_length = None
+
+    def load(self) -> None:
+        """Load the model weights by embedding a warm up sentence."""
+        if is_hashing_model(self.model_name):
+            self._encoder = HashingModel.from_name(self.model_name)
+            self.backend = HASHING_MODEL
+        elif config.ALIGNER_BACKEND == BACKEND_TORCH_INT8:
+            try:
+                self._encoder = load_quantized(self.model_name)
+            except Exception as e:
+                logger.warning(f"Int8 backend is not available, using float model: {e}")
+            if self._encoder is not None:
+                self.backend = BACKEND_TORCH_INT8
+                self.cache = get_cache(f"{self.model_name}@int8")
+        elif config.ALIGNER_BACKEND != BACKEND_TORCH:
+            logger.warning(
+                "Unknown aligner backend %s, expected one of %s",
+                config.ALIGNER_BACKEND,
+                ", ".join(BACKENDS),
+            )
+
+        self._embed_lines(WARMUP_LINES, config.ALIGNER_EMBED_BATCH_SIZE, True, False)
+        self._find_tokenizer()
+        if self._tokenizer is None:
+            # rubert_tiny and sonar embed line by line, batching changes nothing
+            self.token_budget = -1
+        elif self.token_budget == 0:
+            self.token_budget = tune_budget(
+                lambda lines, budget: self._embed_bucketed(
+                    lines, budget, config.ALIGNER_NORMALIZE_EMBEDDINGS
+                ),
+                self._token_lengths,
+                tune_lines(),
+            )
+        self.is_loaded = True
+        logger.info(
+            "Model %s is loaded (%s, token budget %d)",
+            self.model_name,
+            self.backend,
+            self.token_budget,
+        )
+
+    def encode(
+        self,
+        lines,
+        batch_size: int = config.ALIGNER_EMBED_BATCH_SIZE,
+        normalize_embeddings: bool = config.ALIGNER_NORMALIZE_EMBEDDINGS,
+        show_progress_bar: bool = False,
+        **kwargs,
+    ):
+        lines = list(lines)
+        if self.cache is None or not lines:
+            return self._embed(
+                lines, batch_size, normalize_embeddings, show_progress_bar
+            )
+
+        keys = [self.cache.make_key(line, normalize_embeddings) for line in lines]
+        try:
+            found = self.cache.get_many(keys)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            found = {}
+
+        texts = dict(zip(keys, lines))
+        missing = [k for k in texts if k not in found]
+        if missing:
+            vecs = self._embed(
+                [texts[k] for k in missing],
+                batch_size,
+                normalize_embeddings,
+                show_progress_bar,
+            )
+            # round fresh vectors like cached ones, results do not depend on cache state
+            computed = {
+                k: np.asarray(v, dtype=np.float16).astype(np.float32)
+                for k, v in zip(missing, vecs)
+            }
+            try:
+                self.cache.put_many(computed)
+            except Exception as e:
+                logger.warning(f"Embedding cache update failed: {e}")
+            found.update(computed)
+
+        return np.array([found[k] for k in keys], dtype=np.float32)
+
+    def _embed(self, lines, batch_size, normalize_embeddings, show_progress_bar):
+        if self.token_budget <= 0 or len(lines) < 2:
+            return self._embed_lines(
+                lines, batch_size, normalize_embeddings, show_progress_bar
+            )
+        return self._embed_bucketed(lines, self.token_budget, normalize_embeddings)
+
+    def _embed_bucketed(self, lines, budget, normalize_embeddings):
+        vecs = [None] * len(lines)
+        for batch in token_batches(self._token_lengths(lines), budget):
+            batch_vecs = self._embed_lines(
+                [lines[i] for i in batch], len(batch), normalize_embeddings, False
+            )
+            for i, vec in zip(batch, batch_vecs):
+                vecs[i] = vec
+        return np.array(vecs, dtype=np.float32)
+
+    def _token_lengths(self, lines):
+        ids = self._tokenizer(
+            list(lines),
+            add_special_tokens=True,
+            truncation=self._max_length is not None,
+            max_length=self._max_length,
+        )["input_ids"]
+        return [len(x) for x in ids]
+
+    def _find_tokenizer(self) -> None:
+        """Tokenizer of the loaded SentenceTransformer, if the model is one."""
+        from lingtrain_aligner import aligner, model_dispatcher
+        from sentence_transformers import SentenceTransformer
+
+        model = self._encoder
+        if model is None and self.model_name in model_dispatcher.models:
+            model = model_dispatcher.models[self.model_name].model
+        elif model is None and aligner.custom_model_name == self.model_name:
+            model = aligner.custom_model
+        if isinstance(model, SentenceTransformer):
+            self._tokenizer = model.tokenizer
+            self._max_length = model.max_seq_length
+
+    def _embed_lines(self, lines, batch_size, normalize_embeddings, show_progress_bar):
+        from lingtrain_aligner import aligner
+
+        return aligner.get_line_vectors(
+            lines,
+            self.model_name,
+            batch_size,
+            normalize_embeddings,
+            show_progress_bar,
+            model=self._encoder,
+        )
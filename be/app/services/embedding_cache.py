@@ -0,0 +1,230 @@
+"""Embedding cache - persistent sentence vectors shared by all alignment workers"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+
+import numpy as np
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.db"
+VECTORS_FILE = "vectors.f16"
+TAGS_FILE = "tags.u64"
+
+_spaces = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _spaces.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+class EmbeddingCache:
+    """On-disk cache of sentence embeddings for a single model.
+
+    Vectors are stored as float16 rows of a memory-mapped file. A small
+    SQLite index maps the content hash of (model, normalization flag,
+    normalized text) to a row slot and keeps the last access time used for
+    LRU eviction once the size cap is reached. Every slot also carries the
+    key's tag in a second memory-mapped array, so a reader never returns a
+    vector whose slot was concurrently recycled by another worker.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, max_bytes: int):
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.dir = os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", model_name))
+        os.makedirs(self.dir, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(self.dir, INDEX_FILE), timeout=30, isolation_level=None
+        )
+        self._db.execute(
+            "create table if not exists entries(key text primary key, slot integer unique, last_used real)"
+        )
+        self._db.execute(
+            "create table if not exists meta(key text primary key, val integer)"
+        )
+        self.dim = None
+        self.capacity = None
+        self._vectors = None
+        self._tags = None
+        self._load_meta()
+
+    def make_key(self, text: str, normalize_embeddings: bool) -> str:
+        raw = f"{self.model_name}\x00{int(bool(normalize_embeddings))}\x00{normalize_text(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        """Return cached vectors for the known keys."""
+        res = {}
+        if self._vectors is None:
+            self._load_meta()
+        if self._vectors is None or not keys:
+            return res
+
+        unique_keys = list(dict.fromkeys(keys))
+        slots = {}
+        for chunk in _chunks(unique_keys, 500):
+            placeholders = ",".join("?" * len(chunk))
+            for key, slot in self._db.execute(
+                f"select key, slot from entries where key in ({placeholders})", chunk
+            ):
+                slots[key] = slot
+
+        for key, slot in slots.items():
+            vec = np.array(self._vectors[slot], dtype=np.float32)
+            if self._tags[slot] == _tag(key):
+                res[key] = vec
+
+        if res:
+            now = time.time()
+            self._db.execute("begin immediate")
+            try:
+                self._db.executemany(
+                    "update entries set last_used=? where key=?",
+                    [(now, key) for key in res],
+                )
+                self._db.execute("commit")
+            except Exception:
+                self._db.execute("rollback")
+                raise
+        return res
+
+    def put_many(self, items: dict[str, np.ndarray]) -> None:
+        """Store vectors, evicting the least recently used ones if full."""
+        if not items:
+            return
+        if self._vectors is None:
+            self._init_storage(len(next(iter(items.values()))))
+
+        now = time.time()
+        self._db.execute("begin immediate")
+        try:
+            self._load_meta()
+            known = set()
+            keys = list(items)
+            for chunk in _chunks(keys, 500):
+                placeholders = ",".join("?" * len(chunk))
+                known.update(
+                    x[0]
+                    for x in self._db.execute(
+                        f"select key from entries where key in ({placeholders})",
+                        chunk,
+                    )
+                )
+            new_keys = [k for k in keys if k not in known][: self.capacity]
+            if not new_keys:
+                self._db.execute("commit")
+                return
+
+            used = self._db.execute("select count(*) from entries").fetchone()[0]
+            free = list(range(used, min(self.capacity, used + len(new_keys))))
+            to_evict = len(new_keys) - len(free)
+            if to_evict > 0:
+                evicted = self._db.execute(
+                    "select key, slot from entries order by last_used limit ?",
+                    (to_evict,),
+                ).fetchall()
+                self._db.executemany(
+                    "delete from entries where key=?", [(x[0],) for x in evicted]
+                )
+                free.extend(x[1] for x in evicted)
+
+            for key, slot in zip(new_keys, free):
+                self._tags[slot] = 0
+                self._vectors[slot] = np.asarray(items[key], dtype=np.float16)
+                self._tags[slot] = _tag(key)
+            self._vectors.flush()
+            self._tags.flush()
+
+            self._db.executemany(
+                "insert into entries(key, slot, last_used) values (?,?,?)",
+                [(key, slot, now) for key, slot in zip(new_keys, free)],
+            )
+            self._db.execute("commit")
+        except Exception:
+            self._db.execute("rollback")
+            raise
+
+    def stats(self) -> dict:
+        count = self._db.execute("select count(*) from entries").fetchone()[0]
+        return {
+            "model": self.model_name,
+            "items": count,
+            "capacity": self.capacity or 0,
+            "dim": self.dim or 0,
+        }
+
+    def _load_meta(self) -> None:
+        meta = dict(self._db.execute("select key, val from meta").fetchall())
+        if "dim" in meta and self._vectors is None:
+            self.dim = meta["dim"]
+            self.capacity = meta["capacity"]
+            self._open_storage()
+
+    def _init_storage(self, dim: int) -> None:
+        self._db.execute("begin immediate")
+        try:
+            meta = dict(self._db.execute("select key, val from meta").fetchall())
+            if "dim" not in meta:
+                capacity = max(1, self.max_bytes // (dim * 2 + 8))
+                self._db.executemany(
+                    "insert into meta(key, val) values (?,?)",
+                    [("dim", dim), ("capacity", capacity)],
+                )
+                # sparse files, pages are allocated on first write
+                with open(os.path.join(self.dir, VECTORS_FILE), "wb") as f:
+                    f.truncate(capacity * dim * 2)
+                with open(os.path.join(self.dir, TAGS_FILE), "wb") as f:
+                    f.truncate(capacity * 8)
+                logger.info(
+                    "Embedding cache for %s created: dim=%d, capacity=%d",
+                    self.model_name,
+                    dim,
+                    capacity,
+                )
+            self._db.execute("commit")
+        except Exception:
+            self._db.execute("rollback")
+            raise
+        self._load_meta()
+
+    def _open_storage(self) -> None:
+        self._vectors = np.memmap(
+            os.path.join(self.dir, VECTORS_FILE),
+            dtype=np.float16,
+            mode="r+",
+            shape=(self.capacity, self.dim),
+        )
+        self._tags = np.memmap(
+            os.path.join(self.dir, TAGS_FILE),
+            dtype=np.uint64,
+            mode="r+",
+            shape=(self.capacity,),
+        )
+
+
+def _tag(key: str) -> int:
+    # never 0, which marks a slot being rewritten
+    return int(key[:16], 16) | 1
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def get_cache(model_name: str) -> EmbeddingCache | None:
+    if config.ALIGNER_EMBED_CACHE_SIZE_MB <= 0:
+        return None
+    return EmbeddingCache(
+        config.ALIGNER_EMBED_CACHE_DIR,
+        model_name,
+        config.ALIGNER_EMBED_CACHE_SIZE_MB * 1024 * 1024,
+    )
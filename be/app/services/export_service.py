@@ -4,6 +4,7 @@ import datetime
 import logging
 
 from app.models.alignment import Alignment
+from app.services import alignment_db, doc_index_store
 from app.services.file_storage import (
     get_alignment_db_path,
     get_download_dir,
@@ -36,6 +37,7 @@ def download_processing(
             user_id, alignment.lang_from, alignment.lang_to, alignment.guid
         )
     )
+    doc_index_store.materialize_path(db_path)
 
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     download_dir = get_download_dir(user_id)
@@ -67,6 +69,8 @@ def download_processing(
     elif file_format == FORMAT_PLAIN:
         saver.save_plain_text(db_path, download_file, side)
     elif file_format == FORMAT_DB:
+        # committed pages may still be in the WAL file next to the DB
+        alignment_db.connections.checkpoint(db_path)
         download_file = db_path
 
     return download_file
@@ -86,6 +90,7 @@ def get_book_preview(
             user_id, alignment.lang_from, alignment.lang_to, alignment.guid
         )
     )
+    doc_index_store.materialize_path(db_path)
 
     if reader.is_empty_cells(db_path):
         return ""
@@ -125,6 +130,7 @@ def download_book(
             user_id, alignment.lang_from, alignment.lang_to, alignment.guid
         )
     )
+    doc_index_store.materialize_path(db_path)
 
     if reader.is_empty_cells(db_path):
         return ""
@@ -0,0 +1,58 @@
+"""Hashing model - deterministic offline stand-in for the sentence model"""
+
+import re
+import zlib
+
+import numpy as np
+
+HASHING_MODEL = "hashing"
+DEFAULT_DIM = 256
+
+_WORD = re.compile(r"\w+")
+
+
+def is_hashing_model(model_name: str) -> bool:
+    return model_name == HASHING_MODEL or model_name.startswith(f"{HASHING_MODEL}-")
+
+
+class HashingModel:
+    """Feature hashing of words and their character trigrams.
+
+    Needs no weights or network and gives the same vectors on every host,
+    lines sharing words get similar vectors. Used for benchmarks and local
+    runs with ``ALIGNER_MODEL="hashing"`` or ``"hashing-<dim>"``.
+    """
+
+    def __init__(self, dim: int = DEFAULT_DIM):
+        self.dim = dim
+
+    @classmethod
+    def from_name(cls, model_name: str) -> "HashingModel":
+        _, _, dim = model_name.partition("-")
+        return cls(int(dim) if dim else DEFAULT_DIM)
+
+    def encode(
+        self,
+        sentences,
+        batch_size: int = 32,
+        normalize_embeddings: bool = False,
+        show_progress_bar: bool = False,
+        **kwargs,
+    ):
+        vecs = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for i, line in enumerate(sentences):
+            for feature in _features(line):
+                h = zlib.crc32(feature.encode("utf-8"))
+                vecs[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+            vecs /= np.where(norms == 0, 1, norms)
+        return vecs
+
+
+def _features(line: str):
+    for word in _WORD.findall(line.lower()):
+        yield word
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            yield padded[i : i + 3]
@@ -0,0 +1,64 @@
+"""Index version - change counter of the document index of an alignment DB"""
+
+import logging
+import sqlite3
+import threading
+
+from app.services import alignment_db
+
+logger = logging.getLogger(__name__)
+
+# Triggers bump the counter on every write to doc_index, whoever makes it:
+# the editor, batch commits or lingtrain_aligner's resolver in a worker.
+_SCHEMA = """
+create table if not exists doc_index_version(
+    id integer primary key check (id = 1),
+    version integer not null
+);
+insert or ignore into doc_index_version(id, version) values (1, 0);
+create trigger if not exists doc_index_version_insert after insert on doc_index
+begin
+    update doc_index_version set version = version + 1 where id = 1;
+end;
+create trigger if not exists doc_index_version_update after update on doc_index
+begin
+    update doc_index_version set version = version + 1 where id = 1;
+end;
+create trigger if not exists doc_index_version_delete after delete on doc_index
+begin
+    update doc_index_version set version = version + 1 where id = 1;
+end;
+"""
+
+_installed: set[str] = set()
+_lock = threading.Lock()
+
+
+def ensure_version_tracking(db_path: str) -> None:
+    """Install the version table and triggers once per alignment DB."""
+    if db_path in _installed:
+        return
+    with _lock:
+        if db_path in _installed:
+            return
+        with alignment_db.connect(db_path) as db:
+            db.executescript(_SCHEMA)
+        _installed.add(db_path)
+
+
+def get_version(db_path: str) -> int:
+    ensure_version_tracking(db_path)
+    try:
+        row = _read_version(db_path)
+    except sqlite3.OperationalError:
+        # the DB file was replaced after tracking had been installed
+        with _lock:
+            _installed.discard(db_path)
+        ensure_version_tracking(db_path)
+        row = _read_version(db_path)
+    return row[0] if row else 0
+
+
+def _read_version(db_path: str):
+    with alignment_db.connect(db_path) as db:
+        return db.execute("select version from doc_index_version where id = 1").fetchone()
@@ -0,0 +1,109 @@
+"""Job store - durable alignment job records for resuming after a restart"""
+
+import logging
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models.alignment_job import AlignmentJob, AlignmentJobState
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED = (AlignmentJobState.QUEUED, AlignmentJobState.RUNNING)
+
+
+def create_job(
+    db: Session,
+    alignment_id: int,
+    user_id: int,
+    kind: str,
+    priority: int,
+    tasks: int,
+    params: dict,
+) -> AlignmentJob:
+    record = AlignmentJob(
+        alignment_id=alignment_id,
+        user_id=user_id,
+        kind=kind,
+        priority=priority,
+        tasks=tasks,
+        params=params,
+        done_batch_ids=[],
+        state=AlignmentJobState.QUEUED,
+    )
+    db.add(record)
+    db.commit()
+    db.refresh(record)
+    return record
+
+
+def get_unfinished_jobs(db: Session) -> list[AlignmentJob]:
+    return (
+        db.query(AlignmentJob)
+        .filter(AlignmentJob.state.in_(UNFINISHED))
+        .order_by(AlignmentJob.id)
+        .all()
+    )
+
+
+def remaining_batches(record: AlignmentJob) -> list[int] | None:
+    """Batches still to process, None if the job never started."""
+    if record.batch_ids is None:
+        return None
+    done = set(record.done_batch_ids or [])
+    return [b for b in record.batch_ids if b not in done]
+
+
+def claim_batches(record_id: int, batch_ids: list[int]) -> list[int]:
+    """Fix the batches of a starting job, a resumed job gets its leftovers."""
+    db = SessionLocal()
+    try:
+        record = db.get(AlignmentJob, record_id)
+        if record is None:
+            return batch_ids
+        if record.batch_ids is None:
+            record.batch_ids = list(batch_ids)
+            record.tasks = len(batch_ids)
+            db.commit()
+            return batch_ids
+        return remaining_batches(record)
+    finally:
+        db.close()
+
+
+def set_done_batches(db: Session, record_id: int, done_batch_ids) -> None:
+    """Store the finished batches, committed by the caller."""
+    record = db.get(AlignmentJob, record_id)
+    if record is not None:
+        record.done_batch_ids = sorted(done_batch_ids)
+
+
+def start_job(record_id: int) -> None:
+    _set_state(record_id, AlignmentJobState.RUNNING)
+
+
+def finish_job(record_id: int, state: int) -> None:
+    """Set the final state unless the job was already finished or cancelled."""
+    _set_state(record_id, state, only_unfinished=True)
+
+
+def cancel_jobs(db: Session, alignment_id: int) -> None:
+    db.query(AlignmentJob).filter(
+        AlignmentJob.alignment_id == alignment_id,
+        AlignmentJob.state.in_(UNFINISHED),
+    ).update({"state": AlignmentJobState.CANCELLED}, synchronize_session=False)
+    db.commit()
+
+
+def _set_state(record_id: int, state: int, only_unfinished: bool = False) -> None:
+    db = SessionLocal()
+    try:
+        record = db.get(AlignmentJob, record_id)
+        if record is None:
+            return
+        if only_unfinished and record.state not in UNFINISHED:
+            return
+        record.state = state
+        db.commit()
+    finally:
+        db.close()
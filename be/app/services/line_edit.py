@@ -0,0 +1,188 @@
+"""Line edit - splitting and merging of splitted lines in one transaction"""
+
+import json
+import logging
+from functools import partial
+
+from app.services import doc_index_store, edit_journal
+
+logger = logging.getLogger(__name__)
+
+TYPE_FROM = "from"
+TYPE_TO = "to"
+
+
+def split_line(db, direction: str, line_id: int, part1: str, part2: str) -> bool:
+    """Split a line in two, ``line_id + 1`` and the lines after move by one.
+
+    The new line copies the attributes of the split one and is left
+    unaligned. The processing lines and the index keep their mapping to
+    ``line_id``, the ids of the lines after are remapped in place of
+    lingtrain_aligner's ``update_processing_mapping`` and
+    ``update_index_mapping``. Needs a write transaction. Returns False if
+    there is no such line.
+    """
+    table = _splitted_table(direction)
+    if not _line_exists(db, table, line_id):
+        return False
+
+    index = doc_index_store.IndexRows(db)
+    _shift_lines(db, table, line_id, 1)
+    columns = [x for x in _columns(db, table) if x not in ("id", "text")]
+    db.execute(
+        f"insert into {table}(id, text, {', '.join(columns)}) "
+        f"select ?, ?, {', '.join(columns)} from {table} where id = ?",
+        (line_id + 1, part2, line_id),
+    )
+    db.execute(f"update {table} set text = ? where id = ?", (part1, line_id))
+    _remap_line_ids(db, direction, line_id, _split_ids)
+    _save(db, index)
+    return True
+
+
+def merge_lines(db, direction: str, line_id: int, text: str | None = None) -> bool:
+    """Merge ``line_id + 1`` into ``line_id``, the inverse of ``split_line``.
+
+    The merged line gets ``text``, by default both texts joined by a space,
+    and keeps the attributes of ``line_id``. The lines after move back by
+    one. If ``line_id`` is aligned, entries that only had the removed line
+    lose it, so the sentence is not aligned twice, otherwise they point to
+    the merged line. The processing texts of the changed entries are built
+    again. Needs a write transaction. Returns False if one of the lines
+    does not exist.
+    """
+    table = _splitted_table(direction)
+    rows = db.execute(
+        f"select id, text, proxy_text from {table} where id in (?, ?)",
+        (line_id, line_id + 1),
+    ).fetchall()
+    lines = {x[0]: x[1:] for x in rows}
+    if line_id not in lines or line_id + 1 not in lines:
+        return False
+
+    (text1, proxy1), (text2, proxy2) = lines[line_id], lines[line_id + 1]
+    if text is None:
+        text = _join(text1, text2)
+
+    index = doc_index_store.IndexRows(db)
+    processing = _processing_table(direction)
+    touched = [
+        x[0]
+        for x in db.execute(
+            f"select id from {processing} where json_valid(text_ids) and exists "
+            f"(select 1 from json_each({processing}.text_ids) where value in (?, ?))",
+            (line_id, line_id + 1),
+        )
+    ]
+    column = _index_column(direction)
+    aligned = db.execute(
+        f"select 1 from doc_index_rows where json_valid({column}) and exists "
+        f"(select 1 from json_each(doc_index_rows.{column}) where value = ?) limit 1",
+        (line_id,),
+    ).fetchone()
+
+    db.execute(
+        f"update {table} set text = ?, proxy_text = ? where id = ?",
+        (text, _join(proxy1, proxy2) or proxy1, line_id),
+    )
+    db.execute(f"delete from {table} where id = ?", (line_id + 1,))
+    _shift_lines(db, table, line_id + 1, -1)
+    _remap_line_ids(
+        db, direction, line_id, partial(_merge_ids, keep_next=aligned is None)
+    )
+    _rebuild_processing_text(db, direction, touched)
+    _save(db, index)
+    return True
+
+
+def _splitted_table(direction: str) -> str:
+    return "splitted_to" if direction == TYPE_TO else "splitted_from"
+
+
+def _processing_table(direction: str) -> str:
+    return "processing_to" if direction == TYPE_TO else "processing_from"
+
+
+def _index_column(direction: str) -> str:
+    return "to_ids" if direction == TYPE_TO else "from_ids"
+
+
+def _line_exists(db, table: str, line_id: int) -> bool:
+    row = db.execute(f"select 1 from {table} where id = ?", (line_id,)).fetchone()
+    return row is not None
+
+
+def _columns(db, table: str) -> list[str]:
+    return [x[1] for x in db.execute(f"pragma table_info({table})")]
+
+
+def _shift_lines(db, table: str, after_id: int, delta: int) -> None:
+    # through negative ids, so a unique id never collides on the way
+    db.execute(f"update {table} set id = -(id + ?) where id > ?", (delta, after_id))
+    db.execute(f"update {table} set id = -id where id < 0")
+
+
+def _remap_line_ids(db, direction: str, line_id: int, remap) -> None:
+    """Rewrite the JSON line id lists that refer to lines after ``line_id``."""
+    db.create_function("remap_line_ids", 2, remap, deterministic=True)
+    for table, col in (
+        (_processing_table(direction), "text_ids"),
+        ("doc_index_rows", _index_column(direction)),
+    ):
+        db.execute(
+            f"update {table} set {col} = remap_line_ids({col}, :line_id) "
+            f"where json_valid({col}) and exists "
+            f"(select 1 from json_each({table}.{col}) where value > :line_id)",
+            {"line_id": line_id},
+        )
+
+
+def _split_ids(ids: str, line_id: int) -> str:
+    return json.dumps([x if x <= line_id else x + 1 for x in json.loads(ids)])
+
+
+def _merge_ids(ids: str, line_id: int, keep_next: bool = True) -> str:
+    ids = json.loads(ids)
+    drop_next = not keep_next and line_id not in ids
+    res = []
+    for x in ids:
+        if x == line_id + 1 and drop_next:
+            continue
+        x = x if x <= line_id else x - 1
+        if x not in res:
+            res.append(x)
+    return json.dumps(res)
+
+
+def _rebuild_processing_text(db, direction: str, processing_ids: list[int]) -> None:
+    """Processing text as ``helper.get_string`` joins it from the lines."""
+    processing = _processing_table(direction)
+    table = _splitted_table(direction)
+    for processing_id in processing_ids:
+        row = db.execute(
+            f"select text_ids from {processing} where id = ?", (processing_id,)
+        ).fetchone()
+        line_ids = json.loads(row[0]) if row else []
+        texts = {
+            x[0]: x[1] or ""
+            for x in db.execute(
+                f"select id, text from {table} where id in "
+                f"(select value from json_each(?))",
+                (json.dumps(line_ids),),
+            )
+        }
+        db.execute(
+            f"update {processing} set text = ? where id = ?",
+            (" ".join(texts.get(x, "") for x in line_ids), processing_id),
+        )
+
+
+def _save(db, index) -> None:
+    # the edit history refers to the line ids before the change
+    edit_journal.clear(db)
+    index.changed = True
+    index.save()
+
+
+def _join(a: str | None, b: str | None) -> str:
+    return " ".join(x.strip() for x in (a, b) if x and x.strip())
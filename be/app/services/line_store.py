@@ -0,0 +1,189 @@
+"""Line store - memory-mapped columns of the splitted lines of an alignment"""
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.services import alignment_db
+
+logger = logging.getLogger(__name__)
+
+TABLES = ("splitted_from", "splitted_to")
+TEXT_COLUMNS = ("text", "proxy_text")
+META_FILE = "meta.json"
+
+
+class LineColumns:
+    """Read-only view of a sidecar built by ``build``.
+
+    Every text column is a UTF-8 blob with an ``int64`` offsets array of
+    ``count + 1`` items, line ``i`` is ``blob[offsets[i]:offsets[i + 1]]``.
+    Files are memory-mapped, so workers share the pages of one alignment
+    and slicing a batch does not touch the rest of the book.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stamp = _stamp(path)
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self._columns = {}
+        for table in TABLES:
+            for column in TEXT_COLUMNS:
+                name = os.path.join(path, f"{table}.{column}")
+                offsets = np.load(f"{name}.offsets.npy", mmap_mode="r")
+                # np.memmap can not map an empty file
+                blob = (
+                    np.memmap(f"{name}.blob", dtype=np.uint8, mode="r")
+                    if offsets[-1]
+                    else np.zeros(0, dtype=np.uint8)
+                )
+                self._columns[(table, column)] = (offsets, blob)
+            self._columns[(table, "exclude")] = np.load(
+                os.path.join(path, f"{table}.exclude.npy"), mmap_mode="r"
+            )
+
+    def count(self, table: str) -> int:
+        return self.meta[table]
+
+    def lines(
+        self, table: str, start: int, end: int, column: str = "text"
+    ) -> list[str]:
+        """Lines ``start..end-1`` in id order, a missing proxy is ``""``."""
+        offsets, blob = self._columns[(table, column)]
+        end = min(end, len(offsets) - 1)
+        if end <= start:
+            return []
+        bounds = offsets[start : end + 1].tolist()
+        data = blob[bounds[0] : bounds[-1]].tobytes()
+        base = bounds[0]
+        return [
+            data[a - base : b - base].decode("utf-8")
+            for a, b in zip(bounds, bounds[1:])
+        ]
+
+    def excluded(self, table: str, start: int, end: int) -> list[bool]:
+        return [bool(x) for x in self._columns[(table, "exclude")][start:end]]
+
+
+_opened: dict[str, LineColumns] = {}
+_lock = threading.Lock()
+
+
+def sidecar_path(db_path: str) -> str:
+    return f"{os.path.splitext(str(db_path))[0]}.lines"
+
+
+def build(db_path: str) -> None:
+    """Write the sidecar of an alignment DB, replacing an existing one."""
+    db_path = str(db_path)
+    with _file_lock(sidecar_path(db_path)):
+        _build(db_path)
+
+
+def _build(db_path: str) -> None:
+    path = sidecar_path(db_path)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_path)
+    try:
+        meta = {"created_at": time.time()}
+        with alignment_db.connect(db_path) as db:
+            for table in TABLES:
+                rows = db.execute(
+                    f"select text, proxy_text, exclude from {table} order by id"
+                ).fetchall()
+                meta[table] = len(rows)
+                for i, column in enumerate(TEXT_COLUMNS):
+                    values = [r[i] for r in rows]
+                    _write_column(tmp_path, f"{table}.{column}", values)
+                np.save(
+                    os.path.join(tmp_path, f"{table}.exclude.npy"),
+                    np.array([r[2] == 1 for r in rows], dtype=np.uint8),
+                )
+        with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        _remove(path)
+        os.replace(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    logger.debug("Line sidecar of %s built: %s", db_path, meta)
+
+
+def invalidate(db_path: str) -> None:
+    """Drop the sidecar after the lines of the alignment were changed.
+
+    Mapped files stay readable for whoever still has them open, the next
+    ``open_lines`` builds a fresh sidecar.
+    """
+    db_path = str(db_path)
+    path = sidecar_path(db_path)
+    with _file_lock(path):
+        _remove(path)
+    with _lock:
+        _opened.pop(db_path, None)
+
+
+def open_lines(db_path: str) -> LineColumns:
+    """Sidecar of the alignment DB, built on first use."""
+    db_path = str(db_path)
+    path = sidecar_path(db_path)
+    with _lock:
+        columns = _opened.get(db_path)
+    if columns is not None and columns.stamp == _stamp(path):
+        return columns
+
+    # workers of one job may all miss the sidecar, one of them builds it
+    with _file_lock(path):
+        if _stamp(path) is None:
+            _build(db_path)
+        columns = LineColumns(path)
+    with _lock:
+        _opened[db_path] = columns
+    return columns
+
+
+@contextmanager
+def _file_lock(path: str):
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_column(path: str, name: str, values) -> None:
+    encoded = [(v or "").encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    np.save(os.path.join(path, f"{name}.offsets.npy"), offsets)
+    with open(os.path.join(path, f"{name}.blob"), "wb") as f:
+        f.write(b"".join(encoded))
+
+
+def _stamp(path: str):
+    try:
+        st = os.stat(os.path.join(path, META_FILE))
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns
+
+
+def _remove(path: str) -> None:
+    if not os.path.isdir(path):
+        return
+    trash = f"{path}.{os.getpid()}.{threading.get_ident()}.old"
+    try:
+        os.replace(path, trash)
+    except OSError:
+        return
+    shutil.rmtree(trash, ignore_errors=True)
@@ -1,27 +1,47 @@
 """Processing service - adapted from a-studio/backend/align_processor.py"""
 
 import logging
-import os
 import queue
-import sqlite3
+import threading
 import time
+from collections import deque
 from dataclasses import dataclass
-from multiprocessing import Process, Queue
 
 import matplotlib
 
 matplotlib.use("Agg")
 
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
 from app import config
 from app.database import SessionLocal
 from app.models.alignment import Alignment, AlignmentState
+from app.models.alignment_job import AlignmentJob, AlignmentJobState
 from app.models.alignment_progress import AlignmentProgress
+from app.schemas.alignment import AlignNext, AlignStart, ResolveRequest
+from app.services import (
+    alignment_db,
+    alignment_lock,
+    doc_index_store,
+    job_store,
+    line_store,
+)
+from app.services.conflict_cache import conflict_cache
+from app.services.conflict_tracker import ConflictTracker
+from app.services.doc_index_cache import doc_index_cache
 from app.services.file_storage import get_alignment_db_path, get_vis_img_path
+from app.services.progress_bus import bus, progress_event
+from app.services.scheduler import scheduler
+from app.services.similarity import BandedSimilarity
+from app.services.stage_timer import JobTimings, StageTimer
+from app.services.worker_pool import TASK_CANCELLED, TaskCancelled, pool
 
 logger = logging.getLogger(__name__)
 
+# how often a job waiting for task results looks for its cancel request
+CANCEL_POLL_SECONDS = 0.5
+
 
 @dataclass(frozen=True)
 class AlignmentInfo:
@@ -42,85 +62,185 @@ class AlignmentInfo:
             total_batches=a.total_batches,
         )
 
-FINISH_PROCESS = "finish_process"
+# pyplot keeps global state, renderings from concurrent jobs must not interleave
+_vis_lock = threading.Lock()
 
 
-def _update_progress_in_new_session(alignment_id: int, batch_id: int) -> None:
-    """Insert alignment progress in a fresh DB session (for use in subprocess)."""
-    db = SessionLocal()
-    try:
-        existing = (
-            db.query(AlignmentProgress)
-            .filter(
-                AlignmentProgress.alignment_id == alignment_id,
-                AlignmentProgress.batch_id == batch_id,
-            )
-            .first()
-        )
-        if not existing:
-            db.add(AlignmentProgress(alignment_id=alignment_id, batch_id=batch_id))
-            db.commit()
-    finally:
-        db.close()
+class ProgressWriter:
+    """Records the progress of one job in the main DB and publishes it.
 
+    Every finished batch is published to progress stream subscribers at
+    once, while progress rows are written in groups of
+    ``ALIGNER_PROGRESS_FLUSH_BATCHES`` or every
+    ``ALIGNER_PROGRESS_FLUSH_SECONDS``, whichever comes first. The batches
+    finished by the job are stored in its job record at the same time.
+    """
 
-def _increment_state_in_new_session(alignment_id: int, state: int) -> None:
-    """Update alignment state with current batch count in a fresh DB session."""
-    db = SessionLocal()
-    try:
-        count = (
-            db.query(AlignmentProgress)
-            .filter(AlignmentProgress.alignment_id == alignment_id)
-            .count()
-        )
-        alignment = db.get(Alignment, alignment_id)
-        if alignment:
-            alignment.state = state
-            alignment.curr_batches = count
+    def __init__(self, alignment_id: int, guid: str, record_id: int | None = None):
+        self.alignment_id = alignment_id
+        self.guid = guid
+        self.record_id = record_id
+        self.state = AlignmentState.IN_PROGRESS
+        self.pending = []
+        self.job_done = set()
+        self.flushed_at = time.monotonic()
+        db = SessionLocal()
+        try:
+            record = db.get(AlignmentJob, record_id) if record_id else None
+            if record is not None:
+                self.job_done.update(record.done_batch_ids or [])
+            self.done = {
+                x[0]
+                for x in db.query(AlignmentProgress.batch_id).filter(
+                    AlignmentProgress.alignment_id == alignment_id
+                )
+            }
+            alignment = db.get(Alignment, alignment_id)
+            self.total_batches = alignment.total_batches if alignment else 0
+        finally:
+            db.close()
+
+    def batch_done(self, batch_id: int) -> None:
+        """An aligned batch was committed to the alignment DB."""
+        if batch_id not in self.done:
+            self.done.add(batch_id)
+            self.pending.append(batch_id)
+        self.job_done.add(batch_id)
+        self.publish()
+        self._maybe_flush()
+
+    def task_done(self, batch_id: int) -> None:
+        """A job task that does not align a batch has finished."""
+        self.job_done.add(batch_id)
+        self._maybe_flush()
+
+    def set_state(self, state: int) -> None:
+        self.state = state
+        self.flush()
+        self.publish()
+        if state == AlignmentState.ERROR and self.record_id:
+            job_store.finish_job(self.record_id, AlignmentJobState.ERROR)
+
+    def finish(self) -> None:
+        """Set the final state of a job that did not fail."""
+        if len(self.done) >= self.total_batches:
+            self.set_state(AlignmentState.DONE)
+        else:
+            self.set_state(AlignmentState.IN_PROGRESS_DONE)
+
+    def _maybe_flush(self) -> None:
+        if (
+            len(self.pending) >= config.ALIGNER_PROGRESS_FLUSH_BATCHES
+            or time.monotonic() - self.flushed_at >= config.ALIGNER_PROGRESS_FLUSH_SECONDS
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        db = SessionLocal()
+        try:
+            if self.record_id:
+                job_store.set_done_batches(db, self.record_id, self.job_done)
+            if self.pending:
+                # another job of the alignment may have stored the same batch
+                db.execute(
+                    sqlite_insert(AlignmentProgress)
+                    .values(
+                        [
+                            {"alignment_id": self.alignment_id, "batch_id": b}
+                            for b in self.pending
+                        ]
+                    )
+                    .on_conflict_do_nothing()
+                )
+            alignment = db.get(Alignment, self.alignment_id)
+            if alignment:
+                alignment.state = self.state
+                alignment.curr_batches = len(self.done)
             db.commit()
-    finally:
-        db.close()
+        finally:
+            db.close()
+        self.pending = []
+        self.flushed_at = time.monotonic()
+
+    def publish(self) -> None:
+        bus.publish(
+            self.guid,
+            progress_event(
+                self.guid, self.state, len(self.done), self.total_batches
+            ),
+        )
 
 
-def _update_state_in_new_session(
-    alignment_id: int,
-    state: int,
-    curr_batches: int | None = None,
-    total_batches: int | None = None,
-) -> None:
-    """Update alignment state in a fresh DB session."""
-    db = SessionLocal()
-    try:
-        alignment = db.get(Alignment, alignment_id)
-        if alignment:
-            alignment.state = state
-            if curr_batches is not None:
-                alignment.curr_batches = curr_batches
-            if total_batches is not None:
-                alignment.total_batches = total_batches
-            db.commit()
-    finally:
-        db.close()
-
+class TaskFeeder:
+    """Feeds the tasks of one job to the worker pool.
+
+    At most ``job.slots`` tasks (the pool size without a scheduler job) are
+    in the pool at once, so a long job never queues all of its batches ahead
+    of other users' work. Once the job is cancelled the remaining tasks are
+    dropped and the ones already in the pool are cancelled too, the wait
+    for results looks for the cancel every ``CANCEL_POLL_SECONDS``.
+    """
+
+    def __init__(self, target, tasks, job=None):
+        self.target = target
+        self.pending = deque(enumerate(tasks))
+        self.job = job
+        self.in_flight = 0
+        self.cancelled = False
+        if job:
+            job.tasks = max(1, len(self.pending))
+        self.pool_job_id = pool.open_job()
+
+    def feed(self):
+        if self.job and self.job.cancelled and not self.cancelled:
+            self.cancelled = True
+            self.pending.clear()
+            pool.cancel_job(self.pool_job_id)
+        limit = self.job.slots if self.job else pool.size
+        while self.pending and self.in_flight < max(1, limit):
+            task_index, task = self.pending.popleft()
+            pool.submit(self.pool_job_id, task_index, self.target, *task)
+            self.in_flight += 1
+
+    def next_result(self, error_result):
+        """Wait for the next finished task, ``error_result`` if it crashed.
+
+        Returns None when no tasks are left, cancelled tasks are skipped.
+        """
+        while True:
+            self.feed()
+            if not self.in_flight:
+                return None
+            try:
+                _, ok, payload = pool.get_result(
+                    self.pool_job_id, timeout=CANCEL_POLL_SECONDS
+                )
+            except queue.Empty:
+                # a cancel reaches the running tasks without waiting for one
+                continue
+            self.in_flight -= 1
+            if self.job:
+                self.job.task_done()
+            self.feed()
+            if ok:
+                return payload
+            if payload != TASK_CANCELLED:
+                return error_result
 
-def _get_progress_in_new_session(alignment_id: int) -> tuple[int, int]:
-    """Get current/total batches in a fresh DB session."""
-    db = SessionLocal()
-    try:
-        alignment = db.get(Alignment, alignment_id)
-        if alignment:
-            return alignment.curr_batches, alignment.total_batches
-        return 0, 0
-    finally:
-        db.close()
+    def close(self):
+        pool.close_job(self.pool_job_id)
 
 
 class AlignmentProcessor:
-    """Processor with parallel texts alignment logic."""
+    """Processor with parallel texts alignment logic.
+
+    Batches are executed by the shared worker pool, results are handled in
+    the calling thread. The instance is pickled together with every task, so
+    it must only hold plain data.
+    """
 
     def __init__(
         self,
-        proc_count,
         db_path,
         alignment_id,
         res_img_best,
@@ -136,17 +256,16 @@ class AlignmentProcessor:
         plot_regression=False,
         use_proxy_from=False,
         use_proxy_to=False,
+        job_record_id=None,
     ):
         from lingtrain_aligner import constants as la_con
 
-        self.proc_count = proc_count
-        self.queue_in = Queue()
-        self.queue_out = Queue()
         self.db_path = db_path
         self.alignment_id = alignment_id
         self.res_img_best = res_img_best
         self.lang_name_from = lang_name_from
         self.lang_name_to = lang_name_to
+        self.tasks = []
         self.tasks_count = 0
         self.align_guid = align_guid
         self.model_name = model_name
@@ -158,320 +277,425 @@ class AlignmentProcessor:
         self.plot_regression = plot_regression
         self.use_proxy_from = use_proxy_from
         self.use_proxy_to = use_proxy_to
+        self.job_record_id = job_record_id
 
     def add_tasks(self, task_list):
-        for i, task in enumerate(task_list):
-            self.queue_in.put((i, task))
-        for i in range(self.proc_count):
-            self.queue_in.put((-1, FINISH_PROCESS))
-        self.tasks_count = len(task_list)
+        self.tasks = list(task_list)
+        self.tasks_count = len(self.tasks)
+
+    def create_feeder(self, job=None):
+        target = (
+            self.process_batch_wrapper
+            if self.mode == "align"
+            else self.resolve_batch_wrapper
+        )
+        # tasks are dropped before submitting, every task pickles the processor
+        tasks, self.tasks = self.tasks, []
+        return TaskFeeder(target, tasks, job)
 
-    def work(self, queue_in, queue_out):
-        while True:
-            try:
-                task_index, task = queue_in.get_nowait()
-            except queue.Empty:
-                time.sleep(0.01)
-            else:
-                try:
-                    if task == FINISH_PROCESS:
-                        break
-                    if self.mode == "align":
-                        self.process_batch_wrapper(*task)
-                    elif self.mode == "resolve":
-                        self.resolve_batch_wrapper(*task)
-                except Exception as e:
-                    logger.error(f"Task failed: {e}", exc_info=True)
-                    queue_out.put("error")
-
-    def handle_result(self, queue_out):
+    def handle_result(self, feeder):
         from lingtrain_aligner import aligner, vis_helper
 
-        counter = 0
+        progress = ProgressWriter(
+            self.alignment_id, self.align_guid, self.job_record_id
+        )
+        timings = JobTimings(self.job_record_id)
         error_occured = False
+        pending = []
         result = []
 
-        while counter < self.tasks_count:
-            result_code, batch_number, texts_from, texts_to, shift, window = (
-                queue_out.get()
-            )
+        while True:
+            res = feeder.next_result((AlignmentState.ERROR, -1, [], [], -1, -1, {}))
+            if res is None:
+                break
+            result_code, batch_number, texts_from, texts_to, shift, window, stages = res
 
             if result_code == AlignmentState.DONE:
-                result.append((batch_number, texts_from, texts_to, shift, window))
-                _update_progress_in_new_session(self.alignment_id, batch_number)
-                _increment_state_in_new_session(
-                    self.alignment_id, AlignmentState.IN_PROGRESS
-                )
+                timings.add_batch(batch_number, stages)
+                batch = (batch_number, texts_from, texts_to, shift, window)
+                if config.ALIGNER_INCREMENTAL_COMMIT:
+                    with timings.stage("db_write", batch_number):
+                        self.commit_batches([batch])
+                else:
+                    pending.append(batch)
+                result.append((batch_number, shift, window))
+                progress.batch_done(batch_number)
             elif result_code == AlignmentState.ERROR:
                 error_occured = True
-                _increment_state_in_new_session(
-                    self.alignment_id, AlignmentState.ERROR
-                )
+                progress.set_state(AlignmentState.ERROR)
                 break
 
-            counter += 1
+        if pending:
+            pending.sort()
+            with timings.stage("db_write"):
+                self.commit_batches(pending)
+        if result:
+            with timings.stage("db_write"):
+                doc_index_store.materialize_path(self.db_path)
 
-        result.sort()
-        with sqlite3.connect(self.db_path) as db:
-            aligner.write_processing_batches(db, result)
-            aligner.create_doc_index(db, result)
+        for batch_id, shift, window in result:
+            with timings.stage("update_history", batch_id):
+                aligner.update_history(
+                    self.db_path,
+                    [batch_id],
+                    self.operation,
+                    parameters={"shift": shift, "window": window},
+                )
 
-        for batch_id, _, _, shift, window in result:
-            aligner.update_history(
-                self.db_path,
-                [batch_id],
-                self.operation,
-                parameters={"shift": shift, "window": window},
-            )
+        with _vis_lock:
+            for batch_id, _, _ in result:
+                with timings.stage("visualize", batch_id):
+                    vis_helper.visualize_alignment_by_db(
+                        self.db_path,
+                        self.res_img_best,
+                        lang_name_from=self.lang_name_from,
+                        lang_name_to=self.lang_name_to,
+                        batch_ids=[batch_id],
+                        transparent_bg=True,
+                        show_info=self.plot_info,
+                        show_regression=self.plot_regression,
+                    )
+
+        timings.save()
+        if not error_occured:
+            progress.finish()
 
-        for batch_id, _, _, shift, window in result:
-            vis_helper.visualize_alignment_by_db(
-                self.db_path,
-                self.res_img_best,
-                lang_name_from=self.lang_name_from,
-                lang_name_to=self.lang_name_to,
-                batch_ids=[batch_id],
-                transparent_bg=True,
-                show_info=self.plot_info,
-                show_regression=self.plot_regression,
-            )
+    def commit_batches(self, batches):
+        """Write aligned batches and splice them into the document index.
 
-        if not error_occured:
-            curr_batches, total_batches = _get_progress_in_new_session(
-                self.alignment_id
-            )
-            if curr_batches == total_batches:
-                _update_state_in_new_session(
-                    self.alignment_id, AlignmentState.DONE
-                )
-            else:
-                _update_state_in_new_session(
-                    self.alignment_id, AlignmentState.IN_PROGRESS_DONE
-                )
+        Only the index rows of the batches are replaced, in one write
+        transaction with the processing lines. The blob is written by
+        ``materialize`` once the job is done, not once per batch.
+        """
+        from lingtrain_aligner import aligner
 
-    def start_align(self):
-        workers = [
-            Process(
-                target=self.work, args=(self.queue_in, self.queue_out), daemon=True
-            )
-            for _ in range(min(self.proc_count, self.tasks_count))
-        ]
-        for w in workers:
-            w.start()
+        doc_index_store.ensure_schema(self.db_path)
+        with alignment_db.connect(self.db_path) as db:
+            db.execute("begin immediate")
+            aligner.write_processing_batches(db, batches)
+            update = doc_index_store.replace_batches(db, [x[0] for x in batches])
+        doc_index_cache.update(self.db_path, update)
 
-        align_handler = Process(
-            target=self.handle_result, args=(self.queue_out,)
-        )
-        align_handler.start()
-        align_handler.join()
+    def start_align(self, job=None):
+        feeder = self.create_feeder(job)
+        try:
+            self.handle_result(feeder)
+        finally:
+            feeder.close()
 
     def process_batch_wrapper(
         self,
-        lines_from_batch,
-        lines_to_batch,
-        proxy_from,
-        proxy_to,
-        line_ids_from,
-        line_ids_to,
+        ctx,
         batch_number,
+        range_from,
+        range_to,
         shift,
         window,
     ):
-        from lingtrain_aligner import aligner
-
+        """Align one batch, its lines are read from the alignment DB here."""
+        timer = StageTimer()
         try:
-            texts_from, texts_to = aligner.process_batch(
-                self.db_path,
+            with timer.stage("read_lines"):
+                lines = line_store.open_lines(self.db_path)
+                lines_from_batch = lines.lines("splitted_from", *range_from)
+                lines_to_batch = lines.lines("splitted_to", *range_to)
+            line_ids_from = list(range(*range_from))
+            line_ids_to = list(range(*range_to))
+            texts_from, texts_to = self.align_batch(
+                ctx,
+                timer,
                 lines_from_batch,
                 lines_to_batch,
                 line_ids_from,
                 line_ids_to,
                 batch_number,
-                self.model_name,
                 window,
-                self.embed_batch_size,
-                self.normalize_embeddings,
-                show_progress_bar=False,
-                save_pic=True,
-                lang_name_from=self.lang_name_from,
-                lang_name_to=self.lang_name_to,
-                img_path=self.res_img_best,
-                show_info=self.plot_info,
-                show_regression=self.plot_regression,
-                use_proxy_from=self.use_proxy_from,
-                use_proxy_to=self.use_proxy_to,
             )
-            self.queue_out.put(
-                (AlignmentState.DONE, batch_number, texts_from, texts_to, shift, window)
+            return (
+                AlignmentState.DONE,
+                batch_number,
+                texts_from,
+                texts_to,
+                shift,
+                window,
+                timer.stages,
             )
         except Exception as e:
             logger.error(e, exc_info=True)
-            self.queue_out.put((AlignmentState.ERROR, -1, [], [], -1, -1))
+            return (AlignmentState.ERROR, -1, [], [], -1, -1, timer.stages)
 
-    def start_resolve(self):
-        resolve_handler = Process(
-            target=self.handle_resolve, args=(self.queue_out,), daemon=True
-        )
-        resolve_handler.start()
+    def align_batch(
+        self,
+        ctx,
+        timer,
+        lines_from_batch,
+        lines_to_batch,
+        line_ids_from,
+        line_ids_to,
+        batch_number,
+        window,
+    ):
+        """Same as ``aligner.process_batch``, but only the window band of the
+        similarity matrix is computed."""
+        from lingtrain_aligner import aligner, vis_helper
 
-        workers = [
-            Process(
-                target=self.work, args=(self.queue_in, self.queue_out), daemon=True
+        vectors = []
+        with timer.stage("embed"):
+            for direction, ids, use_proxy in (
+                ("from", line_ids_from, self.use_proxy_from),
+                ("to", line_ids_to, self.use_proxy_to),
+            ):
+                vectors.append(
+                    aligner.update_embeddings(
+                        self.db_path,
+                        direction=direction,
+                        ids=ids,
+                        is_proxy=use_proxy,
+                        model_name=self.model_name,
+                        embed_batch_size=self.embed_batch_size,
+                        normalize_embeddings=self.normalize_embeddings,
+                        show_progress_bar=False,
+                        model=ctx.model,
+                        lang_emb_from="ell_Grek",
+                    )
+                )
+        with timer.stage("similarity"):
+            sim = BandedSimilarity(vectors[0], vectors[1], window)
+
+        with timer.stage("render"):
+            vis_helper.save_pic(
+                sim.best_matrix(),
+                self.lang_name_to,
+                self.lang_name_from,
+                self.res_img_best,
+                batch_number,
+                (min(line_ids_from), max(line_ids_from)),
+                (min(line_ids_to), max(line_ids_to)),
+                transparent=True,
+                show_info=self.plot_info,
+                show_regression=self.plot_regression,
             )
-            for _ in range(min(self.proc_count, self.tasks_count))
-        ]
-        for w in workers:
-            w.start()
+
+        texts_from = []
+        texts_to = []
+        for i, j in enumerate(sim.best):
+            id_from = line_ids_from[i]
+            id_to = line_ids_to[j]
+            text_from = lines_from_batch[i].strip()
+            text_to = lines_to_batch[j].strip()
+            texts_from.append((f"[{id_from+1}]", id_from + 1, text_from))
+            texts_to.append((f"[{id_to+1}]", id_to + 1, text_to))
+        return texts_from, texts_to
+
+    def start_resolve(self, job=None):
+        feeder = self.create_feeder(job)
+        try:
+            self.handle_resolve(feeder)
+        finally:
+            feeder.close()
 
     def resolve_batch_wrapper(
-        self, batch_id, batch_amount, handle_start, handle_finish
+        self, ctx, batch_id, batch_amount, handle_start, handle_finish
     ):
-        from lingtrain_aligner import aligner, resolver, constants as la_con
-
+        timer = StageTimer()
         try:
-            # Strategy 1: iterative with increasing chain length
-            steps = 3
-            for i in range(steps):
-                min_chain_length = 2 + i
-                max_conflicts_len = 6 * (i + 1)
-                conflicts, _ = resolver.get_all_conflicts(
-                    self.db_path,
-                    min_chain_length=min_chain_length,
-                    max_conflicts_len=max_conflicts_len,
-                    batch_id=batch_id,
-                )
-                resolver.resolve_all_conflicts(
-                    self.db_path,
+            with timer.stage("read_index"):
+                tracker = ConflictTracker(self.db_path, batch_id)
+            try:
+                # Strategy 1: iterative with increasing chain length
+                steps = 3
+                for i in range(steps):
+                    ctx.check_cancelled()
+                    min_chain_length = 2 + i
+                    max_conflicts_len = 6 * (i + 1)
+                    with timer.stage("find_conflicts"):
+                        conflicts, _ = tracker.find(min_chain_length, max_conflicts_len)
+                    self.resolve_pass(
+                        ctx,
+                        timer,
+                        tracker,
+                        conflicts,
+                        batch_id,
+                        batch_amount,
+                        min_chain_length,
+                        max_conflicts_len,
+                    )
+
+                # Strategy 2: negative length correction
+                ctx.check_cancelled()
+                min_chain_length = 2
+                max_conflicts_len = 26
+                with timer.stage("find_conflicts"):
+                    conflicts, rest_conflicts = tracker.find(
+                        min_chain_length, max_conflicts_len
+                    )
+                    tracker.correct(
+                        rest_conflicts,
+                        min_chain_length,
+                        max_conflicts_len,
+                        handle_start=handle_start,
+                        handle_finish=handle_finish,
+                    )
+                self.resolve_pass(
+                    ctx,
+                    timer,
+                    tracker,
                     conflicts,
-                    self.model_name,
-                    show_logs=False,
-                    use_proxy_from=self.use_proxy_from,
-                    use_proxy_to=self.use_proxy_to,
+                    batch_id,
+                    batch_amount,
+                    min_chain_length,
+                    max_conflicts_len,
                 )
-                params = {"min_chain_length": min_chain_length, "max_conflicts_len": max_conflicts_len}
-                if batch_id == -1:
-                    params["batch_amount"] = batch_amount
-                aligner.update_history(
-                    self.db_path, [batch_id], la_con.OPERATION_RESOLVE, parameters=params
+
+                # Strategy 3: edge handling
+                ctx.check_cancelled()
+                with timer.stage("find_conflicts"):
+                    conflicts, _ = tracker.find(
+                        min_chain_length,
+                        max_conflicts_len,
+                        handle_start=handle_start,
+                        handle_finish=handle_finish,
+                    )
+                self.resolve_pass(
+                    ctx,
+                    timer,
+                    tracker,
+                    conflicts,
+                    batch_id,
+                    batch_amount,
+                    min_chain_length,
+                    max_conflicts_len,
                 )
+            finally:
+                # keep the resolutions of an interrupted pass
+                with timer.stage("db_write"):
+                    tracker.flush()
 
-            # Strategy 2: negative length correction
-            min_chain_length = 2
-            max_conflicts_len = 26
-            conflicts, rest_conflicts = resolver.get_all_conflicts(
-                self.db_path,
-                min_chain_length=min_chain_length,
-                max_conflicts_len=max_conflicts_len,
-                batch_id=batch_id,
-            )
-            resolver.correct_conflicts(
-                self.db_path,
-                rest_conflicts,
-                batch_id=batch_id,
-                min_chain_length=min_chain_length,
-                max_conflicts_len=max_conflicts_len,
-                handle_start=handle_start,
-                handle_finish=handle_finish,
-            )
-            resolver.resolve_all_conflicts(
-                self.db_path,
-                conflicts,
-                self.model_name,
-                show_logs=False,
-                use_proxy_from=self.use_proxy_from,
-                use_proxy_to=self.use_proxy_to,
-            )
-            params = {"min_chain_length": min_chain_length, "max_conflicts_len": max_conflicts_len}
-            if batch_id == -1:
-                params["batch_amount"] = batch_amount
-            aligner.update_history(
-                self.db_path, [batch_id], la_con.OPERATION_RESOLVE, parameters=params
-            )
+            return (AlignmentState.DONE, batch_id, timer.stages)
 
-            # Strategy 3: edge handling
-            conflicts, _ = resolver.get_all_conflicts(
-                self.db_path,
-                min_chain_length=min_chain_length,
-                max_conflicts_len=max_conflicts_len,
-                batch_id=batch_id,
-                handle_start=handle_start,
-                handle_finish=handle_finish,
-            )
-            resolver.resolve_all_conflicts(
-                self.db_path,
+        except TaskCancelled:
+            raise
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            return (AlignmentState.ERROR, [], timer.stages)
+
+    def resolve_pass(
+        self,
+        ctx,
+        timer,
+        tracker,
+        conflicts,
+        batch_id,
+        batch_amount,
+        min_chain_length,
+        max_conflicts_len,
+    ):
+        from lingtrain_aligner import aligner, constants as la_con
+
+        with timer.stage("resolve"):
+            tracker.resolve(
                 conflicts,
                 self.model_name,
-                show_logs=False,
+                model=ctx.model,
                 use_proxy_from=self.use_proxy_from,
                 use_proxy_to=self.use_proxy_to,
             )
+        with timer.stage("db_write"):
+            tracker.flush()
+        params = {"min_chain_length": min_chain_length, "max_conflicts_len": max_conflicts_len}
+        if batch_id == -1:
+            params["batch_amount"] = batch_amount
+        with timer.stage("update_history"):
             aligner.update_history(
                 self.db_path, [batch_id], la_con.OPERATION_RESOLVE, parameters=params
             )
 
-            self.queue_out.put((AlignmentState.DONE, batch_id))
-
-        except Exception as e:
-            logger.error(e, exc_info=True)
-            self.queue_out.put((AlignmentState.ERROR, []))
-
-    def handle_resolve(self, queue_out):
+    def handle_resolve(self, feeder):
         from lingtrain_aligner import vis_helper
 
-        counter = 0
+        progress = ProgressWriter(
+            self.alignment_id, self.align_guid, self.job_record_id
+        )
+        timings = JobTimings(self.job_record_id)
         error_occured = False
         result = []
 
-        while counter < self.tasks_count:
-            result_code, batch_number = queue_out.get()
+        while True:
+            res = feeder.next_result((AlignmentState.ERROR, [], {}))
+            if res is None:
+                break
+            result_code, batch_number, stages = res
             if result_code == AlignmentState.DONE:
+                timings.add_batch(batch_number, stages)
                 result.append(batch_number)
+                progress.task_done(batch_number)
             elif result_code == AlignmentState.ERROR:
                 error_occured = True
-                _increment_state_in_new_session(
-                    self.alignment_id, AlignmentState.ERROR
-                )
+                progress.set_state(AlignmentState.ERROR)
                 break
-            counter += 1
 
-        vis_helper.visualize_alignment_by_db(
-            self.db_path,
-            self.res_img_best,
-            lang_name_from=self.lang_name_from,
-            lang_name_to=self.lang_name_to,
-            batch_ids=result,
-            transparent_bg=True,
-            show_info=self.plot_info,
-            show_regression=self.plot_regression,
-        )
+        with _vis_lock, timings.stage("visualize"):
+            vis_helper.visualize_alignment_by_db(
+                self.db_path,
+                self.res_img_best,
+                lang_name_from=self.lang_name_from,
+                lang_name_to=self.lang_name_to,
+                batch_ids=result,
+                transparent_bg=True,
+                show_info=self.plot_info,
+                show_regression=self.plot_regression,
+            )
 
+        timings.save()
         if not error_occured:
-            curr_batches, total_batches = _get_progress_in_new_session(
-                self.alignment_id
-            )
-            if curr_batches == total_batches:
-                _update_state_in_new_session(
-                    self.alignment_id, AlignmentState.DONE
-                )
-            else:
-                _update_state_in_new_session(
-                    self.alignment_id, AlignmentState.IN_PROGRESS_DONE
-                )
+            progress.finish()
+
+
+def batch_tasks(db_path: str, batch_ids, window: int, batch_shift: int) -> list:
+    """Align tasks as ``(batch_id, range_from, range_to, shift, window)``.
+
+    Line ranges are the slices ``aligner.get_batch_intersected`` would cut,
+    the texts themselves are read from the line sidecar by the worker
+    running the batch.
+    """
+    lines = line_store.open_lines(db_path)
+    len_from = lines.count("splitted_from")
+    len_to = lines.count("splitted_to")
+    if not len_from or not len_to:
+        return []
+
+    n = config.ALIGNER_BATCH_SIZE
+    k = int(round(n * len_to / len_from))
+    if k < window * 2:
+        logger.warning(
+            f"Batch for the second language is too small. k = {k}, window = {window}"
+        )
 
+    wanted = set(batch_ids)
+    tasks = []
+    for batch_id, start_from in enumerate(range(0, len_from, n)):
+        if batch_id not in wanted:
+            continue
+        start_to = k * batch_id
+        range_from = (start_from, min(start_from + n, len_from))
+        range_to = (
+            max(0, start_to - window + batch_shift),
+            min(start_to + k + window + batch_shift, len_to),
+        )
+        tasks.append((batch_id, range_from, range_to, batch_shift, window))
+    return tasks
 
-def start_alignment(user_id: int, alignment: AlignmentInfo, data) -> None:
-    from lingtrain_aligner import aligner, constants as la_con
+
+def start_alignment(
+    user_id: int, alignment: AlignmentInfo, data, record_id=None, job=None
+) -> None:
+    from lingtrain_aligner import constants as la_con
 
     db_path = str(
         get_alignment_db_path(user_id, alignment.lang_from, alignment.lang_to, alignment.guid)
     )
     res_img_best = str(get_vis_img_path(user_id, alignment.guid))
 
-    lines_from = aligner.get_splitted_from(db_path)
-    lines_to = aligner.get_splitted_to(db_path)
-    proxy_from = aligner.get_proxy_from(db_path)
-    proxy_to = aligner.get_proxy_to(db_path)
-
     batch_ids = data.batch_ids
     if data.align_all:
         batch_ids = list(range(alignment.total_batches))
@@ -479,43 +703,14 @@ def start_alignment(user_id: int, alignment: AlignmentInfo, data) -> None:
     batch_ids = [x for x in batch_ids if x < alignment.total_batches][
         : alignment.total_batches
     ]
+    if record_id:
+        batch_ids = job_store.claim_batches(record_id, batch_ids)
     if not batch_ids:
         return
 
-    task_list = [
-        (
-            lines_from_batch,
-            lines_to_batch,
-            proxy_from_batch,
-            proxy_to_batch,
-            line_ids_from,
-            line_ids_to,
-            batch_id,
-            data.batch_shift,
-            data.window,
-        )
-        for (
-            lines_from_batch,
-            lines_to_batch,
-            proxy_from_batch,
-            proxy_to_batch,
-            line_ids_from,
-            line_ids_to,
-            batch_id,
-        ) in aligner.get_batch_intersected(
-            lines_from,
-            lines_to,
-            n=config.ALIGNER_BATCH_SIZE,
-            window=data.window,
-            batch_ids=batch_ids,
-            batch_shift=data.batch_shift,
-            iter3=proxy_from,
-            iter4=proxy_to,
-        )
-    ]
+    task_list = batch_tasks(db_path, batch_ids, data.window, data.batch_shift)
 
     proc = AlignmentProcessor(
-        config.ALIGNER_PROCESSORS,
         db_path,
         alignment.id,
         res_img_best,
@@ -530,13 +725,16 @@ def start_alignment(user_id: int, alignment: AlignmentInfo, data) -> None:
         plot_regression=False,
         use_proxy_from=data.use_proxy_from,
         use_proxy_to=data.use_proxy_to,
+        job_record_id=record_id,
     )
     proc.add_tasks(task_list)
-    proc.start_align()
+    proc.start_align(job)
 
 
-def align_next(user_id: int, alignment: AlignmentInfo, data) -> None:
-    from lingtrain_aligner import aligner, constants as la_con
+def align_next(
+    user_id: int, alignment: AlignmentInfo, data, record_id=None, job=None
+) -> None:
+    from lingtrain_aligner import constants as la_con
 
     db_path = str(
         get_alignment_db_path(user_id, alignment.lang_from, alignment.lang_to, alignment.guid)
@@ -544,7 +742,7 @@ def align_next(user_id: int, alignment: AlignmentInfo, data) -> None:
     res_img_best = str(get_vis_img_path(user_id, alignment.guid))
 
     # Determine next batch IDs
-    with sqlite3.connect(db_path) as align_db:
+    with alignment_db.connect(db_path) as align_db:
         batch_ids_rows = align_db.execute("select batch_id from batches").fetchall()
     processed = [x[0] for x in batch_ids_rows]
     last_batch_id = max(processed) + 1 if processed else 0
@@ -553,48 +751,14 @@ def align_next(user_id: int, alignment: AlignmentInfo, data) -> None:
     batch_ids = [x for x in batch_ids if x < alignment.total_batches][
         : alignment.total_batches
     ]
+    if record_id:
+        batch_ids = job_store.claim_batches(record_id, batch_ids)
     if not batch_ids:
         return
 
-    lines_from = aligner.get_splitted_from(db_path)
-    lines_to = aligner.get_splitted_to(db_path)
-    proxy_from = aligner.get_proxy_from(db_path)
-    proxy_to = aligner.get_proxy_to(db_path)
-
-    task_list = [
-        (
-            lines_from_batch,
-            lines_to_batch,
-            proxy_from_batch,
-            proxy_to_batch,
-            line_ids_from,
-            line_ids_to,
-            batch_id,
-            data.batch_shift,
-            data.window,
-        )
-        for (
-            lines_from_batch,
-            lines_to_batch,
-            proxy_from_batch,
-            proxy_to_batch,
-            line_ids_from,
-            line_ids_to,
-            batch_id,
-        ) in aligner.get_batch_intersected(
-            lines_from,
-            lines_to,
-            n=config.ALIGNER_BATCH_SIZE,
-            window=data.window,
-            batch_ids=batch_ids,
-            batch_shift=data.batch_shift,
-            iter3=proxy_from,
-            iter4=proxy_to,
-        )
-    ]
+    task_list = batch_tasks(db_path, batch_ids, data.window, data.batch_shift)
 
     proc = AlignmentProcessor(
-        config.ALIGNER_PROCESSORS,
         db_path,
         alignment.id,
         res_img_best,
@@ -609,12 +773,15 @@ def align_next(user_id: int, alignment: AlignmentInfo, data) -> None:
         plot_regression=False,
         use_proxy_from=data.use_proxy_from,
         use_proxy_to=data.use_proxy_to,
+        job_record_id=record_id,
     )
     proc.add_tasks(task_list)
-    proc.start_align()
+    proc.start_align(job)
 
 
-def resolve_conflicts(user_id: int, alignment: AlignmentInfo, data) -> None:
+def resolve_conflicts(
+    user_id: int, alignment: AlignmentInfo, data, record_id=None, job=None
+) -> None:
     from lingtrain_aligner import constants as la_con
 
     db_path = str(
@@ -626,11 +793,12 @@ def resolve_conflicts(user_id: int, alignment: AlignmentInfo, data) -> None:
     batch_ids = [x for x in batch_ids if x < alignment.total_batches][
         : alignment.total_batches
     ]
+    if record_id:
+        batch_ids = job_store.claim_batches(record_id, batch_ids)
     if not batch_ids:
         return
 
     proc = AlignmentProcessor(
-        config.ALIGNER_PROCESSORS,
         db_path,
         alignment.id,
         res_img_best,
@@ -646,6 +814,7 @@ def resolve_conflicts(user_id: int, alignment: AlignmentInfo, data) -> None:
         plot_regression=False,
         use_proxy_from=data.use_proxy_from,
         use_proxy_to=data.use_proxy_to,
+        job_record_id=record_id,
     )
     proc.add_tasks(
         [
@@ -653,17 +822,140 @@ def resolve_conflicts(user_id: int, alignment: AlignmentInfo, data) -> None:
             for batch_id in batch_ids
         ]
     )
-    proc.start_resolve()
+    proc.start_resolve(job)
+
+
+JOB_KINDS = {
+    "align": (start_alignment, AlignStart),
+    "align_next": (align_next, AlignNext),
+    "resolve": (resolve_conflicts, ResolveRequest),
+}
+
+
+def run_job(
+    kind: str, user_id: int, alignment: AlignmentInfo, data, record_id: int, job=None
+) -> None:
+    """Run a recorded job, its record tracks the state for restart recovery.
+
+    The job holds the alignment lock while it runs, jobs of one alignment
+    run one after another and editor writes are refused meanwhile.
+    """
+    fn, _ = JOB_KINDS[kind]
+    db_path = get_alignment_db_path(
+        user_id, alignment.lang_from, alignment.lang_to, alignment.guid
+    )
+    job_store.start_job(record_id)
+    state = AlignmentJobState.ERROR
+    try:
+        try:
+            with alignment_lock.writing(
+                db_path,
+                f"{kind} job {record_id} is running",
+                cancelled=lambda: job is not None and job.cancelled,
+            ):
+                fn(user_id, alignment, data, record_id=record_id, job=job)
+        except alignment_lock.AlignmentBusy:
+            # only a cancelled job stops waiting for the lock
+            if not (job and job.cancelled):
+                raise
+        if job and job.cancelled:
+            state = AlignmentJobState.CANCELLED
+        else:
+            state = AlignmentJobState.DONE
+    finally:
+        job_store.finish_job(record_id, state)
+
+
+def submit_job(
+    db: Session,
+    user_id: int,
+    alignment: Alignment,
+    kind: str,
+    priority: int,
+    tasks: int,
+    data,
+):
+    record = job_store.create_job(
+        db, alignment.id, user_id, kind, priority, tasks, data.model_dump()
+    )
+    return scheduler.submit(
+        user_id,
+        alignment.guid,
+        kind,
+        priority,
+        tasks,
+        run_job,
+        (kind, user_id, AlignmentInfo.from_orm(alignment), data, record.id),
+    )
+
+
+def recover_jobs() -> int:
+    """Resubmit jobs interrupted by a restart, finished batches are skipped."""
+    db = SessionLocal()
+    resumed = 0
+    try:
+        for record in job_store.get_unfinished_jobs(db):
+            alignment = db.get(Alignment, record.alignment_id)
+            if alignment is None or alignment.is_deleted or record.kind not in JOB_KINDS:
+                record.state = AlignmentJobState.CANCELLED
+                db.commit()
+                continue
+
+            remaining = job_store.remaining_batches(record)
+            if remaining == []:
+                # interrupted after its last batch, only the final state is missing
+                record.state = AlignmentJobState.DONE
+                db.commit()
+                ProgressWriter(alignment.id, alignment.guid).finish()
+                continue
+
+            _, schema = JOB_KINDS[record.kind]
+            scheduler.submit(
+                record.user_id,
+                alignment.guid,
+                record.kind,
+                record.priority,
+                record.tasks if remaining is None else len(remaining),
+                run_job,
+                (
+                    record.kind,
+                    record.user_id,
+                    AlignmentInfo.from_orm(alignment),
+                    schema.model_validate(record.params),
+                    record.id,
+                ),
+            )
+            resumed += 1
+            logger.info(
+                "Resuming %s job %d of alignment %s, %s batch(es) left",
+                record.kind,
+                record.id,
+                alignment.guid,
+                "all" if remaining is None else len(remaining),
+            )
+    finally:
+        db.close()
+    return resumed
 
 
 def stop_alignment(db: Session, alignment: Alignment) -> None:
+    """Cancel the alignment's jobs, batches finished so far are kept."""
+    scheduler.cancel(alignment.guid)
+    job_store.cancel_jobs(db, alignment.id)
     alignment.state = AlignmentState.IN_PROGRESS_DONE
     db.commit()
+    bus.publish(
+        alignment.guid,
+        progress_event(
+            alignment.guid,
+            alignment.state,
+            alignment.curr_batches,
+            alignment.total_batches,
+        ),
+    )
 
 
 def get_conflicts(user_id: int, alignment: Alignment, handle_edges: str) -> dict:
-    from lingtrain_aligner import resolver
-
     db_path = str(
         get_alignment_db_path(user_id, alignment.lang_from, alignment.lang_to, alignment.guid)
     )
@@ -671,20 +963,8 @@ def get_conflicts(user_id: int, alignment: Alignment, handle_edges: str) -> dict
     handle_start = handle_edges in ("start", "both")
     handle_finish = handle_edges in ("finish", "both")
 
-    conflicts, rest = resolver.get_all_conflicts(
-        db_path,
-        min_chain_length=2,
-        max_conflicts_len=20,
-        batch_id=-1,
-        handle_start=handle_start,
-        handle_finish=handle_finish,
-    )
-    stat1 = resolver.get_statistics(conflicts, print_stat=False)
-    stat2 = resolver.get_statistics(rest, print_stat=False)
-    res = [(x, stat1[x]) for x in stat1]
-    res.extend([(x, stat2[x]) for x in stat2])
-    res.sort(key=lambda x: x[1], reverse=True)
-    return {"items": res}
+    index = conflict_cache.get(db_path, handle_start, handle_finish)
+    return {"items": index.items}
 
 
 def show_conflict(
@@ -699,15 +979,7 @@ def show_conflict(
     handle_start = handle_edges in ("start", "both")
     handle_finish = handle_edges in ("finish", "both")
 
-    conflicts, rest = resolver.get_all_conflicts(
-        db_path,
-        min_chain_length=2,
-        max_conflicts_len=20,
-        batch_id=-1,
-        handle_start=handle_start,
-        handle_finish=handle_finish,
-    )
-    conflicts.extend(rest)
+    conflicts = conflict_cache.get(db_path, handle_start, handle_finish).conflicts
     if not conflicts:
         return {"from": [], "to": []}
 
@@ -722,7 +994,6 @@ def update_visualization(
     user_id: int, alignment: Alignment, batch_ids: list[int], update_all: bool
 ) -> None:
     from lingtrain_aligner import vis_helper
-    from app.services.file_storage import get_vis_img_path
 
     db_path = str(
         get_alignment_db_path(user_id, alignment.lang_from, alignment.lang_to, alignment.guid)
@@ -738,13 +1009,15 @@ def update_visualization(
     if not batch_ids:
         return
 
-    vis_helper.visualize_alignment_by_db(
-        db_path,
-        res_img_best,
-        lang_name_from=alignment.lang_from,
-        lang_name_to=alignment.lang_to,
-        batch_ids=batch_ids,
-        transparent_bg=True,
-        show_info=True,
-        show_regression=False,
-    )
+    doc_index_store.materialize_path(db_path)
+    with _vis_lock:
+        vis_helper.visualize_alignment_by_db(
+            db_path,
+            res_img_best,
+            lang_name_from=alignment.lang_from,
+            lang_name_to=alignment.lang_to,
+            batch_ids=batch_ids,
+            transparent_bg=True,
+            show_info=True,
+            show_regression=False,
+        )
@@ -0,0 +1,63 @@
+"""Progress bus - in-process publish/subscribe for alignment progress events"""
+
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Event queue of one streaming client, bound to its event loop."""
+
+    def __init__(self, guid: str, loop: asyncio.AbstractEventLoop):
+        self.guid = guid
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+
+class ProgressBus:
+    """Delivers progress events from job threads to streaming clients."""
+
+    def __init__(self):
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, guid: str) -> Subscription:
+        sub = Subscription(guid, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(guid, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.guid)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.guid]
+
+    def publish(self, guid: str, event: dict) -> None:
+        """Thread-safe, never blocks the publishing job."""
+        with self._lock:
+            subs = list(self._subscribers.get(guid, ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub.queue.put_nowait, event)
+            except RuntimeError:
+                # event loop of a disconnected client is already closed
+                self.unsubscribe(sub)
+
+
+def progress_event(
+    guid: str, state: int, curr_batches: int, total_batches: int
+) -> dict:
+    return {
+        "guid": guid,
+        "state": int(state),
+        "curr_batches": curr_batches,
+        "total_batches": total_batches,
+    }
+
+
+bus = ProgressBus()
@@ -0,0 +1,211 @@
+"""Quantized model - int8 CPU backend for the sentence embedding model"""
+
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+import time
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+BACKEND_TORCH = "torch"
+BACKEND_TORCH_INT8 = "torch-int8"
+BACKENDS = (BACKEND_TORCH, BACKEND_TORCH_INT8)
+
+# where lingtrain_aligner and sentence_transformers keep the float models
+HUB_CACHE_DIR = "./models_cache"
+_LINGTRAIN_MODELS = {
+    "sentence_transformer_multilingual": (
+        "SENTENCE_TRANSFORMERS_MODEL_PATH",
+        "distiluse-base-multilingual-cased-v2",
+    ),
+    "sentence_transformer_multilingual_xlm_100": (
+        "SENTENCE_TRANSFORMERS_XLM_100_MODEL_PATH",
+        "xlm-r-100langs-bert-base-nli-mean-tokens",
+    ),
+    "sentence_transformer_multilingual_labse": (
+        "SENTENCE_TRANSFORMERS_LABSE_MODEL_PATH",
+        "LaBSE",
+    ),
+}
+
+_MISSING = object()
+
+PARITY_LINES = [
+    "The old man was thin and gaunt with deep wrinkles in the back of his neck.",
+    "Старик был худ и измождён, затылок его прорезали глубокие морщины.",
+    "Der alte Mann war dünn und hager, mit tiefen Falten im Nacken.",
+    "Le vieil homme était maigre et sec, avec des rides profondes sur la nuque.",
+    "El viejo era flaco y desgarbado, con arrugas profundas en la nuca.",
+    "老人消瘦而憔悴，脖颈上有深深的皱纹。",
+    "Chapter 1",
+    "Yes.",
+]
+
+
+def load_quantized(model_name: str):
+    """Int8 copy of a SentenceTransformer model, None to use the float model.
+
+    The first worker quantizes the float model and checks it against it on
+    ``PARITY_LINES``. The int8 model and the check result are saved in
+    ``ALIGNER_BACKEND_CACHE_DIR`` by model name, revision of the float
+    weights and torch version, later starts load them and do not touch the
+    float model. The whole module is saved, a quantized ``state_dict`` only
+    loads into a model that was quantized again.
+    """
+    os.makedirs(config.ALIGNER_BACKEND_CACHE_DIR, exist_ok=True)
+    cached = _load_cached(model_name, _cache_stem(model_name))
+    if cached is not _MISSING:
+        return cached
+
+    float_model, owner = _load_float(model_name)
+    if float_model is None:
+        logger.warning(
+            "Model %s is not a SentenceTransformer, int8 backend is not available",
+            model_name,
+        )
+        return None
+
+    # the hub revision is known once the float model is downloaded
+    stem = _cache_stem(model_name)
+    lock_fd = os.open(f"{stem}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        # one worker quantizes, the others wait and load its copy
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        cached = _load_cached(model_name, stem)
+        if cached is _MISSING:
+            cached = _quantize(model_name, float_model, stem)
+    finally:
+        os.close(lock_fd)
+
+    # the int8 model is a copy, the float weights are not needed anymore
+    if cached is not None and owner is not None:
+        delattr(owner, "_lazy_model")
+    return cached
+
+
+def _quantize(model_name: str, float_model, stem: str):
+    import numpy as np
+    import torch
+
+    started = time.time()
+    model = torch.ao.quantization.quantize_dynamic(
+        float_model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    ref = float_model.encode(PARITY_LINES, normalize_embeddings=True)
+    got = model.encode(PARITY_LINES, normalize_embeddings=True)
+    meta = {
+        "model": model_name,
+        "torch": torch.__version__,
+        "min_cosine": float(np.min(np.sum(ref * got, axis=1))),
+        "created_at": time.time(),
+    }
+    logger.info(
+        "Int8 %s parity cosine %.4f on %d lines",
+        model_name,
+        meta["min_cosine"],
+        len(PARITY_LINES),
+    )
+    if meta["min_cosine"] < config.ALIGNER_BACKEND_MIN_COSINE:
+        _write_meta(f"{stem}.json", meta)
+        logger.warning("Int8 %s failed the parity check, using float model", model_name)
+        return None
+
+    tmp_path = f"{stem}.pt.{os.getpid()}.tmp"
+    torch.save(model, tmp_path)
+    os.replace(tmp_path, f"{stem}.pt")
+    _write_meta(f"{stem}.json", meta)
+    logger.info("Int8 %s quantized in %.1fs", model_name, time.time() - started)
+    return model
+
+
+def _load_cached(model_name: str, stem: str):
+    """Saved int8 model, None if it failed the parity check, ``_MISSING``
+    if there is nothing saved for this revision and torch version."""
+    import torch
+
+    meta = _read_meta(f"{stem}.json")
+    if meta is None:
+        return _MISSING
+    if meta["min_cosine"] < config.ALIGNER_BACKEND_MIN_COSINE:
+        logger.warning(
+            "Int8 %s failed the parity check (cosine %.4f), using float model",
+            model_name,
+            meta["min_cosine"],
+        )
+        return None
+    try:
+        model = torch.load(f"{stem}.pt", map_location="cpu", weights_only=False)
+    except Exception as e:
+        logger.warning(f"Can not load {stem}.pt: {e}")
+        return _MISSING
+    logger.info("Int8 %s loaded from %s.pt", model_name, stem)
+    return model
+
+
+def _cache_stem(model_name: str) -> str:
+    import torch
+
+    safe = re.sub(r"[^\w.-]", "_", f"{model_name}-{_revision(model_name)}")
+    return os.path.join(
+        config.ALIGNER_BACKEND_CACHE_DIR, f"{safe}-torch{torch.__version__}"
+    )
+
+
+def _revision(model_name: str) -> str:
+    """Revision of the float weights, without loading them.
+
+    A model saved for lingtrain_aligner is known by its file size and
+    mtime, a hub model by the commit its cache folder points to.
+    """
+    from lingtrain_aligner import sentence_transformers_models
+
+    path_attr, hub_name = _LINGTRAIN_MODELS.get(model_name, (None, model_name))
+    path = getattr(sentence_transformers_models, path_attr or "", None)
+    if path and os.path.isfile(path):
+        stat = os.stat(path)
+        return f"{stat.st_size}-{int(stat.st_mtime)}"
+    suffix = "--" + hub_name.replace("/", "--")
+    refs = sorted(glob.glob(os.path.join(HUB_CACHE_DIR, "models--*", "refs", "main")))
+    for ref in refs:
+        if ref.split(os.sep)[-3].endswith(suffix):
+            with open(ref, encoding="utf-8") as f:
+                return f.read().strip()[:12]
+    return "unknown"
+
+
+def _load_float(model_name: str):
+    """Float SentenceTransformer and the lingtrain_aligner entry owning it."""
+    from lingtrain_aligner import model_dispatcher
+    from sentence_transformers import SentenceTransformer
+
+    if model_name in model_dispatcher.models:
+        owner = model_dispatcher.models[model_name]
+        model = owner.model
+        if not isinstance(model, SentenceTransformer):
+            return None, None
+        return model, owner
+    # same as aligner.get_line_vectors does for custom model names
+    return SentenceTransformer(model_name, cache_folder=HUB_CACHE_DIR), None
+
+
+def _read_meta(meta_path: str) -> dict | None:
+    if not os.path.isfile(meta_path):
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Can not read {meta_path}: {e}")
+        return None
+
+
+def _write_meta(meta_path: str, meta: dict) -> None:
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
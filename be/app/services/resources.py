@@ -0,0 +1,188 @@
+"""Resources - CPU and memory sizing of the alignment worker pool"""
+
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+AUTO = "auto"
+# a worker gets at least this many threads in auto mode, transformer
+# inference scales well up to a few threads per process
+AUTO_MIN_THREADS = 2
+# part of the available memory the workers may take
+MEMORY_SHARE = 0.8
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+@dataclass
+class WorkerLayout:
+    """Worker count, compute threads per worker and their CPU sets."""
+
+    workers: int
+    threads: int
+    cpus: list[list[int]] = field(default_factory=list)
+    host_cpus: int = 0
+    host_memory_mb: int | None = None
+    mode: str = "config"
+
+    @property
+    def pinned(self) -> bool:
+        return bool(self.cpus)
+
+    def worker_cpus(self, worker_id: int) -> list[int] | None:
+        return self.cpus[worker_id] if worker_id < len(self.cpus) else None
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "pinned": self.pinned}
+
+    def describe(self) -> str:
+        text = (
+            f"{self.workers} worker(s) x {self.threads} thread(s) on "
+            f"{self.host_cpus} CPU(s), {self.mode}"
+        )
+        if self.host_memory_mb is not None:
+            text += f", {self.host_memory_mb} MB available"
+        if self.pinned:
+            text += ", pinned " + " ".join(
+                f"{cpus[0]}-{cpus[-1]}" if len(cpus) > 1 else str(cpus[0])
+                for cpus in self.cpus
+            )
+        return text
+
+
+def available_cpus() -> list[int]:
+    """CPUs this process may run on, limited by a cgroup CPU quota."""
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = list(range(os.cpu_count() or 1))
+
+    quota = _read_first("/sys/fs/cgroup/cpu.max")
+    if quota and not quota.startswith("max"):
+        limit, period = quota.split()[:2]
+        cpus = cpus[: max(1, int(limit) // int(period))]
+    return cpus
+
+
+def available_memory_mb() -> int | None:
+    """Available memory, limited by a cgroup memory limit."""
+    available = None
+    meminfo = _read_first("/proc/meminfo", whole=True)
+    if meminfo:
+        for line in meminfo.splitlines():
+            if line.startswith("MemAvailable:"):
+                available = int(line.split()[1]) // 1024
+                break
+
+    limit = _read_first("/sys/fs/cgroup/memory.max")
+    if limit and limit.isdigit():
+        used = _read_first("/sys/fs/cgroup/memory.current")
+        free = (int(limit) - int(used or 0)) // (1024 * 1024)
+        available = free if available is None else min(available, free)
+    return available
+
+
+def plan_layout(
+    processors: str = config.ALIGNER_PROCESSORS,
+    threads: str = config.ALIGNER_WORKER_THREADS,
+    pin: bool = config.ALIGNER_PIN_WORKERS,
+    worker_memory_mb: int = config.ALIGNER_WORKER_MEMORY_MB,
+) -> WorkerLayout:
+    """Split the host between workers.
+
+    ``processors`` and ``threads`` are numbers or ``"auto"``, anything else
+    is taken as ``"auto"`` with a warning. In auto mode
+    the worker count is bounded by memory (``worker_memory_mb`` per model
+    copy) and by ``AUTO_MIN_THREADS`` per worker, the CPUs left are shared
+    as threads. Workers are pinned to disjoint CPU sets when they fit.
+    """
+    cpus = available_cpus()
+    memory_mb = available_memory_mb()
+    workers = _parse_count("LINGTRAIN_ALIGNER_PROCESSORS", processors)
+    worker_threads = _parse_count("LINGTRAIN_ALIGNER_WORKER_THREADS", threads)
+    auto_workers = workers is None
+    auto_threads = worker_threads is None
+
+    if auto_workers:
+        by_cpu = len(cpus) // (AUTO_MIN_THREADS if auto_threads else worker_threads)
+        workers = max(1, by_cpu)
+        if memory_mb is not None and worker_memory_mb > 0:
+            by_memory = int(memory_mb * MEMORY_SHARE) // worker_memory_mb
+            workers = min(workers, max(1, by_memory))
+    if auto_threads:
+        worker_threads = max(1, len(cpus) // workers)
+
+    layout = WorkerLayout(
+        workers=workers,
+        threads=worker_threads,
+        host_cpus=len(cpus),
+        host_memory_mb=memory_mb,
+        mode=AUTO if auto_workers or auto_threads else "config",
+    )
+    if workers * worker_threads > len(cpus):
+        logger.warning(
+            "%d worker(s) x %d thread(s) oversubscribe %d CPU(s)",
+            workers,
+            worker_threads,
+            len(cpus),
+        )
+    elif pin:
+        layout.cpus = [
+            cpus[i * worker_threads : (i + 1) * worker_threads] for i in range(workers)
+        ]
+    return layout
+
+
+def apply_worker_layout(layout: WorkerLayout, worker_id: int) -> None:
+    """Limit the compute threads of the calling worker and pin it."""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(layout.threads)
+
+    import torch
+
+    torch.set_num_threads(layout.threads)
+    try:
+        # numpy BLAS pools may already exist in a forked worker
+        from threadpoolctl import threadpool_limits
+
+        threadpool_limits(layout.threads)
+    except ImportError:
+        pass
+
+    cpus = layout.worker_cpus(worker_id)
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Worker {worker_id} can not be pinned to {cpus}: {e}")
+
+
+def _parse_count(name: str, value) -> int | None:
+    """Positive count of a setting, None for ``"auto"`` or a bad value."""
+    text = str(value).strip().lower()
+    if text == AUTO:
+        return None
+    try:
+        return max(1, int(text))
+    except ValueError:
+        logger.warning(f"{name}={value!r} is not a number, using {AUTO}")
+        return None
+
+
+def _read_first(path: str, whole: bool = False) -> str | None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read() if whole else f.readline().strip()
+    except OSError:
+        return None
+
+
+layout = plan_layout()
@@ -0,0 +1,281 @@
+"""Job scheduler - fair sharing of alignment workers between users"""
+
+import enum
+import itertools
+import logging
+import threading
+import time
+
+from app import config
+from app.services.resources import layout
+
+logger = logging.getLogger(__name__)
+
+ETA_SMOOTHING = 0.3
+DEFAULT_TASK_SECONDS = 10.0
+
+
+class JobPriority(enum.IntEnum):
+    INTERACTIVE = 0
+    NORMAL = 1
+    BULK = 2
+
+
+class JobState(enum.IntEnum):
+    QUEUED = 0
+    RUNNING = 1
+    FINISHED = 2
+    CANCELLED = 3
+
+
+class Job:
+    """Background alignment job.
+
+    ``slots`` is the number of batches the job may keep in the worker pool at
+    once. It is granted by the scheduler and changes while the job runs as
+    other jobs start and finish. ``cancel`` asks a running job to stop
+    feeding new batches, the job function checks ``cancelled``.
+    """
+
+    def __init__(
+        self,
+        job_id: int,
+        user_id: int,
+        alignment_guid: str,
+        kind: str,
+        priority: int,
+        tasks: int,
+        fn,
+        args: tuple,
+    ):
+        self.id = job_id
+        self.user_id = user_id
+        self.alignment_guid = alignment_guid
+        self.kind = kind
+        self.priority = priority
+        self.tasks = max(1, tasks)
+        self.done_tasks = 0
+        self.fn = fn
+        self.args = args
+        self.state = JobState.QUEUED
+        self.slots = 0
+        self.submitted_at = time.time()
+        self.started_at = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+
+    @property
+    def remaining_tasks(self) -> int:
+        return max(0, self.tasks - self.done_tasks)
+
+    def task_done(self) -> None:
+        self.done_tasks += 1
+
+
+class JobScheduler:
+    """Runs alignment jobs under a global worker slot budget.
+
+    Queued jobs are started by priority, then by how many jobs their user
+    already runs, then in submission order. A user never runs more than
+    ``user_max_jobs`` jobs at once, and the slots of all running jobs never
+    exceed ``total_slots``. A job stays queued while another job of its
+    alignment runs.
+    """
+
+    def __init__(self, total_slots: int, user_max_jobs: int):
+        self.total_slots = max(1, total_slots)
+        self.user_max_jobs = max(1, user_max_jobs)
+        self._queued: list[Job] = []
+        self._running: list[Job] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._task_seconds = DEFAULT_TASK_SECONDS
+
+    def submit(
+        self,
+        user_id: int,
+        alignment_guid: str,
+        kind: str,
+        priority: int,
+        tasks: int,
+        fn,
+        args: tuple,
+    ) -> Job:
+        """Queue ``fn(*args, job=job)`` to run in a background thread."""
+        with self._lock:
+            job = Job(
+                next(self._ids),
+                user_id,
+                alignment_guid,
+                kind,
+                priority,
+                tasks,
+                fn,
+                args,
+            )
+            self._queued.append(job)
+            logger.info(
+                "Job %d queued: %s %s, user=%d, priority=%d, tasks=%d",
+                job.id,
+                kind,
+                alignment_guid,
+                user_id,
+                priority,
+                job.tasks,
+            )
+            self._schedule()
+        return job
+
+    def cancel(self, alignment_guid: str) -> int:
+        """Drop queued jobs of the alignment and signal its running ones."""
+        with self._lock:
+            jobs = [j for j in self._queued if j.alignment_guid == alignment_guid]
+            for job in jobs:
+                self._queued.remove(job)
+                job.cancel()
+                job.state = JobState.CANCELLED
+            running = [j for j in self._running if j.alignment_guid == alignment_guid]
+            for job in running:
+                job.cancel()
+            jobs.extend(running)
+        for job in jobs:
+            logger.info("Job %d cancelled: %s %s", job.id, job.kind, alignment_guid)
+        return len(jobs)
+
+    def queue_info(self, alignment_guid: str) -> dict:
+        """Queue position (0 when running) and ETA of the alignment's job."""
+        with self._lock:
+            running = [j for j in self._running if j.alignment_guid == alignment_guid]
+            if running:
+                job = running[0]
+                eta = job.remaining_tasks * self._task_seconds / max(1, job.slots)
+                return {"queue_position": 0, "eta_seconds": round(eta, 1)}
+
+            ordered = self._ordered_queue()
+            for position, job in enumerate(ordered, start=1):
+                if job.alignment_guid != alignment_guid:
+                    continue
+                backlog = sum(j.remaining_tasks for j in self._running)
+                backlog += sum(j.tasks for j in ordered[:position])
+                eta = backlog * self._task_seconds / self.total_slots
+                return {"queue_position": position, "eta_seconds": round(eta, 1)}
+        return {"queue_position": None, "eta_seconds": None}
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "total_slots": self.total_slots,
+                "user_max_jobs": self.user_max_jobs,
+                "task_seconds": round(self._task_seconds, 2),
+                "running": [_job_info(j) for j in self._running],
+                "queued": [_job_info(j) for j in self._ordered_queue()],
+            }
+
+    def _ordered_queue(self) -> list[Job]:
+        per_user = self._running_per_user()
+        return sorted(
+            self._queued,
+            key=lambda j: (j.priority, per_user.get(j.user_id, 0), j.id),
+        )
+
+    def _running_per_user(self) -> dict[int, int]:
+        res = {}
+        for j in self._running:
+            res[j.user_id] = res.get(j.user_id, 0) + 1
+        return res
+
+    def _schedule(self) -> None:
+        while len(self._running) < self.total_slots:
+            per_user = self._running_per_user()
+            # a second job of an alignment would only wait for its lock
+            busy = {j.alignment_guid for j in self._running}
+            candidates = [
+                j
+                for j in self._ordered_queue()
+                if per_user.get(j.user_id, 0) < self.user_max_jobs
+                and j.alignment_guid not in busy
+            ]
+            if not candidates:
+                break
+            job = candidates[0]
+            self._queued.remove(job)
+            self._running.append(job)
+            job.state = JobState.RUNNING
+            job.started_at = time.time()
+            self._rebalance()
+            logger.info(
+                "Job %d started after %.1fs in queue, slots=%d",
+                job.id,
+                job.started_at - job.submitted_at,
+                job.slots,
+            )
+            threading.Thread(
+                target=self._run, args=(job,), name=f"job-{job.id}", daemon=True
+            ).start()
+        self._rebalance()
+
+    def _rebalance(self) -> None:
+        """Split the slot budget between running jobs, urgent ones first."""
+        if not self._running:
+            return
+        ordered = sorted(self._running, key=lambda j: (j.priority, j.id))
+        for j in ordered:
+            j.slots = 1
+        free = self.total_slots - len(ordered)
+        while free > 0:
+            granted = False
+            for j in ordered:
+                if free > 0 and j.slots < j.remaining_tasks:
+                    j.slots += 1
+                    free -= 1
+                    granted = True
+            if not granted:
+                break
+
+    def _run(self, job: Job) -> None:
+        try:
+            job.fn(*job.args, job=job)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+        finally:
+            self._finish(job)
+
+    def _finish(self, job: Job) -> None:
+        with self._lock:
+            if job in self._running:
+                self._running.remove(job)
+            job.state = JobState.CANCELLED if job.cancelled else JobState.FINISHED
+            duration = time.time() - (job.started_at or job.submitted_at)
+            if job.done_tasks and not job.cancelled:
+                task_seconds = duration * max(1, job.slots) / job.done_tasks
+                self._task_seconds += ETA_SMOOTHING * (
+                    task_seconds - self._task_seconds
+                )
+            logger.info("Job %d finished in %.1fs", job.id, duration)
+            self._schedule()
+
+
+def _job_info(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "user_id": job.user_id,
+        "alignment_guid": job.alignment_guid,
+        "kind": job.kind,
+        "priority": job.priority,
+        "tasks": job.tasks,
+        "done_tasks": job.done_tasks,
+        "slots": job.slots,
+        "cancelled": job.cancelled,
+    }
+
+
+scheduler = JobScheduler(
+    config.ALIGNER_SCHEDULER_SLOTS or layout.workers,
+    config.ALIGNER_SCHEDULER_USER_JOBS,
+)
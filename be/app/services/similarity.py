@@ -0,0 +1,75 @@
+"""Similarity - banded cosine similarity of two sentence batches"""
+
+import numpy as np
+
+# rows are multiplied in blocks, a block covers only its part of the band
+BLOCK_ROWS = 256
+MIN_SIM = 0.01
+
+
+def band_limits(n_from: int, n_to: int, window: int):
+    """Column range ``[lo, hi)`` of every row inside the alignment window.
+
+    Same condition as ``aligner.get_sim_matrix``: a pair ``(i, j)`` is
+    compared when ``i - window < j * k < i + window``, ``k = n_from / n_to``.
+    """
+    k = n_from / n_to
+    scaled = np.arange(n_to) * k
+    rows = np.arange(n_from)
+    lo = np.searchsorted(scaled, rows - window, side="right")
+    hi = np.searchsorted(scaled, rows + window, side="left")
+    return lo, np.maximum(hi, lo)
+
+
+class BandedSimilarity:
+    """Similarities of the window band, ``n_from x width`` instead of
+    ``n_from x n_to``.
+
+    Row ``i`` keeps the columns ``lo[i]..hi[i]`` starting at position 0 of
+    ``band[i]``, values are cosine similarities clipped at 0.01 and stored
+    in float16. Products are computed in float32, numpy has no fast float16
+    matmul.
+    """
+
+    def __init__(self, vectors_from, vectors_to, window: int):
+        vectors_from = _normalized(vectors_from)
+        vectors_to = _normalized(vectors_to)
+        n_from, n_to = len(vectors_from), len(vectors_to)
+        self.shape = (n_from, n_to)
+        self.lo, self.hi = band_limits(n_from, n_to, window)
+        width = int((self.hi - self.lo).max()) if n_from else 0
+        self.band = np.zeros((n_from, width), dtype=np.float16)
+        self.best = np.zeros(n_from, dtype=np.int64)
+
+        offsets = np.arange(width)
+        for start in range(0, n_from, BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, n_from)
+            lo, hi = self.lo[start:end], self.hi[start:end]
+            col_start, col_end = int(lo.min()), int(hi.max())
+            if col_end <= col_start:
+                continue
+            block = vectors_from[start:end] @ vectors_to[col_start:col_end].T
+            cols = lo[:, None] + offsets[None, :]
+            inside = cols < hi[:, None]
+            values = np.take_along_axis(
+                block, np.minimum(cols, col_end - 1) - col_start, axis=1
+            )
+            values = np.where(inside, np.maximum(values, MIN_SIM), 0)
+            self.band[start:end] = values
+            # the best match is taken before rounding to float16, a row
+            # without columns gets 0 like the argmax of a zero row
+            self.best[start:end] = np.where(hi > lo, lo + values.argmax(1), 0)
+
+    def best_matrix(self):
+        """Dense 0/1 matrix of the best match per row, for the batch picture."""
+        matrix = np.zeros(self.shape, dtype=np.uint8)
+        matrix[np.arange(self.shape[0]), self.best] = 1
+        return matrix
+
+
+def _normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim != 2:
+        vectors = vectors.reshape(len(vectors), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
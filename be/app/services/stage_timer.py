@@ -0,0 +1,139 @@
+"""Stage timer - time spent in every stage of the alignment pipeline"""
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from app.database import SessionLocal
+from app.models.alignment_job_timing import JOB_STAGE, AlignmentJobTiming
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds, the last bucket takes everything above
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class StageTimer:
+    """Seconds per stage of one task, plain data to return from a worker."""
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+
+class JobTimings:
+    """Stage timings of one job, per batch and for the whole job.
+
+    Workers time their part of a batch and send it back with the result,
+    the stages run in the job thread are added to the same batch. Stages
+    that are not bound to a batch are kept under ``JOB_STAGE``.
+    """
+
+    def __init__(self, record_id: int | None = None):
+        self.record_id = record_id
+        self.batches: dict[int, dict[str, float]] = {}
+        self.started = time.perf_counter()
+
+    def add_batch(self, batch_id: int, stages: dict[str, float]) -> None:
+        batch = self.batches.setdefault(batch_id, {})
+        for name, seconds in stages.items():
+            batch[name] = batch.get(name, 0.0) + seconds
+            histograms.observe(name, seconds)
+
+    @contextmanager
+    def stage(self, name: str, batch_id: int = JOB_STAGE):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_batch(batch_id, {name: time.perf_counter() - started})
+
+    def totals(self) -> dict[str, dict]:
+        return summarize(
+            (name, seconds)
+            for stages in self.batches.values()
+            for name, seconds in stages.items()
+        )
+
+    def save(self) -> None:
+        """Log the totals and store the timings with the job record."""
+        self.add_batch(JOB_STAGE, {"total": time.perf_counter() - self.started})
+        logger.info(
+            "Job %s stages: %s",
+            self.record_id,
+            ", ".join(
+                f"{name} {x['total']:.2f}s" for name, x in self.totals().items()
+            ),
+        )
+        if not self.record_id:
+            return
+        db = SessionLocal()
+        try:
+            db.add_all(
+                AlignmentJobTiming(
+                    job_id=self.record_id, batch_id=batch_id, stage=name, seconds=seconds
+                )
+                for batch_id, stages in self.batches.items()
+                for name, seconds in stages.items()
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Can not save stage timings of job {self.record_id}: {e}")
+        finally:
+            db.close()
+
+
+class StageHistograms:
+    """Process-wide histograms of per-batch stage durations."""
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._stages: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = {"counts": [0] * (len(self.buckets) + 1), "count": 0, "sum": 0.0}
+                self._stages[name] = stage
+            stage["counts"][bisect.bisect_left(self.buckets, seconds)] += 1
+            stage["count"] += 1
+            stage["sum"] += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "stages": {
+                    name: {**stage, "counts": list(stage["counts"])}
+                    for name, stage in sorted(self._stages.items())
+                },
+            }
+
+
+def summarize(items) -> dict[str, dict]:
+    """Count, total and max seconds per stage of ``(stage, seconds)`` pairs."""
+    totals = {}
+    for name, seconds in items:
+        x = totals.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        x["count"] += 1
+        x["total"] += seconds
+        x["max"] = max(x["max"], seconds)
+    return dict(sorted(totals.items(), key=lambda x: -x[1]["total"]))
+
+
+histograms = StageHistograms()
@@ -0,0 +1,363 @@
+"""Worker pool - long-lived processes that keep the alignment model warm"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from multiprocessing import Array, Process, Queue
+
+from app import config
+from app.services.resources import WorkerLayout, apply_worker_layout, layout
+
+logger = logging.getLogger(__name__)
+
+STOP_WORKER = "stop_worker"
+MSG_STARTED = "started"
+MSG_DONE = "done"
+TASK_CANCELLED = "cancelled"
+
+HEALTH_CHECK_INTERVAL = 1.0
+CANCELLED_JOBS_SIZE = 64
+# warm flag of a worker that could not load the model and exited
+LOAD_FAILED = -1
+LOAD_RETRY_SECONDS = 30.0
+
+
+class TaskCancelled(Exception):
+    """Raised inside a task when its job was cancelled."""
+
+
+class WorkerContext:
+    """Per-process state handed to every task executed by a pool worker."""
+
+    def __init__(self, worker_id: int, model, cancelled_jobs):
+        self.worker_id = worker_id
+        self.model = model
+        self.job_id = None
+        self._cancelled_jobs = cancelled_jobs
+
+    def cancelled(self) -> bool:
+        return _is_cancelled(self._cancelled_jobs, self.job_id)
+
+    def check_cancelled(self) -> None:
+        """Stop the current task between steps if its job was cancelled."""
+        if self.cancelled():
+            raise TaskCancelled()
+
+
+def _is_cancelled(cancelled_jobs, job_id) -> bool:
+    return job_id is not None and job_id in cancelled_jobs[:]
+
+
+def _worker_main(
+    worker_id,
+    model_name,
+    tasks,
+    results,
+    warm_flags,
+    load_seconds,
+    cancelled_jobs,
+    layout,
+):
+    """Worker process loop: load the model once, then execute tasks."""
+    from app.services.embedding import EmbeddingModel
+
+    if layout is not None:
+        apply_worker_layout(layout, worker_id)
+    model = EmbeddingModel(model_name)
+    started = time.perf_counter()
+    try:
+        model.load()
+        load_seconds[worker_id] = time.perf_counter() - started
+        warm_flags[worker_id] = 1
+    except Exception as e:
+        # without the model every task would fail, the pool restarts the worker
+        logger.error(f"Worker {worker_id} failed to load model: {e}", exc_info=True)
+        warm_flags[worker_id] = LOAD_FAILED
+        return
+
+    ctx = WorkerContext(worker_id, model, cancelled_jobs)
+    while True:
+        item = tasks.get()
+        if item == STOP_WORKER:
+            break
+
+        job_id, task_index, fn, args = item
+        ctx.job_id = job_id
+        results.put((MSG_STARTED, worker_id, job_id, task_index))
+        try:
+            ctx.check_cancelled()
+            payload = fn(ctx, *args)
+            results.put((MSG_DONE, worker_id, job_id, task_index, True, payload))
+        except TaskCancelled:
+            results.put(
+                (MSG_DONE, worker_id, job_id, task_index, False, TASK_CANCELLED)
+            )
+        except Exception as e:
+            logger.error(f"Task failed: {e}", exc_info=True)
+            results.put((MSG_DONE, worker_id, job_id, task_index, False, None))
+
+
+class WorkerPool:
+    """App-lifetime pool of alignment workers shared by all alignment jobs.
+
+    Every worker loads the embedding model once at startup. Jobs open a
+    result channel with ``open_job``, push tasks with ``submit`` and read
+    ``(task_index, ok, payload)`` tuples back with ``get_result``. A task is
+    any picklable callable taking a ``WorkerContext`` as first argument.
+
+    ``cancel_job`` marks a job in a small ring shared with the workers. Its
+    queued tasks are skipped and running ones may stop early through
+    ``WorkerContext.check_cancelled``, both report ``TASK_CANCELLED``.
+
+    A worker that can not load the model exits, it is started again after
+    ``LOAD_RETRY_SECONDS``. While no worker has the model, queued tasks
+    fail instead of waiting.
+
+    With a ``WorkerLayout`` every worker limits its torch and BLAS threads
+    to ``layout.threads`` and is pinned to its CPU set.
+    """
+
+    def __init__(
+        self, size: int, model_name: str, layout: WorkerLayout | None = None
+    ):
+        self.size = max(1, size)
+        self.model_name = model_name
+        self.layout = layout
+        self._tasks = None
+        self._results = None
+        self._warm_flags = None
+        self._load_seconds = None
+        self._cancelled_jobs = None
+        self._cancelled_pos = 0
+        self._workers: dict[int, Process] = {}
+        self._load_failed: dict[int, float] = {}
+        self._in_flight: dict[int, tuple[int, int]] = {}
+        self._jobs: dict[int, queue.Queue] = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._dispatcher = None
+        self._running = False
+        self._started_at = None
+        self._last_health_check = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self._running
+
+    def start(self) -> None:
+        with self._lock:
+            if self._running:
+                return
+            self._tasks = Queue()
+            self._results = Queue()
+            self._warm_flags = Array("b", self.size)
+            self._load_seconds = Array("d", self.size)
+            self._cancelled_jobs = Array("q", CANCELLED_JOBS_SIZE)
+            for worker_id in range(self.size):
+                self._spawn(worker_id)
+            self._running = True
+            self._started_at = time.time()
+            self._dispatcher = threading.Thread(
+                target=self._dispatch, name="worker-pool-dispatcher", daemon=True
+            )
+            self._dispatcher.start()
+        logger.info(
+            "Worker pool started: %d worker(s), model=%s", self.size, self.model_name
+        )
+        if self.layout is not None:
+            logger.info("Worker layout: %s", self.layout.describe())
+
+    def stop(self, timeout: float = 10.0) -> None:
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            workers = list(self._workers.values())
+            for _ in workers:
+                self._tasks.put(STOP_WORKER)
+
+        for w in workers:
+            w.join(timeout)
+            if w.is_alive():
+                w.terminate()
+        if self._dispatcher:
+            self._dispatcher.join(timeout)
+        self._workers.clear()
+        self._load_failed.clear()
+        self._in_flight.clear()
+        logger.info("Worker pool stopped")
+
+    def open_job(self) -> int:
+        job_id = next(self._job_ids)
+        self._jobs[job_id] = queue.Queue()
+        return job_id
+
+    def close_job(self, job_id: int) -> None:
+        self._jobs.pop(job_id, None)
+
+    def cancel_job(self, job_id: int) -> None:
+        with self._lock:
+            if self._cancelled_jobs is None:
+                return
+            self._cancelled_jobs[self._cancelled_pos] = job_id
+            self._cancelled_pos = (self._cancelled_pos + 1) % CANCELLED_JOBS_SIZE
+
+    def submit(self, job_id: int, task_index: int, fn, *args) -> None:
+        if not self._running:
+            self.start()
+        self._tasks.put((job_id, task_index, fn, args))
+
+    def get_result(self, job_id: int, timeout: float | None = None):
+        """Block until the next task of the job finishes."""
+        return self._jobs[job_id].get(timeout=timeout)
+
+    def status(self) -> dict:
+        warm = list(self._warm_flags) if self._warm_flags else []
+        load_seconds = list(self._load_seconds) if self._load_seconds else []
+        workers = [
+            {
+                "worker_id": worker_id,
+                "pid": w.pid,
+                "alive": w.is_alive(),
+                "warm": worker_id < len(warm) and warm[worker_id] == 1,
+                "load_failed": worker_id in self._load_failed,
+                "busy": worker_id in self._in_flight,
+                "load_seconds": (
+                    load_seconds[worker_id] if worker_id < len(load_seconds) else 0
+                )
+                or None,
+                "cpus": self.layout.worker_cpus(worker_id) if self.layout else None,
+            }
+            for worker_id, w in sorted(self._workers.items())
+        ]
+        warm_count = sum(1 for w in workers if w["alive"] and w["warm"])
+        if not self._running:
+            state = "stopped"
+        elif warm_count == self.size:
+            state = "warm"
+        elif warm_count > 0:
+            state = "warming"
+        elif len(self._load_failed) == self.size:
+            state = "failed"
+        else:
+            state = "cold"
+        return {
+            "status": state,
+            "size": self.size,
+            "warm": warm_count,
+            "busy": len(self._in_flight),
+            "model": self.model_name,
+            "uptime": time.time() - self._started_at if self._started_at else 0,
+            "workers": workers,
+            "layout": self.layout.as_dict() if self.layout else None,
+        }
+
+    def _spawn(self, worker_id: int) -> None:
+        self._warm_flags[worker_id] = 0
+        self._load_seconds[worker_id] = 0
+        w = Process(
+            target=_worker_main,
+            args=(
+                worker_id,
+                self.model_name,
+                self._tasks,
+                self._results,
+                self._warm_flags,
+                self._load_seconds,
+                self._cancelled_jobs,
+                self.layout,
+            ),
+            name=f"aligner-worker-{worker_id}",
+            daemon=True,
+        )
+        w.start()
+        self._workers[worker_id] = w
+
+    def _deliver(self, job_id: int, task_index: int, ok: bool, payload) -> None:
+        job_queue = self._jobs.get(job_id)
+        if job_queue is None:
+            logger.warning("Dropping result of closed job %s", job_id)
+            return
+        job_queue.put((task_index, ok, payload))
+
+    def _dispatch(self) -> None:
+        while self._running:
+            try:
+                msg = self._results.get(timeout=HEALTH_CHECK_INTERVAL)
+            except queue.Empty:
+                msg = None
+
+            if msg is not None:
+                if msg[0] == MSG_STARTED:
+                    _, worker_id, job_id, task_index = msg
+                    self._in_flight[worker_id] = (job_id, task_index)
+                elif msg[0] == MSG_DONE:
+                    _, worker_id, job_id, task_index, ok, payload = msg
+                    self._in_flight.pop(worker_id, None)
+                    self._deliver(job_id, task_index, ok, payload)
+
+            if time.time() - self._last_health_check >= HEALTH_CHECK_INTERVAL:
+                self._last_health_check = time.time()
+                self._check_workers()
+
+    def _check_workers(self) -> None:
+        with self._lock:
+            if not self._running:
+                return
+            for worker_id, w in list(self._workers.items()):
+                if w.is_alive():
+                    continue
+                if self._warm_flags[worker_id] == LOAD_FAILED:
+                    self._retry_load(worker_id)
+                    continue
+                logger.error(
+                    "Worker %d (pid %s) died with exit code %s, restarting",
+                    worker_id,
+                    w.pid,
+                    w.exitcode,
+                )
+                lost = self._in_flight.pop(worker_id, None)
+                if lost:
+                    self._deliver(lost[0], lost[1], False, None)
+                self._spawn(worker_id)
+            if len(self._load_failed) == self.size:
+                self._fail_queued()
+
+    def _retry_load(self, worker_id: int) -> None:
+        failed_at = self._load_failed.get(worker_id)
+        if failed_at is None:
+            logger.error(
+                "Worker %d could not load model %s, retrying in %.0fs",
+                worker_id,
+                self.model_name,
+                LOAD_RETRY_SECONDS,
+            )
+            self._load_failed[worker_id] = time.time()
+        elif time.time() - failed_at >= LOAD_RETRY_SECONDS:
+            del self._load_failed[worker_id]
+            self._spawn(worker_id)
+
+    def _fail_queued(self) -> None:
+        """Fail the queued tasks while no worker has the model."""
+        failed = 0
+        while True:
+            try:
+                item = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+            if item == STOP_WORKER:
+                continue
+            job_id, task_index, _, _ = item
+            self._deliver(job_id, task_index, False, None)
+            failed += 1
+        if failed:
+            logger.error(
+                "No worker could load model %s, %d task(s) failed",
+                self.model_name,
+                failed,
+            )
+
+
+pool = WorkerPool(layout.workers, config.ALIGNER_MODEL, layout)
@@ -0,0 +1,272 @@
+"""Alignment benchmark - end to end timings of the processing pipeline
+
+Runs offline with the deterministic hashing model, from the ``be`` folder:
+
+    python -m benchmarks.alignment --lines 5000 --output bench.json
+
+Every round creates a fresh alignment of a synthetic corpus and times
+create_alignment, start_alignment, align_next, resolve_conflicts and the
+exports. The JSON result holds the commit, the parameters and the median
+of every stage, results of two commits can be compared with ``--compare``.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+STAGES = (
+    "create_alignment",
+    "start_alignment",
+    "align_next",
+    "resolve_conflicts",
+    "export_tmx",
+    "export_xml",
+    "export_json",
+    "export_txt",
+    "book_preview",
+    "book_download",
+)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=2000, help="source lines")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument(
+        "--warmup-rounds", type=int, default=1, help="untimed rounds run first"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default="hashing-256")
+    parser.add_argument("--workers", default="2", help='a number or "auto"')
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--window", type=int, default=50)
+    parser.add_argument("--next", type=int, default=2, help="batches for align_next")
+    parser.add_argument(
+        "--embed-cache", action="store_true", help="keep the embedding cache on"
+    )
+    parser.add_argument("--output", help="write the JSON result to this file")
+    parser.add_argument(
+        "--compare", help="JSON result of another run, print the stage ratios"
+    )
+    parser.add_argument("--keep", action="store_true", help="keep the work folder")
+    return parser.parse_args(argv)
+
+
+def configure(args, workdir):
+    """Point the app to the work folder, config is read on import."""
+    os.environ.update(
+        {
+            "LINGTRAIN_DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'app.db')}",
+            "LINGTRAIN_DATA_DIR": os.path.join(workdir, "data"),
+            "LINGTRAIN_STATIC_DIR": os.path.join(workdir, "static"),
+            "LINGTRAIN_ALIGNER_MODEL": args.model,
+            "LINGTRAIN_ALIGNER_PROCESSORS": str(args.workers),
+            "LINGTRAIN_ALIGNER_BATCH_SIZE": str(args.batch_size),
+            "LINGTRAIN_ALIGNER_MAX_BATCHES": "0",
+        }
+    )
+    if not args.embed_cache:
+        os.environ["LINGTRAIN_ALIGNER_EMBED_CACHE_SIZE_MB"] = "0"
+
+
+def run(args):
+    from app.database import Base, SessionLocal, engine
+    from app.models.user import User
+    from app.services import alignment_service, document_service, export_service
+    from app.services.file_storage import ensure_user_dirs, get_splitted_dir
+    from app.services.processing_service import (
+        AlignmentInfo,
+        align_next,
+        resolve_conflicts,
+        start_alignment,
+    )
+    from app.schemas.alignment import AlignNext, AlignStart, ResolveRequest
+    from app.services.worker_pool import pool
+
+    from benchmarks.corpus import make_corpus
+
+    Base.metadata.create_all(bind=engine)
+    lines_from, lines_to = make_corpus(args.lines, seed=args.seed)
+
+    db = SessionLocal()
+    user = User(username="bench", email="bench@example.com")
+    db.add(user)
+    db.commit()
+    docs = []
+    for lang, lines in (("en", lines_from), ("xx", lines_to)):
+        ensure_user_dirs(user.id, lang)
+        name = f"bench_{lang}.txt"
+        with open(get_splitted_dir(user.id, lang) / name, "w", encoding="utf8") as f:
+            f.write("\n".join(lines) + "\n")
+        docs.append(document_service.register_document(db, user.id, lang, name))
+
+    started = time.perf_counter()
+    pool.start()
+    while pool.status()["warm"] < pool.size:
+        if time.perf_counter() - started > 600:
+            raise RuntimeError("Worker pool did not warm up in 10 minutes")
+        time.sleep(0.1)
+    warmup = time.perf_counter() - started
+
+    timings = {stage: [] for stage in STAGES}
+    record = False
+
+    def timed(stage, fn, *fn_args, **fn_kwargs):
+        t = time.perf_counter()
+        result = fn(*fn_args, **fn_kwargs)
+        if record:
+            timings[stage].append(time.perf_counter() - t)
+        return result
+
+    total_batches = first = 0
+    try:
+        for round_id in range(args.warmup_rounds + args.rounds):
+            record = round_id >= args.warmup_rounds
+            alignment = timed(
+                "create_alignment",
+                alignment_service.create_alignment,
+                db,
+                user.id,
+                docs[0],
+                docs[1],
+                f"bench {round_id}",
+            )
+            total_batches = alignment.total_batches
+            info = AlignmentInfo.from_orm(alignment)
+            first = max(1, total_batches - args.next)
+            timed(
+                "start_alignment",
+                start_alignment,
+                user.id,
+                info,
+                AlignStart(batch_ids=list(range(first)), window=args.window),
+            )
+            timed(
+                "align_next",
+                align_next,
+                user.id,
+                info,
+                AlignNext(amount=min(5, max(1, args.next)), window=args.window),
+            )
+            timed(
+                "resolve_conflicts",
+                resolve_conflicts,
+                user.id,
+                info,
+                ResolveRequest(batch_ids=list(range(total_batches))),
+            )
+            db.refresh(alignment)
+            for file_format in ("tmx", "xml", "json", "txt"):
+                timed(
+                    f"export_{file_format}",
+                    export_service.download_processing,
+                    user.id,
+                    alignment,
+                    file_format,
+                )
+            timed("book_preview", export_service.get_book_preview, user.id, alignment)
+            timed("book_download", export_service.download_book, user.id, alignment)
+    finally:
+        pool.stop()
+        db.close()
+
+    stages = {}
+    for stage, values in timings.items():
+        if not values:
+            continue
+        stages[stage] = {
+            "median": statistics.median(values),
+            "min": min(values),
+            "max": max(values),
+            "runs": values,
+        }
+    if "start_alignment" in stages:
+        aligned = min(len(lines_from), first * args.batch_size)
+        stages["start_alignment"]["lines_per_second"] = (
+            aligned / stages["start_alignment"]["median"]
+        )
+    return {
+        "benchmark": "alignment",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "params": {
+            "lines_from": len(lines_from),
+            "lines_to": len(lines_to),
+            "batches": total_batches,
+            "rounds": args.rounds,
+            "warmup_rounds": args.warmup_rounds,
+            "seed": args.seed,
+            "model": args.model,
+            "workers": pool.size,
+            "batch_size": args.batch_size,
+            "window": args.window,
+            "embed_cache": args.embed_cache,
+        },
+        "warmup_seconds": warmup,
+        "stages": stages,
+    }
+
+
+def compare(result, other_path):
+    with open(other_path, encoding="utf-8") as f:
+        other = json.load(f)
+    print(f"{'stage':<20}{'base':>10}{'this':>10}{'ratio':>8}")
+    for stage in STAGES:
+        if stage not in result["stages"] or stage not in other["stages"]:
+            continue
+        base = other["stages"][stage]["median"]
+        this = result["stages"][stage]["median"]
+        ratio = this / base if base else float("inf")
+        print(f"{stage:<20}{base:>10.3f}{this:>10.3f}{ratio:>8.2f}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="lingtrain-bench-")
+    configure(args, workdir)
+    try:
+        # lingtrain_aligner prints its progress, keep stdout for the result
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run(args)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        compare(result, args.compare)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Synthetic corpus - reproducible parallel texts for the benchmarks"""
+
+import random
+
+SYLLABLES = (
+    "ka ri mo ten sa lu vi ne do pa ro mi ta ze bo li fa nu go se "
+    "ar el in os um ba de ki lo ma"
+).split()
+
+
+def make_corpus(
+    lines: int,
+    seed: int = 0,
+    vocabulary: int = 3000,
+    shared_words: float = 0.7,
+    merge_rate: float = 0.04,
+    split_rate: float = 0.04,
+    drop_rate: float = 0.01,
+) -> tuple[list[str], list[str]]:
+    """Source and target lines with the noise real books have.
+
+    Target words are a fixed dictionary translation of the source words,
+    ``shared_words`` of them stay the same (names, numbers, cognates), so a
+    hashing model still finds the pairs. Some source lines are merged,
+    split or dropped on the target side, the resolver gets conflicts to fix.
+    """
+    rng = random.Random(seed)
+    words = _vocabulary(rng, vocabulary)
+    translation = {
+        w: w if rng.random() < shared_words else _word(rng) for w in words
+    }
+    weights = [1 / (i + 1) for i in range(len(words))]
+
+    lines_from, lines_to = [], []
+    merged = None
+    for _ in range(lines):
+        size = rng.randint(4, 24)
+        sentence = rng.choices(words, weights, k=size)
+        line_from = " ".join(sentence).capitalize() + "."
+        line_to = " ".join(translation[w] for w in sentence).capitalize() + "."
+        lines_from.append(line_from)
+
+        if merged is not None:
+            lines_to.append(f"{merged} {line_to}")
+            merged = None
+            continue
+        roll = rng.random()
+        if roll < drop_rate:
+            continue
+        if roll < drop_rate + merge_rate:
+            merged = line_to
+            continue
+        if roll < drop_rate + merge_rate + split_rate and size > 8:
+            cut = line_to.find(" ", len(line_to) // 2)
+            lines_to.extend([line_to[:cut] + ".", line_to[cut + 1 :].capitalize()])
+            continue
+        lines_to.append(line_to)
+    if merged is not None:
+        lines_to.append(merged)
+    return lines_from, lines_to
+
+
+def _vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add(_word(rng))
+    return sorted(words)
+
+
+def _word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
@@ -1,4 +1,4 @@
-import { apiFetch, apiUpload } from './client'
+import { apiFetch, apiStream, apiUpload } from './client'
 
 export const AlignmentState = {
   INIT: 0,
@@ -26,6 +26,8 @@ export interface AlignmentOut {
   document_from_id: number
   document_to_id: number
   created_at: string
+  queue_position: number | null
+  eta_seconds: number | null
 }
 
 export interface AlignmentCreate {
@@ -156,3 +158,18 @@ export function uploadProxy(guid: string, direction: 'from' | 'to', file: File)
 export function getProgress(guid: string) {
   return apiFetch<AlignmentOut>(`/api/aligner/alignments/${guid}/progress`)
 }
+
+export type ProgressUpdate = Pick<AlignmentOut, 'guid' | 'state' | 'curr_batches' | 'total_batches'> &
+  Partial<AlignmentOut>
+
+export function streamProgress(
+  guid: string,
+  onUpdate: (update: ProgressUpdate) => void,
+  signal?: AbortSignal,
+) {
+  return apiStream(
+    `/api/aligner/alignments/${guid}/progress/stream`,
+    (data) => onUpdate(data as ProgressUpdate),
+    signal,
+  )
+}
@@ -88,3 +88,42 @@ export async function apiDownload(path: string, options: RequestInit = {}): Prom
 
   return res.blob()
 }
+
+export async function apiStream(
+  path: string,
+  onEvent: (data: unknown) => void,
+  signal?: AbortSignal,
+): Promise<void> {
+  const token = localStorage.getItem('token')
+
+  const headers: Record<string, string> = { Accept: 'text/event-stream' }
+
+  if (token) {
+    headers['Authorization'] = `Bearer ${token}`
+  }
+
+  const res = await fetch(`${BASE_URL}${path}`, { headers, signal })
+
+  if (!res.ok || !res.body) {
+    const body = await res.json().catch(() => ({ detail: res.statusText }))
+    throw new ApiError(res.status, body.detail ?? 'Unknown error', body)
+  }
+
+  const reader = res.body.pipeThrough(new TextDecoderStream()).getReader()
+  let buffer = ''
+  for (;;) {
+    const { value, done } = await reader.read()
+    if (done) return
+    buffer += value
+    const messages = buffer.split('\n\n')
+    buffer = messages.pop() ?? ''
+    for (const message of messages) {
+      const data = message
+        .split('\n')
+        .filter((line) => line.startsWith('data:'))
+        .map((line) => line.slice(5).trim())
+        .join('\n')
+      if (data) onEvent(JSON.parse(data))
+    }
+  }
+}
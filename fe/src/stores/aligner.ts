@@ -15,11 +15,13 @@ import {
   stopAlignment as apiStopAlignment,
   resolveConflicts as apiResolveConflicts,
   getProgress,
+  streamProgress,
   type AlignmentOut,
   type AlignmentCreate,
   type AlignStartParams,
   type AlignNextParams,
   type AlignmentStateValue,
+  type ProgressUpdate,
   type ResolveConflictsParams,
 } from '@/api/alignments'
 
@@ -31,6 +33,7 @@ export const useAlignerStore = defineStore('aligner', () => {
   const selectedAlignment = ref<AlignmentOut | null>(null)
   const loading = ref(false)
   const polling = ref<number | null>(null)
+  let progressStream: AbortController | null = null
 
   async function fetchDocuments(lang: string) {
     loading.value = true
@@ -100,8 +103,30 @@ export const useAlignerStore = defineStore('aligner', () => {
     await apiResolveConflicts(guid, data)
   }
 
+  function applyProgress(update: ProgressUpdate) {
+    if (selectedAlignment.value?.guid === update.guid) {
+      selectedAlignment.value = { ...selectedAlignment.value, ...update }
+    }
+    const idx = alignments.value.findIndex((a) => a.guid === update.guid)
+    if (idx !== -1) alignments.value[idx] = { ...alignments.value[idx], ...update }
+  }
+
+  // Progress is pushed by the server, interval polling is the fallback
   function startPolling(guid: string) {
     stopPolling()
+    const controller = new AbortController()
+    progressStream = controller
+    streamProgress(guid, applyProgress, controller.signal)
+      .catch(() => undefined)
+      .finally(() => {
+        if (progressStream === controller && !controller.signal.aborted) {
+          progressStream = null
+          startIntervalPolling(guid)
+        }
+      })
+  }
+
+  function startIntervalPolling(guid: string) {
     polling.value = window.setInterval(async () => {
       try {
         const updated = await getProgress(guid)
@@ -115,6 +140,10 @@ export const useAlignerStore = defineStore('aligner', () => {
   }
 
   function stopPolling() {
+    if (progressStream !== null) {
+      progressStream.abort()
+      progressStream = null
+    }
     if (polling.value !== null) {
       clearInterval(polling.value)
       polling.value = null